@@ -0,0 +1,120 @@
+# Inference backends: one predict(batch) interface over every model format
+#
+#   .h5 / .keras  -> Keras (needs TensorFlow)
+#   .tflite       -> LiteRT / tflite-runtime interpreter (falls back to TensorFlow)
+#   .onnx         -> ONNX Runtime
+#
+# Each runtime is imported only when a model of that format is loaded, so a
+# process serving a .tflite or .onnx artifact never imports TensorFlow.
+import os
+import threading
+
+import numpy as np
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, path, num_threads=None):
+        from keras.models import load_model
+        self.model = load_model(path)
+        self.input_shape = tuple(self.model.input_shape)
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+
+def _tflite_interpreter_class():
+    # Prefer the standalone runtimes; full TensorFlow only as a last resort
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        import tensorflow as tf
+        return tf.lite.Interpreter
+    except ImportError:
+        raise ImportError("Running .tflite models needs ai-edge-litert, tflite-runtime or tensorflow") from None
+
+
+def _quantize(batch, details):
+    scale, zero_point = details['quantization']
+    dtype = details['dtype']
+    if scale:
+        info = np.iinfo(dtype)
+        batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+    return np.ascontiguousarray(batch, dtype=dtype)
+
+
+def _dequantize(values, details):
+    scale, zero_point = details['quantization']
+    if scale:
+        return (values.astype(np.float32) - zero_point) * scale
+    return values.astype(np.float32)
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, path, num_threads=None):
+        interpreter_class = _tflite_interpreter_class()
+        self.interpreter = interpreter_class(model_path=path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(dim) for dim in self._input['shape'][1:])
+        self._batch_size = None
+        # An interpreter holds its tensors, so calls must not interleave
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self.interpreter.resize_tensor_input(self._input['index'], (len(batch),) + self.input_shape[1:])
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input['index'], _quantize(batch, self._input))
+            self.interpreter.invoke()
+            return _dequantize(self.interpreter.get_tensor(self._output['index']), self._output)
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("Running .onnx models needs onnxruntime") from None
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self.input_shape = (None,) + tuple(model_input.shape[1:])
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+BACKENDS = {
+    '.h5': KerasBackend,
+    '.keras': KerasBackend,
+    '.tflite': TFLiteBackend,
+    '.onnx': OnnxBackend,
+}
+
+
+def load_backend(path, num_threads=None):
+    """Load a model artifact with the backend matching its file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in BACKENDS:
+        raise ValueError(f"unsupported model format {extension!r} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[extension](path, num_threads=num_threads)
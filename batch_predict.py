@@ -0,0 +1,236 @@
+# Headless batch inference for folders of leaf images
+#
+#   python batch_predict.py "Test Image/" -o predictions.csv
+#   python batch_predict.py "survey/**/*.jpg" --batch-size 64 -o predictions.jsonl
+#   python batch_predict.py --manifest survey_files.txt -o predictions.csv
+#   python batch_predict.py survey/ --workers 8 --reduced-decode auto -o predictions.csv
+import argparse
+import csv
+import functools
+import glob
+import json
+import os
+import sys
+import time
+
+from inference import CLASS_NAMES, IMAGE_EXTENSIONS, IMAGE_SIZE, decode_image, predict_batch, preprocess
+from model_registry import DEFAULT_MODEL_PATH, get_model
+from preprocess_pipeline import PrefetchPipeline
+
+
+def is_image(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_image_paths(inputs, manifests=(), recursive=False):
+    """Yield image paths from directories, glob patterns, files and manifests.
+
+    A manifest is a text file with one image path per line; relative paths
+    are resolved against the manifest's directory, and blank lines and lines
+    starting with '#' are skipped.
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                for root, dirs, files in os.walk(item):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if is_image(name):
+                            yield os.path.join(root, name)
+            else:
+                for name in sorted(os.listdir(item)):
+                    path = os.path.join(item, name)
+                    if os.path.isfile(path) and is_image(name):
+                        yield path
+        elif os.path.isfile(item):
+            yield item
+        else:
+            for path in sorted(glob.iglob(item, recursive=True)):
+                if os.path.isfile(path) and is_image(path):
+                    yield path
+    for manifest in manifests:
+        base = os.path.dirname(manifest)
+        with open(manifest, encoding='utf-8') as lines:
+            for line in lines:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield os.path.join(base, line)
+
+
+def load_item(path, reduce=1, size=IMAGE_SIZE):
+    """Read, decode and resize one image to ``size``, timing each step."""
+    record = {'path': path, 'error': None}
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as image_file:
+            image = decode_image(image_file.read(), reduce)
+    except OSError as e:
+        image = None
+        record['error'] = str(e)
+    decoded = time.perf_counter()
+    record['decode_ms'] = (decoded - start) * 1000
+    if image is None:
+        record['error'] = record['error'] or 'could not decode image'
+        record['image'] = None
+        record['preprocess_ms'] = 0.0
+        return record
+    record['image'] = preprocess(image, size)
+    record['preprocess_ms'] = (time.perf_counter() - decoded) * 1000
+    return record
+
+
+def iter_batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def classify(model, batch):
+    """Fill in label, probabilities and predict time for one batch of records."""
+    ready = [record for record in batch if record['image'] is not None]
+    predict_ms = 0.0
+    if ready:
+        start = time.perf_counter()
+        probabilities = predict_batch(model, [record['image'] for record in ready])
+        # One predict call serves the whole batch; charge each image its share
+        predict_ms = (time.perf_counter() - start) * 1000 / len(ready)
+        for record, probs in zip(ready, probabilities):
+            best = int(probs.argmax())
+            record['label'] = model.labels[best]
+            record['confidence'] = float(probs[best])
+            record['unknown'] = not model.spec.is_confident(record['confidence'])
+            record['probabilities'] = {name: float(p) for name, p in zip(model.labels, probs)}
+    for record in batch:
+        record.pop('image', None)
+        record.setdefault('label', None)
+        record.setdefault('confidence', None)
+        record.setdefault('unknown', None)
+        record.setdefault('probabilities', {})
+        record['predict_ms'] = predict_ms if record['error'] is None else 0.0
+        record['total_ms'] = record['decode_ms'] + record['preprocess_ms'] + record['predict_ms']
+        for key in ('decode_ms', 'preprocess_ms', 'predict_ms', 'total_ms'):
+            record[key] = round(record[key], 3)
+    return batch
+
+
+class CsvWriter:
+    def __init__(self, stream, labels=CLASS_NAMES):
+        self.stream = stream
+        fields = ['path', 'label', 'confidence', 'unknown']
+        fields += [f'prob_{name}' for name in labels]
+        fields += ['decode_ms', 'preprocess_ms', 'predict_ms', 'total_ms', 'error']
+        self.writer = csv.DictWriter(stream, fieldnames=fields, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, record):
+        row = dict(record)
+        for name, p in record['probabilities'].items():
+            row[f'prob_{name}'] = p
+        self.writer.writerow(row)
+
+
+class JsonlWriter:
+    def __init__(self, stream, labels=CLASS_NAMES):
+        # Each record names its own probabilities, so the labels are not needed
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonlWriter}
+
+
+def output_format(path, requested):
+    if requested:
+        return requested
+    if path and path.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def run(paths, model, writer, batch_size, stream=None, workers=0, prefetch=2,
+        processes=False, reduce=1):
+    """Classify ``paths`` in batches and write one row per image.
+
+    With ``workers`` > 0, images are decoded and resized on a worker pool
+    while the model is busy with the previous batch.
+
+    Returns (images written, failed images, wall-clock seconds).
+    """
+    load = functools.partial(load_item, reduce=reduce, size=model.input_size)
+    if workers > 0:
+        batches = PrefetchPipeline(paths, load, batch_size, workers, prefetch, processes)
+    else:
+        batches = iter_batches(map(load, paths), batch_size)
+    written = failed = 0
+    start = time.perf_counter()
+    for batch in batches:
+        for record in classify(model, batch):
+            writer.write(record)
+            written += 1
+            failed += record['error'] is not None
+        if stream is not None:
+            stream.flush()
+    return written, failed, time.perf_counter() - start
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Classify plant leaf images in batches.')
+    parser.add_argument('inputs', nargs='*', help='image files, directories or glob patterns')
+    parser.add_argument('-m', '--manifest', action='append', default=[],
+                        help='text file listing one image path per line (repeatable)')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='descend into sub-directories of directory inputs')
+    parser.add_argument('-b', '--batch-size', type=int, default=32,
+                        help='images per model.predict call (default: 32)')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        help='output format (default: from the output extension, else csv)')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='models.json name or model file')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='decode/resize workers running ahead of the model (default: 0, inline)')
+    parser.add_argument('--processes', action='store_true',
+                        help='use a process pool instead of threads for the workers')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='ready batches to buffer ahead of the model (default: 2)')
+    parser.add_argument('--reduced-decode', default='1', choices=['1', '2', '4', '8', 'auto'],
+                        help='decode JPEGs at 1/N scale; auto keeps at least 256x256 (default: 1)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.inputs and not args.manifest:
+        build_parser().error('give at least one input or --manifest')
+    if args.batch_size < 1:
+        build_parser().error('--batch-size must be at least 1')
+    if args.workers < 0 or args.prefetch < 1:
+        build_parser().error('--workers must be >= 0 and --prefetch >= 1')
+    reduce = args.reduced_decode if args.reduced_decode == 'auto' else int(args.reduced_decode)
+
+    model = get_model(args.model, warm_up=True)
+    paths = iter_image_paths(args.inputs, args.manifest, args.recursive)
+    fmt = output_format(args.output, args.format)
+
+    stream = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        written, failed, seconds = run(paths, model, WRITERS[fmt](stream, model.labels), args.batch_size, stream,
+                                       args.workers, args.prefetch, args.processes, reduce)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+    rate = written / seconds if seconds else 0.0
+    print(f"Classified {written - failed} image(s), {failed} failed, "
+          f"in {seconds:.2f} s ({rate:.1f} images/s)", file=sys.stderr)
+    return 1 if written == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+# Inference benchmarks: preprocessing, model and end-to-end latency
+#
+#   python benchmark.py                                   # full run, prints a table
+#   python benchmark.py --quick --json bench.json         # CI-sized run
+#   python benchmark.py --quick --baseline bench_baseline.json --threshold 0.25
+#
+# Times each stage of the upload-to-label path separately, on the images in
+# Test Image/ and on synthetic leaf photos at several camera resolutions:
+#
+#   decode/<source>          cv2.imdecode of the uploaded bytes
+#   decode_reduced/<source>  the same with reduced decoding ('auto')
+#   resize/<source>          cv2.resize to the model input
+#   predict/batch<N>         one model predict over N preprocessed images
+#   end_to_end/<source>      bytes -> decode -> resize -> predict -> label
+#   tta/<N>                  N test-time augmentations of one decoded image
+#                            built and predicted as one batch, then averaged
+#   tiled/<source>           bytes -> tiled analysis (tiling.py) -> label,
+#                            with --tiled
+#
+# --client-upload compares each source with what serve.py's upload page sends
+# (downscaled and re-encoded in the browser, emulated with downscale_jpeg):
+# bytes per upload, server decode time and how much the predictions change.
+# The test images are also upscaled to 3000x3000 camera-quality JPEGs, since
+# they are only 256x256 themselves.
+#
+# --cpus and --cpu-fraction rerun the benchmark in a child process pinned to
+# fewer cores and/or stopped part of the time (see edge.py), to estimate how
+# the edge profile fares on a slower CPU:
+#
+#   python benchmark.py --quick --model artifacts/plant_disease_model_int8.tflite --cpus 1 --cpu-fraction 0.25
+#
+# Every stage reports p50/p95/p99 latency and throughput; the report also
+# has the peak resident memory after each stage. With --baseline, stages
+# whose latency grew by more than --threshold (or a peak RSS that did) are
+# listed as regressions and the exit status is 1.
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from batch_predict import iter_image_paths
+from edge import THROTTLED_ENV, run_limited
+from inference import decode_image, label_of, predict_batch, preprocess, tta_summary, tta_variants
+from model_registry import DEFAULT_MODEL_PATH, get_model
+from tiling import decode_for_tiling, tile_grid, tile_summary
+from uploads import CLIENT_JPEG_QUALITY, CLIENT_MAX_SIDE, downscale_jpeg
+
+DEFAULT_RESOLUTIONS = '640x480,1280x960,2048x1536,4000x3000'
+DEFAULT_BATCH_SIZES = '1,2,4,8,16,32,64,128,256'
+DEFAULT_TTA_SIZES = '1,2,4,8,12'
+
+QUICK_RESOLUTIONS = '640x480,2048x1536'
+QUICK_BATCH_SIZES = '1,8,32'
+QUICK_TTA_SIZES = '1,8'
+
+
+def peak_rss_bytes():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def synthetic_jpeg(width, height, seed=0, quality=90):
+    """A leaf-coloured JPEG with enough texture to compress like a photo."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    image[..., 1] = np.maximum(image[..., 1], 120)
+    noise = rng.integers(-12, 13, image.shape, dtype=np.int16)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def load_sources(images, resolutions):
+    """{source name: list of encoded images}"""
+    sources = {}
+    test_images = []
+    for path in iter_image_paths([images]):
+        with open(path, 'rb') as image_file:
+            test_images.append(image_file.read())
+    if test_images:
+        sources['test_images'] = test_images
+    for resolution in resolutions:
+        width, height = (int(value) for value in resolution.split('x'))
+        sources[resolution] = [synthetic_jpeg(width, height, seed) for seed in range(3)]
+    return sources
+
+
+def time_calls(fn, inputs, repeats, warmup=2):
+    """Call ``fn`` on ``inputs`` round-robin; returns per-call seconds."""
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    seconds = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def summarize(seconds, items_per_call=1):
+    ms = np.array(seconds) * 1000
+    return {
+        'runs': len(seconds),
+        'items_per_call': items_per_call,
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'throughput_per_s': items_per_call * len(seconds) / float(np.sum(seconds)),
+    }
+
+
+def run(model, sources, batch_sizes, repeats, log=None, tta_sizes=(), tiled=False):
+    """Benchmark every stage; returns {stage: summary}."""
+    stages = {}
+
+    def resize(image):
+        return preprocess(image, model.input_size)
+
+    def record(name, seconds, items_per_call=1):
+        stages[name] = summarize(seconds, items_per_call)
+        stages[name]['peak_rss_mib'] = peak_rss_bytes() / 2 ** 20
+        if log:
+            print(f"{name}: p50 {stages[name]['p50_ms']:.2f} ms", file=log)
+
+    for name, encoded in sources.items():
+        record(f'decode/{name}', time_calls(decode_image, encoded, repeats))
+        record(f'decode_reduced/{name}',
+               time_calls(lambda data: decode_image(data, reduce='auto'), encoded, repeats))
+        decoded = [decode_image(data) for data in encoded]
+        record(f'resize/{name}', time_calls(resize, decoded, repeats))
+
+    images = [resize(decode_image(data)) for encoded in sources.values() for data in encoded]
+    for batch_size in batch_sizes:
+        batch = [images[i % len(images)] for i in range(batch_size)]
+        # Large batches are slow; fewer runs keep the total time reasonable
+        runs = max(3, repeats * 8 // max(batch_size, 8))
+        record(f'predict/batch{batch_size}', time_calls(lambda batch: predict_batch(model, batch), [batch], runs),
+               batch_size)
+
+    def end_to_end(data):
+        return label_of(predict_batch(model, [resize(decode_image(data))])[0], model.labels)
+
+    for name, encoded in sources.items():
+        record(f'end_to_end/{name}', time_calls(end_to_end, encoded, repeats))
+
+    decoded = [decode_image(data) for encoded in sources.values() for data in encoded]
+    for n in tta_sizes:
+        record(f'tta/{n}', time_calls(
+            lambda image: tta_summary(predict_batch(model, tta_variants(image, n, model.input_size))),
+            decoded, repeats))
+
+    def tiled_label(data):
+        probabilities, _ = tile_summary(tile_grid(decode_for_tiling(data), model))
+        return label_of(probabilities, model.labels)
+
+    if tiled:
+        for name, encoded in sources.items():
+            # Hundreds of tiles per large photo; a few runs are enough
+            record(f'tiled/{name}', time_calls(tiled_label, encoded, max(3, repeats // 5), warmup=1))
+    return stages
+
+
+def phone_photos(encoded, side=3000, quality=95):
+    """Small images upscaled to a phone camera's resolution and re-encoded, as stand-ins for real uploads."""
+    photos = []
+    for data in encoded:
+        image = cv2.resize(decode_image(data), (side, side), interpolation=cv2.INTER_CUBIC)
+        ok, photo = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        photos.append(photo.tobytes())
+    return photos
+
+
+def client_upload(model, sources, repeats, max_side=CLIENT_MAX_SIDE, quality=CLIENT_JPEG_QUALITY):
+    """{source: upload bytes, decode time and prediction changes, original vs downscaled on the client}"""
+    rows = {}
+    for name, encoded in sources.items():
+        client = [downscale_jpeg(data, max_side, quality) for data in encoded]
+        original = predict_batch(model, [preprocess(decode_image(data), model.input_size) for data in encoded])
+        downscaled = predict_batch(model, [preprocess(decode_image(data), model.input_size) for data in client])
+        rows[name] = {
+            'images': len(encoded),
+            'upload_bytes': float(np.mean([len(data) for data in encoded])),
+            'client_upload_bytes': float(np.mean([len(data) for data in client])),
+            'decode_ms': summarize(time_calls(decode_image, encoded, repeats))['p50_ms'],
+            'client_decode_ms': summarize(time_calls(decode_image, client, repeats))['p50_ms'],
+            'top1_agreement': float(np.mean(original.argmax(axis=1) == downscaled.argmax(axis=1))),
+            'max_probability_diff': float(np.abs(original - downscaled).max()),
+        }
+    return rows
+
+
+def print_client_upload(rows):
+    print(f"\n{'source':<22} {'upload kB':>10} {'client kB':>10} {'decode ms':>10} {'client ms':>10} "
+          f"{'top-1 same':>10} {'max dp':>7}")
+    for name, row in rows.items():
+        print(f"{name:<22} {row['upload_bytes'] / 1024:>10.1f} {row['client_upload_bytes'] / 1024:>10.1f} "
+              f"{row['decode_ms']:>10.2f} {row['client_decode_ms']:>10.2f} {row['top1_agreement']:>10.1%} "
+              f"{row['max_probability_diff']:>7.4f}")
+
+
+def compare(report, baseline, threshold=0.25, metric='p50_ms'):
+    """Rows of (stage, baseline, current, ratio, regressed) for stages in both reports."""
+    rows = []
+    for name, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if previous is None or not previous[metric]:
+            continue
+        ratio = current[metric] / previous[metric]
+        rows.append((name, previous[metric], current[metric], ratio, ratio > 1 + threshold))
+    if baseline.get('peak_rss_mib'):
+        ratio = report['peak_rss_mib'] / baseline['peak_rss_mib']
+        rows.append(('peak_rss_mib', baseline['peak_rss_mib'], report['peak_rss_mib'], ratio,
+                     ratio > 1 + threshold))
+    return rows
+
+
+def print_stages(stages):
+    print(f"{'stage':<32} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'items/s':>9} {'RSS MiB':>8}")
+    for name, row in stages.items():
+        print(f"{name:<32} {row['runs']:>5} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+              f"{row['p99_ms']:>9.2f} {row['throughput_per_s']:>9.1f} {row['peak_rss_mib']:>8.0f}")
+
+
+def print_comparison(rows, metric):
+    print(f"\n{'stage':<32} {'baseline':>9} {'current':>9} {'ratio':>6}   ({metric})")
+    for name, previous, current, ratio, regressed in rows:
+        print(f"{name:<32} {previous:>9.2f} {current:>9.2f} {ratio:>6.2f}{'  REGRESSION' if regressed else ''}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing, inference and the end-to-end path.')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='model file (default: $BHOOMI_MODEL)')
+    parser.add_argument('--images', default='Test Image', help='folder or glob of real images')
+    parser.add_argument('--resolutions', help=f'synthetic image sizes (default: {DEFAULT_RESOLUTIONS})')
+    parser.add_argument('--batch-sizes', help=f'predict batch sizes (default: {DEFAULT_BATCH_SIZES})')
+    parser.add_argument('--tta-sizes', help=f'test-time augmentation views (default: {DEFAULT_TTA_SIZES})')
+    parser.add_argument('--tiled', action='store_true', help='also time tiled analysis of every source')
+    parser.add_argument('--client-upload', action='store_true',
+                        help="compare uploads downscaled on the client, as by serve.py's upload page")
+    parser.add_argument('--cpus', type=int, help='run pinned to this many cores')
+    parser.add_argument('--cpu-fraction', type=float, default=1.0,
+                        help='run only this share of the time, to emulate a slower CPU (default: 1)')
+    parser.add_argument('--repeats', type=int, help='timed runs per stage (default: 30, quick: 10)')
+    parser.add_argument('--quick', action='store_true', help='fewer sizes and runs, for CI')
+    parser.add_argument('--json', dest='json_path', help='write the report to this JSON file')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown vs the baseline, as a fraction (default: 0.25)')
+    parser.add_argument('--metric', default='p50_ms', choices=('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'),
+                        help='latency compared against the baseline (default: p50_ms)')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not 0 < args.cpu_fraction <= 1:
+        parser.error('--cpu-fraction must be in (0, 1]')
+    if (args.cpus or args.cpu_fraction < 1) and not os.getenv(THROTTLED_ENV):
+        command = [sys.executable, os.path.abspath(__file__)] + (sys.argv[1:] if argv is None else argv)
+        return run_limited(command, args.cpus, args.cpu_fraction)
+    resolutions = args.resolutions or (QUICK_RESOLUTIONS if args.quick else DEFAULT_RESOLUTIONS)
+    batch_sizes = args.batch_sizes or (QUICK_BATCH_SIZES if args.quick else DEFAULT_BATCH_SIZES)
+    tta_sizes = args.tta_sizes or (QUICK_TTA_SIZES if args.quick else DEFAULT_TTA_SIZES)
+    repeats = args.repeats or (10 if args.quick else 30)
+
+    sources = load_sources(args.images, [value for value in resolutions.split(',') if value])
+    model = get_model(args.model, warm_up=True)
+    stages = run(model, sources, [int(value) for value in batch_sizes.split(',') if value], repeats,
+                 log=sys.stderr, tta_sizes=[int(value) for value in tta_sizes.split(',') if value],
+                 tiled=args.tiled)
+    report = {
+        'model': os.path.basename(args.model),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'cpus': args.cpus,
+        'cpu_fraction': args.cpu_fraction,
+        'opencv': cv2.__version__,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeats': repeats,
+        'peak_rss_mib': peak_rss_bytes() / 2 ** 20,
+        'stages': stages,
+    }
+    if args.client_upload:
+        if 'test_images' in sources:
+            sources['phone_test_images'] = phone_photos(sources['test_images'])
+        report['client_upload'] = client_upload(model, sources, repeats)
+    print_stages(stages)
+    if args.client_upload:
+        print_client_upload(report['client_upload'])
+    print(f"\nPeak RSS: {report['peak_rss_mib']:.0f} MiB")
+    if args.json_path:
+        with open(args.json_path, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            rows = compare(report, json.load(baseline_file), args.threshold, args.metric)
+        print_comparison(rows, args.metric)
+        regressions = [row[0] for row in rows if row[4]]
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# Confidence calibration and open-set rejection
+#
+#   python calibration.py path/to/Dataset                      # fit a temperature on the validation split
+#   python calibration.py .cache/shards --model crop-id        # shard directories work too
+#   python calibration.py path/to/Dataset --write --min-confidence 0.6
+#
+# A CNN's softmax is over-confident, and a photo that is not a leaf at all
+# still lands in one of the classes. Temperature scaling fits a single number
+# T on held-out images (dataset.py's validation split, which training never
+# sees) by minimising the negative log-likelihood. The model's probabilities
+# then become softmax(log(p) / T) (ModelSpec.calibrate, applied by
+# BoundModel.predict); T > 1 softens over-confident outputs without changing
+# any top-1 label.
+#
+# A prediction whose calibrated top probability is below the model's
+# min_confidence is reported as unknown: the app skips the LLM description
+# for it, and serve.py and batch_predict.py flag it. The report lists the
+# coverage (share of images kept) and the accuracy of the kept images at
+# several thresholds to choose it by.
+#
+# --write stores the temperature (and --min-confidence) in models.json for
+# manifest models, and in the <stem>.model.json sidecar for other files.
+import argparse
+import sys
+
+import numpy as np
+
+from dataset import (DEFAULT_SEED, ShardedDataset, is_shard_dir, list_dataset, load_example,
+                     split_dataset)
+from inference import preprocess
+from model_manifest import MANIFEST, ManifestError, temperature_scale, update_manifest, write_binding
+
+THRESHOLDS = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+# Search range for the temperature
+MIN_TEMPERATURE = 0.05
+MAX_TEMPERATURE = 20.0
+
+
+def negative_log_likelihood(probabilities, targets):
+    return float(-np.mean(np.log(np.maximum(probabilities[np.arange(len(targets)), targets], 1e-12))))
+
+
+def fit_temperature(probabilities, targets, iterations=60):
+    """Temperature minimising the NLL of ``targets``, by golden-section search over log(T)."""
+    def loss(log_temperature):
+        return negative_log_likelihood(temperature_scale(probabilities, np.exp(log_temperature)), targets)
+
+    ratio = (np.sqrt(5) - 1) / 2
+    low, high = np.log(MIN_TEMPERATURE), np.log(MAX_TEMPERATURE)
+    left, right = high - ratio * (high - low), low + ratio * (high - low)
+    left_loss, right_loss = loss(left), loss(right)
+    for _ in range(iterations):
+        if left_loss < right_loss:
+            high, right, right_loss = right, left, left_loss
+            left = high - ratio * (high - low)
+            left_loss = loss(left)
+        else:
+            low, left, left_loss = left, right, right_loss
+            right = low + ratio * (high - low)
+            right_loss = loss(right)
+    return float(np.exp((low + high) / 2))
+
+
+def expected_calibration_error(probabilities, targets, bins=15):
+    """Mean |accuracy - confidence| over equal-width confidence bins, weighted by bin size."""
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == targets
+    edges = np.linspace(0, 1, bins + 1)
+    error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if in_bin.any():
+            error += in_bin.mean() * abs(correct[in_bin].mean() - confidence[in_bin].mean())
+    return float(error)
+
+
+def selective_accuracy(probabilities, targets, thresholds=THRESHOLDS):
+    """(threshold, coverage, accuracy of the covered images) for each threshold."""
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == targets
+    rows = []
+    for threshold in thresholds:
+        kept = confidence >= threshold
+        rows.append((threshold, float(kept.mean()), float(correct[kept].mean()) if kept.any() else None))
+    return rows
+
+
+def load_held_out(source, spec, split='val', seed=DEFAULT_SEED):
+    """uint8 images of one split at ``spec``'s input size, and their output indices.
+
+    Classes the model has no output for are left out; a crop model's target
+    is the crop of each class.
+    """
+    def target_of(class_name):
+        name = class_name.split('-')[0] if spec.kind == 'crop' else class_name
+        return spec.labels.index(name) if name in spec.labels else -1
+
+    if is_shard_dir(source):
+        shards = ShardedDataset(source)
+        targets = np.array([target_of(name) for name in shards.class_names], np.int64)[shards.labels]
+        rows = shards.split_indices(seed)[split]
+        rows = rows[targets[rows] >= 0]
+        images, targets = list(shards.take(rows)), targets[rows]
+    else:
+        class_names, examples = list_dataset(source)
+        images, targets = [], []
+        for path, label in split_dataset(source, examples, seed)[split]:
+            target = target_of(class_names[label])
+            image = load_example(path) if target >= 0 else None
+            if image is not None:
+                images.append(image)
+                targets.append(target)
+        targets = np.array(targets, np.int64)
+    return [preprocess(image, spec.input_size) for image in images], targets
+
+
+def raw_probabilities(model, images, batch_size=64):
+    """The model's probabilities before its current temperature is applied."""
+    outputs = [model.backend.predict(model.spec.prepare(np.stack(images[start:start + batch_size])))
+               for start in range(0, len(images), batch_size)]
+    return np.concatenate(outputs).astype(np.float32)
+
+
+def save(spec, temperature, min_confidence=None, manifest_path=None):
+    """Store a fit in models.json if the model is listed there, else in its sidecar; returns the file."""
+    spec.temperature = round(temperature, 4)
+    if min_confidence is not None:
+        spec.min_confidence = min_confidence
+    if MANIFEST.models.get(spec.name) is spec:
+        return update_manifest([spec], manifest_path)
+    return write_binding(spec, spec.path)
+
+
+def print_report(temperature, before, after, targets):
+    print(f"Fitted temperature: {temperature:.3f} on {len(targets)} held-out images, "
+          f"accuracy {np.mean(after.argmax(axis=1) == targets):.1%}")
+    print(f"{'':<12} {'NLL':>8} {'ECE':>8}")
+    for name, probabilities in (('before', before), ('after', after)):
+        print(f"{name:<12} {negative_log_likelihood(probabilities, targets):>8.4f} "
+              f"{expected_calibration_error(probabilities, targets):>8.4f}")
+    print(f"\n{'threshold':<12} {'coverage':>8} {'accuracy':>8}   (calibrated)")
+    for threshold, coverage, accuracy in selective_accuracy(after, targets):
+        print(f"{threshold:<12.2f} {coverage:>8.1%} {'-' if accuracy is None else f'{accuracy:.1%}':>8}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Fit a temperature and check confidence thresholds.')
+    parser.add_argument('dataset', help='dataset directory (one sub-directory per class) or shard directory')
+    parser.add_argument('--model', help='model name or file (default: $BHOOMI_MODEL)')
+    parser.add_argument('--split', default='val', choices=('val', 'test'), help='held-out split (default: val)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='split seed, as for train.py')
+    parser.add_argument('--write', action='store_true', help="store the temperature in the model's binding")
+    parser.add_argument('--min-confidence', type=float, help='with --write, also store this threshold')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.min_confidence is not None and not 0 < args.min_confidence <= 1:
+        parser.error('--min-confidence must be in (0, 1]')
+
+    from model_registry import DEFAULT_MODEL_PATH, get_model
+    try:
+        spec = MANIFEST.resolve(args.model or DEFAULT_MODEL_PATH)
+        model = get_model(spec.path)
+        images, targets = load_held_out(args.dataset, spec, args.split, args.seed)
+    except (ManifestError, ValueError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    if not images:
+        print(f"error: no {args.split} images of {spec.name}'s classes in {args.dataset}", file=sys.stderr)
+        return 1
+
+    before = raw_probabilities(model, images)
+    temperature = fit_temperature(before, targets)
+    print_report(temperature, before, temperature_scale(before, temperature), targets)
+    if args.write:
+        print(f"\nWrote {save(spec, temperature, args.min_confidence)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,447 @@
+# Smaller variants of a disease model, and a leaderboard to choose one by
+#
+#   python compress.py .cache/shards                               # train every variant, write the leaderboard
+#   python compress.py path/to/Dataset --variants gap,pruned-50 --epochs 5
+#   python compress.py .cache/shards --register                     # also list the variants in models.json
+#   python compress.py .cache/shards --leaderboard-only             # re-measure the variants on disk
+#
+# Starting from the teacher (the default model in models.json, or --teacher),
+# each variant is trained on the dataset's training split:
+#
+#   distilled-w50   the notebook's CNN at half width, trained from scratch by
+#                   knowledge distillation: the loss mixes cross-entropy on
+#                   the labels with the KL divergence to the teacher's
+#                   probabilities, both softened by KD_TEMPERATURE
+#   gap             the teacher's convolutions (weights copied) with global
+#                   average pooling instead of Flatten -> Dense(8), which
+#                   drops about 98% of the parameters; fine-tuned by
+#                   distillation
+#   pruned-50/-80   the teacher with the 50% / 80% smallest-magnitude weights
+#                   of each large hidden layer set to zero (in the notebook
+#                   model, the Dense(8) that holds 98% of them). Sparsity
+#                   rises step by step over the first half of the epochs
+#                   (cubic ramp) while fine-tuning by distillation, and
+#                   pruned weights stay zero. Kernels stay dense in memory,
+#                   so pruning shrinks the gzipped download, not the RAM or
+#                   the latency
+#
+# Each variant has its own default learning rate (VARIANT_LEARNING_RATES):
+# the GAP head starts from scratch on small pooled features and needs a large
+# one, the pruned teacher a small one to keep what it learnt.
+#
+# Every variant is written to output_dir as <teacher stem>_<variant>.h5 and an
+# INT8 TFLite export, each with its sidecar binding (see model_manifest.py),
+# and named "<teacher>-<variant>". --register adds the .h5 files to
+# models.json with "variant_of" set, which is how the app offers them.
+#
+# The leaderboard (output_dir/leaderboard.json, and printed) measures the
+# teacher and every variant on the test split: parameters, file size, gzipped
+# size, single-image CPU latency of the .h5 and of the INT8 export, accuracy,
+# and top-1 agreement with the teacher. The teacher's own accuracy is only
+# comparable if it never trained on these test images.
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from calibration import load_held_out
+from dataset import DEFAULT_SEED
+from model_manifest import MANIFEST, ManifestError, ModelSpec, update_manifest, write_binding
+
+VARIANTS = ('distilled-w50', 'gap', 'pruned-50', 'pruned-80')
+
+DEFAULT_OUTPUT_DIR = 'artifacts'
+LEADERBOARD_FILE = 'leaderboard.json'
+
+# Softening of both probability distributions in the distillation loss, and
+# the weight of the teacher's term against the labels'
+KD_TEMPERATURE = 4.0
+KD_ALPHA = 0.7
+
+VARIANT_LEARNING_RATES = {'distilled-w50': 0.001, 'gap': 0.01, 'pruned-50': 0.0001, 'pruned-80': 0.0001}
+
+# Smaller layers (the convolutions, the output layer) are left unpruned:
+# they hold few of the weights and each one matters
+MIN_PRUNED_WEIGHTS = 10000
+
+LATENCY_RUNS = 50
+
+
+def variant_path(teacher, variant, output_dir=DEFAULT_OUTPUT_DIR):
+    stem = os.path.splitext(os.path.basename(teacher.path))[0]
+    return os.path.join(output_dir, f'{stem}_{variant}.h5')
+
+
+def int8_path(model_path, output_dir=DEFAULT_OUTPUT_DIR):
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(output_dir, f'{stem}_int8.tflite')
+
+
+def variant_spec(teacher, variant, path, divide_by):
+    return ModelSpec(f'{teacher.name}-{variant}', path, teacher.labels, teacher.input_size, teacher.color,
+                     divide_by, variant_of=teacher.name)
+
+
+def prepare_tensor(images, spec):
+    """ModelSpec.prepare() inside a tf.data pipeline."""
+    import tensorflow as tf
+
+    if spec.color == 'rgb':
+        images = images[..., ::-1]
+    if spec.divide_by != 1:
+        images = tf.cast(images, tf.float32) / spec.divide_by
+    return images
+
+
+def with_teacher(dataset, teacher_model, teacher, student):
+    """(student input, [one-hot label, teacher probabilities]) batches from (uint8 image, label) ones."""
+    import tensorflow as tf
+
+    def add(images, labels):
+        probabilities = teacher_model(prepare_tensor(images, teacher), training=False)
+        targets = tf.concat([tf.cast(labels, tf.float32), tf.cast(probabilities, tf.float32)], axis=-1)
+        return prepare_tensor(images, student), targets
+
+    return dataset.map(add)
+
+
+def distillation_loss(num_classes, temperature=KD_TEMPERATURE, alpha=KD_ALPHA):
+    """Loss over targets holding the one-hot label and the teacher's probabilities side by side."""
+    import keras
+    from keras import ops
+
+    def soften(probabilities):
+        return ops.softmax(ops.log(ops.maximum(probabilities, 1e-7)) / temperature, axis=-1)
+
+    def loss(targets, probabilities):
+        labels, teacher = targets[:, :num_classes], targets[:, num_classes:]
+        hard = keras.losses.categorical_crossentropy(labels, probabilities)
+        soft = keras.losses.kl_divergence(soften(teacher), soften(probabilities)) * temperature ** 2
+        return alpha * soft + (1 - alpha) * hard
+
+    return loss
+
+
+def label_accuracy(num_classes):
+    from keras import ops
+
+    def accuracy(targets, probabilities):
+        return ops.cast(ops.argmax(targets[:, :num_classes], axis=-1) == ops.argmax(probabilities, axis=-1),
+                        'float32')
+
+    return accuracy
+
+
+def magnitude_masks(model, sparsity):
+    """{layer name: 0/1 kernel mask} dropping the ``sparsity`` smallest weights of each large hidden layer."""
+    masks = {}
+    for layer in model.layers[:-1]:
+        if getattr(layer, 'kernel', None) is None or np.prod(layer.kernel.shape) < MIN_PRUNED_WEIGHTS:
+            continue
+        magnitude = np.abs(np.asarray(layer.kernel))
+        masks[layer.name] = (magnitude > np.quantile(magnitude, sparsity)).astype(np.float32)
+    return masks
+
+
+def apply_masks(model, masks):
+    for name, mask in masks.items():
+        kernel = model.get_layer(name).kernel
+        kernel.assign(np.asarray(kernel) * mask)
+
+
+def sparsity_at(progress, target):
+    """Cubic ramp over progress 0..1: prunes fast while the weights can still adapt, slowly near ``target``."""
+    return target * (1 - (1 - min(progress, 1.0)) ** 3)
+
+
+def gradual_pruning(target, ramp_epochs):
+    """Callback raising the pruned layers' sparsity to ``target`` over ``ramp_epochs`` epochs.
+
+    Masks are recomputed from the weights' magnitudes before every training
+    step and applied again after it, so a pruned weight stays zero.
+    """
+    import keras
+    from keras import ops
+
+    class GradualPruning(keras.callbacks.Callback):
+        epoch = 0
+        masks = {}
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.epoch = epoch
+
+        def on_train_batch_begin(self, batch, logs=None):
+            steps = self.params.get('steps') or 1
+            progress = (self.epoch * steps + batch + 1) / (ramp_epochs * steps)
+            self.masks = magnitude_masks(self.model, sparsity_at(progress, target))
+            apply_masks(self.model, self.masks)
+
+        def on_train_batch_end(self, batch, logs=None):
+            for name, mask in self.masks.items():
+                kernel = self.model.get_layer(name).kernel
+                kernel.assign(kernel * ops.convert_to_tensor(mask, kernel.dtype))
+
+    return GradualPruning()
+
+
+def build_variant(variant, teacher_model, teacher, learning_rate):
+    """(student to train, its spec's divide_by)."""
+    import keras
+    from training import build_gap_model, build_model
+
+    num_classes = len(teacher.labels)
+    if variant == 'distilled-w50':
+        return build_model(num_classes, learning_rate, width=0.5), 1
+    if variant == 'gap':
+        model = build_gap_model(num_classes, learning_rate, pixel_scale=1 / teacher.divide_by)
+        convolutions = [layer for layer in teacher_model.layers if isinstance(layer, keras.layers.Conv2D)]
+        targets = [layer for layer in model.layers if isinstance(layer, keras.layers.Conv2D)]
+        if [layer.kernel.shape for layer in convolutions] != [layer.kernel.shape for layer in targets]:
+            raise ValueError(f"{teacher.name} does not have the notebook's convolutions")
+        for source, target in zip(convolutions, targets):
+            target.set_weights(source.get_weights())
+        return model, 1
+    if variant.startswith('pruned-'):
+        model = keras.models.clone_model(teacher_model)
+        model.set_weights(teacher_model.get_weights())
+        return model, teacher.divide_by
+    raise ValueError(f"unknown variant {variant!r} (choose from {', '.join(VARIANTS)})")
+
+
+def load_training_data(source, teacher, batch_size, seed):
+    """{split: (uint8 image, one-hot label) batches or None} and uint8 images for INT8 calibration."""
+    from train import DEFAULT_CONFIG, load_datasets
+
+    config = dict(DEFAULT_CONFIG, dataset=source, batch_size=batch_size, seed=seed,
+                  calibration_samples=100)
+    labels, datasets, calibration, _ = load_datasets(config)
+    if tuple(labels) != teacher.labels:
+        raise ValueError(f"dataset classes {labels} are not {teacher.name}'s labels {list(teacher.labels)}")
+    return datasets, calibration
+
+
+def train_variant(variant, teacher_model, teacher, datasets, calibration, epochs=20, learning_rate=None,
+                  patience=5, output_dir=DEFAULT_OUTPUT_DIR, log=sys.stderr):
+    """Train one variant and write it with its INT8 export; returns the .h5's spec."""
+    import keras
+    from export_model import export_tflite
+
+    learning_rate = learning_rate or VARIANT_LEARNING_RATES[variant]
+    model, divide_by = build_variant(variant, teacher_model, teacher, learning_rate)
+    spec = variant_spec(teacher, variant, variant_path(teacher, variant, output_dir), divide_by)
+    num_classes = len(teacher.labels)
+    model.compile(loss=distillation_loss(num_classes), optimizer=keras.optimizers.Adam(learning_rate),
+                  metrics=[label_accuracy(num_classes)])
+    validation = (with_teacher(datasets['val'], teacher_model, teacher, spec)
+                  if datasets['val'] is not None else None)
+    # The distillation loss keeps falling while the accuracy of a small student is still flat
+    monitor = 'val_loss' if validation is not None else 'loss'
+    sparsity, ramp_epochs, extra_callbacks = None, 1, []
+    if variant.startswith('pruned-'):
+        sparsity, ramp_epochs = int(variant.split('-')[1]) / 100, max(epochs // 2, 1)
+        extra_callbacks.append(gradual_pruning(sparsity, ramp_epochs))
+    start = time.perf_counter()
+    # Only epochs at full sparsity may be kept as the best
+    model.fit(with_teacher(datasets['train'], teacher_model, teacher, spec), epochs=epochs,
+              validation_data=validation, verbose=2,
+              callbacks=extra_callbacks + [keras.callbacks.EarlyStopping(
+                  monitor=monitor, mode='min', restore_best_weights=True, patience=patience,
+                  start_from_epoch=ramp_epochs - 1)])
+    if sparsity is not None:
+        apply_masks(model, magnitude_masks(model, sparsity))
+    print(f"{spec.name}: trained in {time.perf_counter() - start:.0f} s", file=log)
+
+    # Saved with a plain loss, so serving loads it without this module
+    model.compile(loss='categorical_crossentropy', optimizer=keras.optimizers.Adam(learning_rate),
+                  metrics=['accuracy'])
+    os.makedirs(output_dir, exist_ok=True)
+    model.save(spec.path)
+    quantized = int8_path(spec.path, output_dir)
+    export_tflite(model, quantized, 'int8', spec.prepare(calibration))
+    for path in (spec.path, quantized):
+        write_binding(spec, path)
+        print(f"Wrote {path}", file=log)
+    return spec
+
+
+def gzip_size(path):
+    with open(path, 'rb') as model_file:
+        return len(gzip.compress(model_file.read(), compresslevel=9))
+
+
+def measure(spec, images, targets, teacher_top1=None, num_threads=1):
+    """Size, parameters, batch-1 latency and held-out accuracy of one model file."""
+    from backends import load_backend
+    from model_manifest import BoundModel
+
+    model = BoundModel(load_backend(spec.path, num_threads), spec)
+    row = {'path': spec.path, 'backend': model.name, 'size_bytes': os.path.getsize(spec.path),
+           'gzip_bytes': gzip_size(spec.path)}
+    if model.name == 'keras':
+        weights = model.backend.model.get_weights()
+        row['params'] = int(sum(weight.size for weight in weights))
+        row['nonzero_params'] = int(sum(np.count_nonzero(weight) for weight in weights))
+    top1 = np.concatenate([model.predict(np.stack(images[start:start + 64])).argmax(axis=1)
+                           for start in range(0, len(images), 64)])
+    single = np.stack(images[:1])
+    model.predict(single)
+    latencies = []
+    for _ in range(LATENCY_RUNS):
+        start = time.perf_counter()
+        model.predict(single)
+        latencies.append(time.perf_counter() - start)
+    row['p50_ms_batch1'] = float(np.median(latencies) * 1000)
+    row['accuracy'] = float(np.mean(top1 == targets))
+    if teacher_top1 is not None:
+        row['teacher_agreement'] = float(np.mean(top1 == teacher_top1))
+    return row, top1
+
+
+def leaderboard(teacher, variants, source, seed=DEFAULT_SEED, output_dir=DEFAULT_OUTPUT_DIR, log=sys.stderr):
+    """Measure the teacher and ``variants`` ({variant: spec}) and their INT8 exports on the test split."""
+    images, targets = load_held_out(source, teacher, 'test', seed)
+    if not len(images):
+        raise ValueError(f"no test images of {teacher.name}'s classes in {source}")
+    rows = []
+    teacher_top1 = None
+    for variant, spec in [('teacher', teacher)] + list(variants.items()):
+        row, top1 = measure(spec, images, targets, teacher_top1)
+        if teacher_top1 is None:
+            teacher_top1 = top1
+            row['teacher_agreement'] = 1.0
+        row = {'name': spec.name, 'variant': variant, **row}
+        quantized = int8_path(spec.path, output_dir)
+        if os.path.exists(quantized):
+            int8_spec = ModelSpec(spec.name, quantized, spec.labels, spec.input_size, spec.color,
+                                  spec.divide_by)
+            int8_row, _ = measure(int8_spec, images, targets, teacher_top1)
+            row.update({f'int8_{key}': int8_row[key]
+                        for key in ('path', 'size_bytes', 'p50_ms_batch1', 'accuracy')})
+        rows.append(row)
+        print(f"Measured {spec.name}", file=log)
+    rows.sort(key=lambda row: (-row['accuracy'], row['p50_ms_batch1']))
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'teacher': teacher.name,
+        'dataset': source,
+        'split': 'test',
+        'test_images': len(images),
+        'models': rows,
+    }
+
+
+def write_leaderboard(board, path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(board, output, indent=2)
+    return path
+
+
+def load_leaderboard(path=None):
+    """{model name: leaderboard row}, empty if there is no leaderboard."""
+    path = path or os.getenv('BHOOMI_LEADERBOARD') or os.path.join(DEFAULT_OUTPUT_DIR, LEADERBOARD_FILE)
+    try:
+        with open(path, encoding='utf-8') as board_file:
+            return {row['name']: row for row in json.load(board_file)['models']}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _kib(size):
+    return f"{size / 1024:.0f}" if size is not None else '-'
+
+
+def _ms(value):
+    return f"{value:.1f}" if value is not None else '-'
+
+
+def _percent(value):
+    return f"{value * 100:.1f}" if value is not None else '-'
+
+
+def print_leaderboard(board):
+    print(f"{board['test_images']} test images from {board['dataset']}")
+    print(f"{'Model':<32}{'Params':>9}{'Nonzero':>9}{'KiB':>7}{'gzip':>7}{'ms':>7}{'Acc %':>7}"
+          f"{'Agree %':>9}{'int8 KiB':>10}{'int8 ms':>9}{'int8 %':>8}")
+    for row in board['models']:
+        print(f"{row['name']:<32}{row.get('params', '-'):>9}{row.get('nonzero_params', '-'):>9}"
+              f"{_kib(row['size_bytes']):>7}{_kib(row['gzip_bytes']):>7}{_ms(row['p50_ms_batch1']):>7}"
+              f"{_percent(row['accuracy']):>7}{_percent(row['teacher_agreement']):>9}"
+              f"{_kib(row.get('int8_size_bytes')):>10}{_ms(row.get('int8_p50_ms_batch1')):>9}"
+              f"{_percent(row.get('int8_accuracy')):>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train distilled and pruned variants of a model and rank them.')
+    parser.add_argument('dataset', help='dataset directory (one folder per class) or shard directory')
+    parser.add_argument('--teacher', help='manifest name or model file (default: the default model)')
+    parser.add_argument('--variants', default=','.join(VARIANTS),
+                        help=f"comma-separated, from {', '.join(VARIANTS)} (default: all)")
+    parser.add_argument('--epochs', type=int, default=20, help='at most this many epochs per variant')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float,
+                        help='for every variant (default: VARIANT_LEARNING_RATES)')
+    parser.add_argument('--patience', type=int, default=5, help='early stopping patience (epochs)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='split seed (default: %(default)s)')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--leaderboard', help='leaderboard file (default: <output dir>/leaderboard.json)')
+    parser.add_argument('--leaderboard-only', action='store_true',
+                        help='measure the variants already in the output directory, train nothing')
+    parser.add_argument('--register', action='store_true', help='add the variants to models.json')
+    args = parser.parse_args(argv)
+
+    variants = [variant.strip() for variant in args.variants.split(',') if variant.strip()]
+    unknown = sorted(set(variants) - set(VARIANTS))
+    if unknown:
+        parser.error(f"unknown variants {', '.join(unknown)} (choose from {', '.join(VARIANTS)})")
+    try:
+        teacher = MANIFEST.resolve(args.teacher) if args.teacher else MANIFEST.default
+    except ManifestError as e:
+        parser.error(str(e))
+    if teacher.kind != 'disease' or teacher.variant_of is not None:
+        parser.error(f"{teacher.name} is not a disease model")
+
+    if args.leaderboard_only:
+        specs = {}
+        for variant in variants:
+            path = variant_path(teacher, variant, args.output_dir)
+            if os.path.exists(path):
+                specs[variant] = variant_spec(teacher, variant, path, MANIFEST.resolve(path).divide_by)
+    else:
+        import keras
+
+        keras.utils.set_random_seed(args.seed)
+        try:
+            teacher_model = keras.models.load_model(teacher.path, compile=False)
+            datasets, calibration = load_training_data(args.dataset, teacher, args.batch_size, args.seed)
+            if datasets['train'] is None:
+                parser.error(f"no training images in {args.dataset}")
+            specs = {variant: train_variant(variant, teacher_model, teacher, datasets, calibration,
+                                            args.epochs, args.learning_rate, args.patience, args.output_dir)
+                     for variant in variants}
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    try:
+        board = leaderboard(teacher, specs, args.dataset, args.seed, args.output_dir)
+        path = write_leaderboard(board, args.leaderboard or os.path.join(args.output_dir, LEADERBOARD_FILE))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    print_leaderboard(board)
+    print(f"Wrote {path}")
+    if args.register and specs:
+        try:
+            path = update_manifest(list(specs.values()))
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        print(f"Registered {', '.join(spec.name for spec in specs.values())} in {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+# Training dataset layout, stable splits and memory-mapped shards
+#
+#   python dataset.py build path/to/Dataset .cache/shards    # decode once (re-run to add new images)
+#   python dataset.py info .cache/shards
+#   python dataset.py bench .cache/shards --source path/to/Dataset
+#
+# A dataset is one directory per class (Corn___Common_rust/, ...). Decoding
+# and resizing the JPEGs dominates a CPU epoch, so `build` does it once and
+# writes the 256x256 uint8 images into shards:
+#
+#   .cache/shards/index.json                class names, shard list, file of every row
+#   .cache/shards/shard-00000.images.npy    (N, 256, 256, 3) uint8
+#   .cache/shards/shard-00000.labels.npy    (N,) int32
+#
+# Shards are plain .npy files, opened with mmap_mode='r': reading a batch
+# maps the pages instead of decoding anything, and consecutive rows within a
+# shard are zero-copy views. Building again only decodes files that are not
+# in the index yet and appends them as new shards; completed shards are never
+# rewritten, so an interrupted build resumes where it stopped.
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from inference import IMAGE_EXTENSIONS, IMAGE_SIZE, decode_image, preprocess
+from preprocess_pipeline import PrefetchPipeline
+
+SPLITS = ('train', 'val', 'test')
+
+# The notebook held out 20% for test, then 20% of the rest for validation
+DEFAULT_TEST_FRACTION = 0.2
+DEFAULT_VAL_FRACTION = 0.16
+# and used random_state=10
+DEFAULT_SEED = 10
+
+# Height, width, channels of preprocess() output
+INPUT_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+DEFAULT_SHARD_SIZE = 1024
+
+
+def class_name_of(directory):
+    """'Potato___Early_blight' -> 'Potato-Early_blight'"""
+    return directory.replace('___', '-')
+
+
+def class_directories(root):
+    directories = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    if not directories:
+        raise ValueError(f"no class directories in {root}")
+    return directories
+
+
+def iter_class_files(root, directory):
+    """Sorted image paths under one class directory."""
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root, directory)):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def list_dataset(root):
+    """Class names (sorted directory names) and sorted (path, label index) pairs."""
+    directories = class_directories(root)
+    examples = [(path, label) for label, directory in enumerate(directories)
+                for path in iter_class_files(root, directory)]
+    return [class_name_of(directory) for directory in directories], examples
+
+
+def relative_key(path, root):
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def split_of(key, seed=DEFAULT_SEED, val_fraction=DEFAULT_VAL_FRACTION,
+             test_fraction=DEFAULT_TEST_FRACTION):
+    """'train', 'val' or 'test', from a hash of a file's dataset-relative path."""
+    digest = hashlib.sha1(f"{seed}:{key}".encode('utf-8')).digest()
+    position = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    if position < test_fraction:
+        return 'test'
+    if position < test_fraction + val_fraction:
+        return 'val'
+    return 'train'
+
+
+def split_dataset(root, examples, seed=DEFAULT_SEED, val_fraction=DEFAULT_VAL_FRACTION,
+                  test_fraction=DEFAULT_TEST_FRACTION):
+    """{'train': [...], 'val': [...], 'test': [...]} of (path, label) pairs."""
+    splits = {split: [] for split in SPLITS}
+    for path, label in examples:
+        splits[split_of(relative_key(path, root), seed, val_fraction, test_fraction)].append((path, label))
+    return splits
+
+
+def load_example(path):
+    """Read, decode and resize one image exactly as the app does (None if unreadable)."""
+    try:
+        with open(path, 'rb') as image_file:
+            image = decode_image(image_file.read())
+    except OSError:
+        return None
+    return None if image is None else preprocess(image)
+
+
+def is_shard_dir(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def read_index(shard_dir):
+    with open(os.path.join(shard_dir, INDEX_FILE), encoding='utf-8') as index_file:
+        index = json.load(index_file)
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError(f"{shard_dir}: unsupported shard index version {index.get('version')!r}")
+    return index
+
+
+def _write_index(shard_dir, index):
+    path = os.path.join(shard_dir, INDEX_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file)
+    os.replace(path + '.tmp', path)
+
+
+def _shard_paths(shard_dir, name):
+    return (os.path.join(shard_dir, f'{name}.images.npy'),
+            os.path.join(shard_dir, f'{name}.labels.npy'))
+
+
+def _write_shard(shard_dir, name, chunk, workers):
+    """Decode ``chunk`` of (key, path, label) into one shard; returns (keys written, keys skipped)."""
+    images_path, labels_path = _shard_paths(shard_dir, name)
+    images = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8,
+                                       shape=(len(chunk),) + INPUT_SHAPE)
+    labels, written, skipped = [], [], []
+    paths = [path for _, path, _ in chunk]
+    rows = iter(chunk)
+    for batch in PrefetchPipeline(paths, load_example, batch_size=64, workers=workers):
+        for image in batch:
+            key, _, label = next(rows)
+            if image is None:
+                skipped.append(key)
+                continue
+            images[len(written)] = image
+            labels.append(label)
+            written.append(key)
+    images.flush()
+    del images
+    if len(written) < len(chunk):
+        # Unreadable files left unused rows at the end; copy into an exact-size file
+        full = np.load(images_path + '.tmp', mmap_mode='r')
+        exact = np.lib.format.open_memmap(images_path + '.tmp2', mode='w+', dtype=np.uint8,
+                                          shape=(len(written),) + INPUT_SHAPE)
+        exact[:] = full[:len(written)]
+        exact.flush()
+        del full, exact
+        os.replace(images_path + '.tmp2', images_path + '.tmp')
+    np.save(labels_path, np.asarray(labels, dtype=np.int32))
+    os.replace(images_path + '.tmp', images_path)
+    return written, skipped
+
+
+def build_shards(dataset_root, shard_dir, shard_size=DEFAULT_SHARD_SIZE, workers=4, log=None):
+    """Add every image under ``dataset_root`` that is not yet in ``shard_dir``.
+
+    Class labels are fixed by the first build; class directories that appear
+    later get the next labels. Returns (images added, images skipped).
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    if is_shard_dir(shard_dir):
+        index = read_index(shard_dir)
+    else:
+        index = {'version': INDEX_VERSION, 'image_shape': list(INPUT_SHAPE), 'directories': [],
+                 'class_names': [], 'shards': [], 'files': [], 'skipped': []}
+    for directory in class_directories(dataset_root):
+        if directory not in index['directories']:
+            index['directories'].append(directory)
+            index['class_names'].append(class_name_of(directory))
+    known = set(index['files']) | set(index['skipped'])
+    pending = []
+    for label, directory in enumerate(index['directories']):
+        if not os.path.isdir(os.path.join(dataset_root, directory)):
+            continue
+        for path in iter_class_files(dataset_root, directory):
+            key = relative_key(path, dataset_root)
+            if key not in known:
+                pending.append((key, path, label))
+
+    added = skipped = 0
+    for start in range(0, len(pending), shard_size):
+        name = f"shard-{len(index['shards']):05d}"
+        written, failed = _write_shard(shard_dir, name, pending[start:start + shard_size], workers)
+        index['shards'].append({'name': name, 'count': len(written)})
+        index['files'].extend(written)
+        index['skipped'].extend(failed)
+        # Commit after every shard so an interrupted build keeps its progress
+        _write_index(shard_dir, index)
+        added += len(written)
+        skipped += len(failed)
+        if log:
+            print(f"{name}: {len(written)} images ({added + skipped}/{len(pending)})", file=log)
+    if not pending:
+        _write_index(shard_dir, index)
+    return added, skipped
+
+
+class ShardedDataset:
+    """Read-only view over a shard directory; images stay on disk until touched."""
+
+    def __init__(self, shard_dir):
+        index = read_index(shard_dir)
+        self.shard_dir = shard_dir
+        self.class_names = index['class_names']
+        self.shards = index['shards']
+        self.files = index['files']
+        self._images = []
+        labels = []
+        for shard in index['shards']:
+            images_path, labels_path = _shard_paths(shard_dir, shard['name'])
+            if shard['count']:
+                self._images.append(np.load(images_path, mmap_mode='r'))
+                labels.append(np.load(labels_path))
+        self.labels = np.concatenate(labels) if labels else np.zeros(0, np.int32)
+        self._offsets = np.cumsum([0] + [len(images) for images in self._images])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def split_indices(self, seed=DEFAULT_SEED, val_fraction=DEFAULT_VAL_FRACTION,
+                      test_fraction=DEFAULT_TEST_FRACTION):
+        """{'train': array of row indices, ...}, the same split as split_dataset() on the JPEGs."""
+        splits = {split: [] for split in SPLITS}
+        for row, key in enumerate(self.files):
+            splits[split_of(key, seed, val_fraction, test_fraction)].append(row)
+        return {split: np.asarray(rows, dtype=np.int64) for split, rows in splits.items()}
+
+    def take(self, indices):
+        """Images at ``indices`` (any order) as one (N, H, W, 3) uint8 array."""
+        indices = np.asarray(indices, dtype=np.int64)
+        batch = np.empty((len(indices),) + INPUT_SHAPE, dtype=np.uint8)
+        shards = np.searchsorted(self._offsets, indices, side='right') - 1
+        for shard in np.unique(shards):
+            mask = shards == shard
+            rows = indices[mask] - self._offsets[shard]
+            # Reading rows in file order keeps the access pattern sequential
+            order = np.argsort(rows)
+            batch[np.flatnonzero(mask)[order]] = self._images[shard][rows[order]]
+        return batch
+
+    def iter_batches(self, batch_size):
+        """Yield (images, labels) in row order; images are views into the shard files.
+
+        Batches do not span shards, so the last batch of each shard may be short.
+        """
+        for shard, images in enumerate(self._images):
+            for start in range(0, len(images), batch_size):
+                stop = min(start + batch_size, len(images))
+                offset = self._offsets[shard]
+                yield images[start:stop], self.labels[offset + start:offset + stop]
+
+
+def bench(shard_dir, batch_size=64, source=None, samples=200):
+    """Images/s reading the shards, and decoding the JPEGs they came from for comparison."""
+    dataset = ShardedDataset(shard_dir)
+    start = time.perf_counter()
+    checksum = 0
+    for images, _ in dataset.iter_batches(batch_size):
+        # Touch every pixel so the pages are really read
+        checksum += int(images.sum(dtype=np.uint64))
+    seconds = time.perf_counter() - start
+    result = {'images': len(dataset), 'shard_images_per_second': len(dataset) / seconds}
+    if source:
+        paths = [os.path.join(source, key) for key in dataset.files[:samples]]
+        start = time.perf_counter()
+        for path in paths:
+            load_example(path)
+        result['jpeg_images_per_second'] = len(paths) / (time.perf_counter() - start)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compile the training images into memory-mapped shards.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='decode new images into shards')
+    build.add_argument('dataset', help='directory with one sub-directory of images per class')
+    build.add_argument('shards', help='shard directory (created if missing)')
+    build.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                       help=f'images per shard (default: {DEFAULT_SHARD_SIZE})')
+    build.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                       help='decode threads (default: CPU count)')
+    info = commands.add_parser('info', help='summarize a shard directory')
+    info.add_argument('shards')
+    info.add_argument('--seed', type=int, default=DEFAULT_SEED, help='split seed, as for train.py')
+    timing = commands.add_parser('bench', help='time reading the shards (and decoding the JPEGs)')
+    timing.add_argument('shards')
+    timing.add_argument('--source', help='dataset directory the shards were built from')
+    timing.add_argument('-b', '--batch-size', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        added, skipped = build_shards(args.dataset, args.shards, args.shard_size, args.workers,
+                                      log=sys.stderr)
+        print(f"Added {added} images ({skipped} unreadable) in {time.perf_counter() - start:.1f} s")
+    elif args.command == 'info':
+        dataset = ShardedDataset(args.shards)
+        counts = np.bincount(dataset.labels, minlength=len(dataset.class_names))
+        size = sum(os.path.getsize(os.path.join(args.shards, name)) for name in os.listdir(args.shards))
+        print(f"{len(dataset)} images in {len(dataset.shards)} shards, {size / 2 ** 20:.0f} MiB")
+        for name, count in zip(dataset.class_names, counts):
+            print(f"  {name:<32} {count}")
+        for split, rows in dataset.split_indices(args.seed).items():
+            print(f"  split {split:<26} {len(rows)}")
+    else:
+        result = bench(args.shards, args.batch_size, args.source)
+        print(f"Shards: {result['shard_images_per_second']:.0f} images/s over {result['images']} images")
+        if 'jpeg_images_per_second' in result:
+            print(f"JPEG decode + resize: {result['jpeg_images_per_second']:.0f} images/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+# Multilingual disease descriptions from Groq AI, with a persistent store
+#
+# There is one prompt per disease in models.json and language in LANGUAGE_OPTIONS
+# (see prompts.py), so every description is stored on disk keyed by disease,
+# language, LLM model and prompt catalog version. Repeat lookups are served
+# from memory without touching the network, and `python descriptions.py
+# prewarm` fills every combination ahead of time.
+#
+# Descriptions that are not stored yet are streamed token by token
+# (server-sent events), so the first words appear long before the whole
+# answer has been generated. All requests share one pooled HTTP session that
+# retries transient failures with exponential backoff.
+#
+# GROQ_API_URL points the client at another OpenAI-compatible endpoint, e.g.
+# the local stub in groq_stub.py. requests is only imported once a
+# description actually has to be fetched, which keeps it off the app's
+# startup path.
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from model_manifest import MANIFEST
+from prompts import LANGUAGE_OPTIONS, PROMPT_VERSION, build_prompt
+
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+
+DEFAULT_DB_PATH = os.path.join('.cache', 'descriptions.db')
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+
+
+class DescriptionError(Exception):
+    pass
+
+
+def disease_name_of(result):
+    """'Tomato-Bacterial_spot' -> 'Bacterial spot'"""
+    return result.split('-')[1].replace('_', ' ')
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session(retries=3, backoff=0.5):
+    """Process-wide pooled session; keeps TLS connections to the API alive.
+
+    Connection errors and 429/5xx responses are retried with exponential
+    backoff (0.5 s, 1 s, 2 s, ...), honouring Retry-After when present.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def _post(disease_name, selected_language, api_key, url, model, timeout, stream):
+    import requests
+
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    data = {
+        "model": model or GROQ_MODEL,
+        "messages": [
+            {"role": "user", "content": build_prompt(disease_name, selected_language)}
+        ],
+        "stream": stream
+    }
+    try:
+        response = http_session().post(url or GROQ_API_URL, headers=headers, json=data,
+                                       timeout=timeout, stream=stream)
+    except requests.RequestException as e:
+        raise DescriptionError(f"Error contacting Groq AI API: {e}") from e
+    if response.status_code != 200:
+        response.close()
+        raise DescriptionError(f"API returned status code: {response.status_code}")
+    return response
+
+
+def fetch_description(disease_name, selected_language, api_key, url=None, model=None, timeout=15):
+    """Ask the chat-completions endpoint for a description; raises DescriptionError."""
+    response = _post(disease_name, selected_language, api_key, url, model, timeout, stream=False)
+    try:
+        return response.json()['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise DescriptionError(f"Unexpected response from Groq AI API: {e}") from e
+
+
+def stream_description(disease_name, selected_language, api_key, url=None, model=None, timeout=15):
+    """Yield the description text piece by piece as the API generates it.
+
+    ``timeout`` bounds the connection and the gap between two events, not
+    the whole answer.
+    """
+    import requests
+
+    response = _post(disease_name, selected_language, api_key, url, model, timeout, stream=True)
+    with response:
+        try:
+            # Server-sent events are always UTF-8; without a charset in the
+            # Content-Type, requests would guess ISO-8859-1
+            for line in response.iter_lines():
+                line = line.decode('utf-8')
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    return
+                try:
+                    delta = json.loads(payload)['choices'][0].get('delta', {})
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    raise DescriptionError(f"Unexpected event from Groq AI API: {e}") from e
+                if delta.get('content'):
+                    yield delta['content']
+        except requests.RequestException as e:
+            raise DescriptionError(f"Connection to Groq AI API lost: {e}") from e
+
+
+class BackgroundStream:
+    """Run a chunk generator on a worker thread and replay it on iteration.
+
+    The request starts as soon as the object is created, so the network round
+    trip overlaps with whatever the caller renders in the meantime, and a
+    slow API never blocks the thread that created it until it iterates.
+    """
+
+    _DONE = object()
+
+    def __init__(self, chunks):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(chunks,), daemon=True)
+        self._thread.start()
+
+    def _run(self, chunks):
+        try:
+            for chunk in chunks:
+                self._queue.put(chunk)
+        except Exception as e:
+            self._queue.put(e)
+            return
+        self._queue.put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class DescriptionStore:
+    """Descriptions keyed by (disease, language, model, prompt version).
+
+    Lookups hit an in-memory dict first and the SQLite file at ``db_path``
+    second; entries older than ``ttl_seconds`` are treated as missing.
+    ``db_path=None`` keeps everything in memory.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 model=None, prompt_version=PROMPT_VERSION):
+        self.model = model or GROQ_MODEL
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            if os.path.dirname(db_path):
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS descriptions ('
+                ' disease TEXT NOT NULL, language TEXT NOT NULL, model TEXT NOT NULL,'
+                ' prompt_version INTEGER NOT NULL, description TEXT NOT NULL, created REAL NOT NULL,'
+                ' PRIMARY KEY (disease, language, model, prompt_version))'
+            )
+
+    def _key(self, disease_name, language):
+        return (disease_name, language, self.model, self.prompt_version)
+
+    def _fresh(self, created):
+        return self.ttl_seconds is None or time.time() - created <= self.ttl_seconds
+
+    def get(self, disease_name, language):
+        key = self._key(disease_name, language)
+        entry = self._memory.get(key)
+        if entry is not None and self._fresh(entry[1]):
+            self.hits += 1
+            return entry[0]
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT description, created FROM descriptions WHERE disease = ? AND language = ?'
+                    ' AND model = ? AND prompt_version = ?', key
+                ).fetchone()
+                if row is not None and self._fresh(row[1]):
+                    self._memory[key] = row
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, disease_name, language, description):
+        key = self._key(disease_name, language)
+        created = time.time()
+        with self._lock:
+            self._memory[key] = (description, created)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?, ?, ?)',
+                                 key + (description, created))
+
+    def items(self):
+        """(disease, language, description) stored for this model and prompt version, stale or not."""
+        entries = {}
+        with self._lock:
+            for key, (description, _) in self._memory.items():
+                if key[2:] == (self.model, self.prompt_version):
+                    entries[key[:2]] = description
+            if self._db is not None:
+                for disease_name, language, description in self._db.execute(
+                        'SELECT disease, language, description FROM descriptions WHERE model = ?'
+                        ' AND prompt_version = ?', (self.model, self.prompt_version)):
+                    entries.setdefault((disease_name, language), description)
+        return [key + (description,) for key, description in entries.items()]
+
+    def fetch(self, disease_name, language, api_key, url=None, timeout=15):
+        """Fetch a description from the API and store it."""
+        description = fetch_description(disease_name, language, api_key, url, self.model, timeout)
+        self.put(disease_name, language, description)
+        return description
+
+    def stream(self, disease_name, language, api_key, url=None, timeout=15):
+        """Stream a description from the API in the background; stored once complete."""
+        def chunks():
+            parts = []
+            for chunk in stream_description(disease_name, language, api_key, url, self.model, timeout):
+                parts.append(chunk)
+                yield chunk
+            self.put(disease_name, language, ''.join(parts))
+
+        return BackgroundStream(chunks())
+
+    def get_or_fetch(self, disease_name, language, api_key, url=None, timeout=15):
+        description = self.get(disease_name, language)
+        if description is None:
+            description = self.fetch(disease_name, language, api_key, url, timeout)
+        return description
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_description_store():
+    """Process-wide store configured from the environment.
+
+    BHOOMI_DESCRIPTION_DB   SQLite file (default .cache/descriptions.db, '' for memory only)
+    BHOOMI_DESCRIPTION_TTL  lifetime in seconds (default 30 days)
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DescriptionStore(
+                db_path=os.getenv('BHOOMI_DESCRIPTION_DB', DEFAULT_DB_PATH) or None,
+                ttl_seconds=float(os.getenv('BHOOMI_DESCRIPTION_TTL', DEFAULT_TTL_SECONDS)),
+            )
+        return _store
+
+
+def prewarm(store, api_key, languages=None, url=None, force=False):
+    """Fill the store for every disease x language; returns (fetched, skipped, failed)."""
+    fetched = skipped = failed = 0
+    for result in MANIFEST.labels():
+        disease_name = disease_name_of(result)
+        for language in languages or LANGUAGE_OPTIONS:
+            if not force and store.get(disease_name, language) is not None:
+                skipped += 1
+                continue
+            try:
+                store.fetch(disease_name, language, api_key, url)
+                fetched += 1
+            except DescriptionError as e:
+                print(f"{disease_name} / {language}: {e}", file=sys.stderr)
+                failed += 1
+    return fetched, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the disease description store.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    warm = commands.add_parser('prewarm', help='fetch every disease x language description')
+    warm.add_argument('--language', action='append', choices=list(LANGUAGE_OPTIONS),
+                      help='only these languages (repeatable; default: all)')
+    warm.add_argument('--url', help='chat-completions endpoint (default: $GROQ_API_URL or Groq)')
+    warm.add_argument('--force', action='store_true', help='refetch descriptions already stored')
+    args = parser.parse_args(argv)
+
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        parser.error('GROQ_API_KEY is not set')
+    fetched, skipped, failed = prewarm(get_description_store(), api_key, args.language, args.url,
+                                       args.force)
+    print(f"Fetched {fetched}, already stored {skipped}, failed {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
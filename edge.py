@@ -0,0 +1,393 @@
+# Edge profile: the detector on a Raspberry Pi-class ARM box in the village
+#
+#   pip install -r requirements-edge.txt      # numpy, OpenCV, LiteRT: no TensorFlow, no Streamlit
+#   python edge.py predict leaf.jpg photos/   # one line per image
+#   python edge.py serve --host 0.0.0.0       # POST /predict, GET /health, upload page at /
+#   python edge.py check                      # startup time and peak RSS against the budgets
+#   python edge.py check --cpus 1 --cpu-fraction 0.25    # on a throttled CPU
+#
+# The model is the INT8 TFLite export (export_model.py --formats int8, 4x
+# smaller than the Keras file), run by LiteRT or tflite-runtime; a process
+# that would have to fall back to TensorFlow refuses to start instead.
+# Preprocessing is OpenCV only, and JPEGs are decoded at the largest libjpeg
+# reduction that still covers the model input, so a 12-megapixel photo never
+# exists at full size in memory. PNGs cannot be decoded reduced and are
+# limited to MAX_PNG_PIXELS; other formats are refused. The server handles
+# one image at a time and answers 503 while the process is over its budget.
+#
+# Budgets (BHOOMI_EDGE_RSS_MB, default 150, and BHOOMI_EDGE_STARTUP_SECONDS,
+# default 3: process start to first prediction ready) are enforced by
+# `serve`, which exits if loading the model already exceeds the memory
+# budget, and checked by `check`, which starts a fresh process, classifies
+# a 4000x3000 JPEG and the largest accepted PNG, and exits non-zero if a
+# budget is exceeded or TensorFlow, Keras or Streamlit was imported.
+#
+# --cpus pins the process to that many cores, and --cpu-fraction lets it run
+# only that share of the time (SIGSTOP/SIGCONT every 20 ms, like cpulimit),
+# to approximate a slower CPU on a development machine; benchmark.py takes
+# the same options. For an ARM build, run the same commands in an arm64
+# container (docker run --platform linux/arm64 --cpus 1 --memory 150m ...).
+import argparse
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+from backends import TFLiteBackend
+from batch_predict import iter_image_paths
+from inference import decode_image, jpeg_size, predict_batch, preprocess, reduction_factor
+from model_manifest import MANIFEST, BoundModel
+from model_registry import current_rss_bytes
+from serve import UPLOAD_PAGE, BadRequest, PredictionHandler, prediction_response
+
+DEFAULT_EDGE_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts',
+                                  'plant_disease_model_int8.tflite')
+
+RSS_BUDGET_MB = float(os.getenv('BHOOMI_EDGE_RSS_MB', '150'))
+STARTUP_BUDGET_SECONDS = float(os.getenv('BHOOMI_EDGE_STARTUP_SECONDS', '3'))
+
+# Largest upload; the upload page sends tens of kilobytes
+MAX_BODY_BYTES = 8 * 2 ** 20
+
+# 2048x2048: 12 MiB decoded
+MAX_PNG_PIXELS = 2 ** 22
+
+# Modules whose presence means the profile has pulled in a heavy runtime
+FORBIDDEN_MODULES = ('tensorflow', 'keras', 'streamlit')
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Child process environment marker: the throttling has already been applied
+THROTTLED_ENV = 'BHOOMI_THROTTLED'
+
+
+class EdgeError(Exception):
+    pass
+
+
+def png_size(data):
+    """(width, height) from a PNG's IHDR chunk, or None if ``data`` is not a PNG."""
+    if data[:8] != _PNG_SIGNATURE or len(data) < 24:
+        return None
+    return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+
+def load_edge_model(path=None, num_threads=None):
+    """The INT8 TFLite model bound to its manifest entry; raises EdgeError rather than load TensorFlow."""
+    path = path or os.getenv('BHOOMI_EDGE_MODEL') or DEFAULT_EDGE_MODEL
+    spec = MANIFEST.resolve(path)
+    if not spec.path.endswith('.tflite'):
+        raise EdgeError(f"{spec.path} is not a TFLite model; export one with "
+                        "`python export_model.py --formats int8`")
+    if not os.path.exists(spec.path):
+        raise EdgeError(f"{spec.path} does not exist; export it with `python export_model.py --formats int8`")
+    try:
+        import ai_edge_litert  # noqa: F401
+    except ImportError:
+        try:
+            import tflite_runtime  # noqa: F401
+        except ImportError:
+            raise EdgeError("the edge profile needs ai-edge-litert or tflite-runtime "
+                            "(pip install -r requirements-edge.txt)") from None
+    model = BoundModel(TFLiteBackend(spec.path, num_threads=num_threads), spec)
+    # The interpreter allocates its tensors on the first call
+    predict_batch(model, [np.zeros(tuple(reversed(spec.input_size)) + (3,), np.uint8)])
+    return model
+
+
+def prepare(data, size):
+    """Model input for image bytes; raises EdgeError for formats or sizes outside the budget."""
+    if jpeg_size(data) is not None:
+        image = decode_image(data, reduction_factor(data, size))
+    else:
+        dimensions = png_size(data)
+        if dimensions is None:
+            raise EdgeError('the edge profile accepts JPEG and PNG images')
+        if dimensions[0] * dimensions[1] > MAX_PNG_PIXELS:
+            raise EdgeError(f'PNG larger than {MAX_PNG_PIXELS} pixels; send a JPEG')
+        image = decode_image(data)
+    if image is None:
+        raise EdgeError('could not decode image')
+    return preprocess(image, size)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MiB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 1024
+
+
+class EdgeHandler(PredictionHandler):
+    server_version = 'BhoomiSetu-Edge/1.0'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {
+                'status': 'ok',
+                'classes': list(self.server.model.labels),
+                'rss_mb': current_rss_bytes() / 2 ** 20,
+                'peak_rss_mb': peak_rss_mb(),
+                'rss_budget_mb': self.server.rss_budget_mb,
+            })
+        elif self.path == '/':
+            body = UPLOAD_PAGE.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        start = time.perf_counter()
+        if current_rss_bytes() > self.server.rss_budget_mb * 2 ** 20:
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            self._send_json(503, {'error': 'over the memory budget, try again shortly'})
+            return
+        try:
+            data = self._read_image_bytes()
+        except BadRequest as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        model = self.server.model
+        # One image in memory at a time keeps the peak predictable
+        with self.server.lock:
+            try:
+                image = prepare(data, model.input_size)
+            except EdgeError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            decoded = time.perf_counter()
+            probs = predict_batch(model, [image])[0]
+        body = prediction_response(probs, model.spec)
+        body['timing_ms'] = {
+            'decode': (decoded - start) * 1000,
+            'predict': (time.perf_counter() - decoded) * 1000,
+        }
+        self._send_json(200, body)
+
+    def _read_image_bytes(self):
+        if int(self.headers.get('Content-Length') or 0) > MAX_BODY_BYTES:
+            raise BadRequest(f'image larger than {MAX_BODY_BYTES} bytes')
+        return super()._read_image_bytes()
+
+
+def make_edge_server(model, host='127.0.0.1', port=8000, rss_budget_mb=RSS_BUDGET_MB, quiet=False):
+    server = ThreadingHTTPServer((host, port), EdgeHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.lock = threading.Lock()
+    server.rss_budget_mb = rss_budget_mb
+    server.quiet = quiet
+    return server
+
+
+def throttle(process, fraction, period=0.02):
+    """Let ``process`` run only ``fraction`` of each ``period`` until it exits; returns its exit code."""
+    try:
+        while process.poll() is None:
+            time.sleep(period * fraction)
+            process.send_signal(signal.SIGSTOP)
+            time.sleep(period * (1 - fraction))
+            process.send_signal(signal.SIGCONT)
+    except ProcessLookupError:
+        pass
+    return process.wait()
+
+
+def start_limited(command, cpus=None, cpu_fraction=1.0, **popen_args):
+    """Start ``command`` on at most ``cpus`` cores; returns the process and its throttling thread (or None)."""
+    env = dict(popen_args.pop('env', None) or os.environ, **{THROTTLED_ENV: '1'})
+    if cpus:
+        env.update(OMP_NUM_THREADS=str(cpus), BHOOMI_EDGE_THREADS=str(cpus))
+    preexec = None
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))[:cpus]
+
+        def preexec():
+            os.sched_setaffinity(0, cores)
+    process = subprocess.Popen(command, env=env, preexec_fn=preexec, **popen_args)
+    thread = None
+    if cpu_fraction < 1:
+        thread = threading.Thread(target=throttle, args=(process, cpu_fraction), daemon=True)
+        thread.start()
+    return process, thread
+
+
+def run_limited(command, cpus=None, cpu_fraction=1.0):
+    """Run ``command`` on a limited CPU (see start_limited); returns its exit code."""
+    process, thread = start_limited(command, cpus, cpu_fraction)
+    code = process.wait()
+    if thread is not None:
+        thread.join()
+    return code
+
+
+_CHILD = """
+import json, sys, time
+from edge import load_edge_model, peak_rss_mb, prepare
+from inference import predict_batch
+from model_registry import current_rss_bytes
+model = load_edge_model({model!r}, {threads!r})
+ready = time.time()
+rss_ready = current_rss_bytes()
+for path in {images!r}:
+    with open(path, 'rb') as image_file:
+        predict_batch(model, [prepare(image_file.read(), model.input_size)])
+print(json.dumps({{'ready': ready, 'rss_ready_mb': rss_ready / 2 ** 20, 'peak_rss_mb': peak_rss_mb(),
+                  'modules': sorted({{name.split('.')[0] for name in sys.modules}})}}))
+"""
+
+
+def worst_case_images(directory):
+    """A 4000x3000 phone-size JPEG and the largest PNG the profile accepts, written to ``directory``."""
+    import cv2
+
+    test_image = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Test Image', 'RS_Rust 2469.JPG')
+    leaf = cv2.imread(test_image)
+    if leaf is None:
+        leaf = np.random.default_rng(0).integers(0, 256, (256, 256, 3), np.uint8)
+    side = int(MAX_PNG_PIXELS ** 0.5)
+    paths = [os.path.join(directory, 'phone.jpg'), os.path.join(directory, 'largest.png')]
+    cv2.imwrite(paths[0], cv2.resize(leaf, (4000, 3000), interpolation=cv2.INTER_CUBIC),
+                [cv2.IMWRITE_JPEG_QUALITY, 95])
+    cv2.imwrite(paths[1], cv2.resize(leaf, (side, side), interpolation=cv2.INTER_CUBIC))
+    return paths
+
+
+def check(model_path=None, images=(), cpus=None, cpu_fraction=1.0):
+    """Start the profile in a fresh process and measure startup time and memory; returns a report."""
+    with tempfile.TemporaryDirectory() as directory:
+        paths = list(images) or worst_case_images(directory)
+        code = _CHILD.format(model=model_path, threads=cpus, images=paths)
+        start = time.time()
+        process, thread = start_limited([sys.executable, '-c', code], cpus, cpu_fraction,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__)))
+        stdout, stderr = process.communicate()
+        if thread is not None:
+            thread.join()
+    if process.returncode != 0:
+        raise EdgeError(f"edge profile failed to start:\n{stderr[-2000:]}")
+    child = json.loads(stdout.strip().splitlines()[-1])
+    return {
+        'startup_seconds': child['ready'] - start,
+        'rss_ready_mb': child['rss_ready_mb'],
+        'peak_rss_mb': child['peak_rss_mb'],
+        'images': paths if images else ['4000x3000 JPEG', f'{int(MAX_PNG_PIXELS ** 0.5)}px square PNG'],
+        'forbidden_modules': [name for name in FORBIDDEN_MODULES if name in child['modules']],
+        'cpus': cpus,
+        'cpu_fraction': cpu_fraction,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run the detector within an edge device budget.')
+    parser.add_argument('--model', help='INT8 .tflite model (default: $BHOOMI_EDGE_MODEL or '
+                                        'artifacts/plant_disease_model_int8.tflite)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('BHOOMI_EDGE_THREADS', '0')) or None,
+                        help='interpreter threads (default: all cores)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    predict = commands.add_parser('predict', help='classify image files')
+    predict.add_argument('inputs', nargs='+', help='image files, directories or glob patterns')
+    predict.add_argument('--json', action='store_true', help='print one JSON object per image')
+    serve = commands.add_parser('serve', help='serve predictions over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--quiet', action='store_true', help='do not log each request')
+    budget = commands.add_parser('check', help='measure startup time and peak RSS in a fresh process')
+    budget.add_argument('images', nargs='*', help='images to classify (default: worst-case photos)')
+    budget.add_argument('--cpus', type=int, help='pin to this many cores')
+    budget.add_argument('--cpu-fraction', type=float, default=1.0,
+                        help='run only this share of the time, to emulate a slower CPU (default: 1)')
+    budget.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == 'check':
+        if not 0 < args.cpu_fraction <= 1:
+            parser.error('--cpu-fraction must be in (0, 1]')
+        try:
+            report = check(args.model, args.images, args.cpus, args.cpu_fraction)
+        except EdgeError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        report.update(rss_budget_mb=RSS_BUDGET_MB, startup_budget_seconds=STARTUP_BUDGET_SECONDS)
+        print(f"Startup {report['startup_seconds']:.2f} s (budget {STARTUP_BUDGET_SECONDS:.1f} s), "
+              f"RSS {report['rss_ready_mb']:.0f} MiB when ready, peak {report['peak_rss_mb']:.0f} MiB "
+              f"(budget {RSS_BUDGET_MB:.0f} MiB)")
+        if args.json:
+            with open(args.json, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        failures = []
+        if report['startup_seconds'] > STARTUP_BUDGET_SECONDS:
+            failures.append('startup time over budget')
+        if report['peak_rss_mb'] > RSS_BUDGET_MB:
+            failures.append('peak RSS over budget')
+        if report['forbidden_modules']:
+            failures.append(f"imported {', '.join(report['forbidden_modules'])}")
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+
+    try:
+        model = load_edge_model(args.model, args.threads)
+    except EdgeError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    if args.command == 'predict':
+        classified = 0
+        for path in iter_image_paths(args.inputs):
+            with open(path, 'rb') as image_file:
+                data = image_file.read()
+            try:
+                probs = predict_batch(model, [prepare(data, model.input_size)])[0]
+            except EdgeError as e:
+                print(f"{path}: {e}", file=sys.stderr)
+                continue
+            classified += 1
+            response = prediction_response(probs, model.spec)
+            if args.json:
+                print(json.dumps(dict(response, file=path), ensure_ascii=False))
+            else:
+                status = ' (unknown)' if response['unknown'] else ''
+                print(f"{path}: {response['label']} {response['confidence']:.1%}{status}")
+        return 0 if classified else 1
+
+    rss_mb = current_rss_bytes() / 2 ** 20
+    if rss_mb > RSS_BUDGET_MB:
+        print(f"error: {rss_mb:.0f} MiB resident after loading the model, over the {RSS_BUDGET_MB:.0f} MiB "
+              "budget", file=sys.stderr)
+        return 1
+    server = make_edge_server(model, args.host, args.port, quiet=args.quiet)
+    print(f"Serving predictions on http://{args.host}:{server.server_port}/predict "
+          f"({rss_mb:.0f} MiB resident, budget {RSS_BUDGET_MB:.0f} MiB)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# Export the Keras model to lightweight CPU inference formats
+#
+#   python export_model.py                      # fp16 + int8 TFLite and ONNX into artifacts/
+#   python export_model.py --formats int8 --calibration path/to/leaf/images
+#
+# Writes:
+#   artifacts/plant_disease_model_fp16.tflite   float16 weights
+#   artifacts/plant_disease_model_int8.tflite   post-training INT8, calibrated on sample images
+#   artifacts/plant_disease_model.onnx          float32 ONNX
+#   artifacts/export_report.json                parity and latency/memory comparison
+#   artifacts/<artifact stem>.model.json        labels and preprocessing (see model_manifest.py)
+#
+# Exports take the same input as the source model, so each one is bound to
+# the source's labels and preprocessing; INT8 calibration and the parity
+# check feed images prepared that way. The two image sets are kept disjoint
+# (by default every third sample image is held out for the parity check), so
+# INT8 agreement is measured on images the quantizer was not calibrated on.
+#
+# Every artifact is checked against the Keras model (top-1 agreement and the
+# largest probability difference) and profiled in a fresh subprocess, so the
+# load time and resident memory include importing its runtime. The RSS column
+# is measured after a single-image prediction; batch-32 peaks are in the
+# JSON report.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from batch_predict import iter_image_paths
+from inference import decode_image, preprocess
+from model_manifest import MANIFEST, write_binding
+from model_registry import DEFAULT_MODEL_PATH
+
+FORMATS = ('fp16', 'int8', 'onnx')
+
+DEFAULT_IMAGES = 'Test Image'
+# Without --calibration or --eval, every third default image is held out of
+# INT8 calibration for the parity check
+PARITY_HOLD_OUT = 3
+
+
+def augmented(images):
+    """The eight flips/rotations of each image; cheap extra samples for calibration."""
+    for image in images:
+        for k in range(4):
+            rotated = np.rot90(image, k)
+            yield np.ascontiguousarray(rotated)
+            yield np.ascontiguousarray(rotated[:, ::-1])
+
+
+def load_images(sources, limit=None, size=(256, 256)):
+    images = []
+    for path in iter_image_paths(sources, recursive=True):
+        with open(path, 'rb') as image_file:
+            image = decode_image(image_file.read())
+        if image is not None:
+            images.append(preprocess(image, size))
+        if limit and len(images) >= limit:
+            break
+    return images
+
+
+def split_images(calibration_sources=None, eval_sources=None):
+    """Disjoint (calibration, parity) image paths; raises ValueError if the given sets overlap.
+
+    A set that is not given is made of the default images the other one
+    does not use.
+    """
+    def paths(sources):
+        return list(dict.fromkeys(os.path.abspath(path) for path in iter_image_paths(sources, recursive=True)))
+
+    defaults = paths([DEFAULT_IMAGES])
+    held_out = defaults[1::PARITY_HOLD_OUT]
+    evaluation = paths(eval_sources) if eval_sources else None
+    if calibration_sources:
+        calibration = paths(calibration_sources)
+    else:
+        excluded = set(held_out if evaluation is None else evaluation)
+        calibration = [path for path in defaults if path not in excluded]
+    if evaluation is None:
+        evaluation = [path for path in (defaults if calibration_sources else held_out) if path not in calibration]
+    overlap = set(calibration) & set(evaluation)
+    if overlap:
+        raise ValueError(f"{len(overlap)} images are both calibration and parity images, "
+                         f"e.g. {sorted(overlap)[0]}; the parity check would overstate INT8 accuracy")
+    return calibration, evaluation
+
+
+def export_tflite(model, output_path, quantization, calibration_images=()):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output_path, 'wb') as artifact:
+        artifact.write(converter.convert())
+
+
+def export_onnx(model, output_path, opset=13):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input'),)
+    # tf2onnx.convert.from_keras does not understand Keras 3 models; tracing
+    # the call as a tf.function works for both
+    function = tf.function(lambda batch: model(batch, training=False))
+    tf2onnx.convert.from_function(function, input_signature=spec, opset=opset, output_path=output_path)
+
+
+def parity(reference, candidate):
+    """Top-1 agreement and largest absolute probability difference."""
+    return {
+        'top1_agreement': float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1))),
+        'max_abs_diff': float(np.abs(reference - candidate).max()),
+    }
+
+
+def profile(path, runs=20, batch_size=32):
+    """Load one artifact and time it; run in a fresh process for honest memory numbers."""
+    from model_registry import current_rss_bytes
+
+    rss_start = current_rss_bytes()
+    start = time.perf_counter()
+    from backends import load_backend
+    backend = load_backend(path)
+    load_seconds = time.perf_counter() - start
+    shape = tuple(dim or 1 for dim in backend.input_shape)
+    single = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    batch = np.repeat(single, batch_size, axis=0)
+    backend.predict(single)
+    # Memory to serve single images; larger batches add activation buffers
+    rss_serving = current_rss_bytes()
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.predict(single)
+        latencies.append(time.perf_counter() - start)
+    backend.predict(batch)
+    start = time.perf_counter()
+    for _ in range(max(runs // 4, 1)):
+        backend.predict(batch)
+    batch_seconds = (time.perf_counter() - start) / max(runs // 4, 1)
+    return {
+        'backend': backend.name,
+        'load_seconds': load_seconds,
+        'rss_mib': rss_serving / 2 ** 20,
+        'rss_growth_mib': (rss_serving - rss_start) / 2 ** 20,
+        f'rss_mib_batch{batch_size}': current_rss_bytes() / 2 ** 20,
+        'p50_ms_batch1': float(np.median(latencies) * 1000),
+        f'images_per_second_batch{batch_size}': batch_size / batch_seconds,
+    }
+
+
+def profile_in_subprocess(path):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--profile', path],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_table(rows):
+    print(f"| {'artifact':<38} | {'size KiB':>8} | {'load s':>6} | {'RSS MiB':>7} | "
+          f"{'p50 ms (1)':>10} | {'img/s (32)':>10} | {'top-1 agree':>11} | {'max |Δp|':>8} |")
+    print(f"|{'-' * 40}|{'-' * 10}|{'-' * 8}|{'-' * 9}|{'-' * 12}|{'-' * 12}|{'-' * 13}|{'-' * 10}|")
+    for row in rows:
+        print(f"| {os.path.basename(row['path']):<38} | {row['size_kib']:>8.0f} | {row['load_seconds']:>6.2f} | "
+              f"{row['rss_mib']:>7.0f} | {row['p50_ms_batch1']:>10.2f} | "
+              f"{row['images_per_second_batch32']:>10.1f} | {row['top1_agreement']:>11.1%} | "
+              f"{row['max_abs_diff']:>8.4f} |")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Export the model to TFLite and ONNX.')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='Keras model (models.json name or file)')
+    parser.add_argument('--out-dir', default='artifacts', help='output directory (default: artifacts)')
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help=f"comma-separated subset of {','.join(FORMATS)} (default: all)")
+    parser.add_argument('--calibration', action='append',
+                        help='images (dir/glob) for INT8 calibration (default: Test Image, '
+                             'less the parity images)')
+    parser.add_argument('--calibration-samples', type=int, default=200,
+                        help='maximum calibration samples including augmentations (default: 200)')
+    parser.add_argument('--eval', action='append',
+                        help='images (dir/glob) for the parity check, disjoint from the calibration images '
+                             '(default: every third image of Test Image)')
+    parser.add_argument('--no-compare', action='store_true', help='skip the parity check and profiling')
+    parser.add_argument('--profile', metavar='ARTIFACT', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        print(json.dumps(profile(args.profile)))
+        return 0
+
+    formats = [fmt for fmt in args.formats.split(',') if fmt]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        build_parser().error(f"unknown format(s): {', '.join(sorted(unknown))}")
+
+    try:
+        calibration_paths, eval_paths = split_images(args.calibration, args.eval)
+    except ValueError as e:
+        build_parser().error(str(e))
+    if not args.no_compare and not eval_paths:
+        build_parser().error('no parity images left; pass --eval')
+
+    from keras.models import load_model
+    spec = MANIFEST.resolve(args.model)
+    model = load_model(spec.path)
+    os.makedirs(args.out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(spec.path))[0]
+
+    artifacts = []
+    for fmt in formats:
+        if fmt == 'onnx':
+            path = os.path.join(args.out_dir, f'{stem}.onnx')
+            export_onnx(model, path)
+        else:
+            path = os.path.join(args.out_dir, f'{stem}_{fmt}.tflite')
+            calibration = []
+            if fmt == 'int8':
+                samples = augmented(load_images(calibration_paths, size=spec.input_size))
+                calibration = [spec.prepare(image) for image, _ in zip(samples, range(args.calibration_samples))]
+                if not calibration:
+                    build_parser().error('no calibration images found')
+            export_tflite(model, path, fmt, calibration)
+        write_binding(spec, path)
+        print(f"Wrote {path} ({os.path.getsize(path) / 1024:.0f} KiB)", file=sys.stderr)
+        artifacts.append(path)
+
+    if args.no_compare:
+        return 0
+
+    from backends import load_backend
+    eval_images = spec.prepare(np.stack(list(augmented(load_images(eval_paths, size=spec.input_size)))))
+    reference = model.predict(eval_images, verbose=0)
+    rows = []
+    for path in [spec.path] + artifacts:
+        row = {'path': path, 'size_kib': os.path.getsize(path) / 1024}
+        row.update(parity(reference, load_backend(path).predict(eval_images)))
+        row.update(profile_in_subprocess(path))
+        rows.append(row)
+    print_table(rows)
+    with open(os.path.join(args.out_dir, 'export_report.json'), 'w') as report:
+        json.dump({'calibration_images': calibration_paths if 'int8' in formats else [],
+                   'eval_images': eval_paths, 'artifacts': rows}, report, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
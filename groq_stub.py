@@ -0,0 +1,121 @@
+# Local stand-in for the Groq chat-completions API
+#
+#   python groq_stub.py --port 8808 --token-delay 0.02
+#   GROQ_API_URL=http://127.0.0.1:8808/openai/v1/chat/completions GROQ_API_KEY=stub streamlit run main_app.py
+#
+# Answers every request with a canned description that echoes the prompt, so
+# the description store and the app can be exercised without network access.
+# Requests with "stream": true get the answer word by word as server-sent
+# events, and --fail-first makes the first N requests return 503 to exercise
+# the client's retries.
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = '/openai/v1/chat/completions'
+
+
+def canned_description(prompt):
+    return (f"Stub description for: {prompt}\n\n"
+            "**Symptoms:** spots or lesions on the leaves.\n\n"
+            "**Causes:** a plant pathogen favoured by warm, humid weather.\n\n"
+            "**Treatment:** remove infected leaves and consult a local agronomist.")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path != COMPLETIONS_PATH:
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        with self.server.lock:
+            self.server.requests += 1
+            fail = self.server.requests <= self.server.fail_first
+        if fail:
+            self._send_json(503, {'error': {'message': 'stub failure'}})
+            return
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        prompt = body.get('messages', [{}])[-1].get('content', '')
+        if body.get('stream'):
+            self._stream(body, canned_description(prompt))
+            return
+        self._send_json(200, {
+            'id': f'stub-{self.server.requests}',
+            'object': 'chat.completion',
+            'model': body.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': canned_description(prompt)},
+                'finish_reason': 'stop',
+            }],
+        })
+
+    def _stream(self, body, text):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            chunk = {
+                'id': f'stub-{self.server.requests}',
+                'object': 'chat.completion.chunk',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': word if i == 0 else ' ' + word},
+                             'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(host='127.0.0.1', port=0, delay=0.0, token_delay=0.0, fail_first=0):
+    """Run the stub on a background thread; returns (server, completions URL)."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.delay = delay
+    server.token_delay = token_delay
+    server.fail_first = fail_first
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}{COMPLETIONS_PATH}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake Groq chat-completions API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--token-delay', type=float, default=0.0,
+                        help='seconds between streamed words')
+    parser.add_argument('--fail-first', type=int, default=0,
+                        help='answer the first N requests with 503')
+    args = parser.parse_args()
+    server, url = start_stub(args.host, args.port, args.delay, args.token_delay, args.fail_first)
+    print(f"Stub chat-completions endpoint at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
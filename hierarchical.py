@@ -0,0 +1,324 @@
+# Two-stage inference: identify the crop on a small image, then run only that crop's disease head
+#
+#   python hierarchical.py "Test Image/"                   # classify with the models in models.json
+#   python hierarchical.py --bench                         # FLOPs and latency against the flat model
+#   python hierarchical.py --bench --synthetic             # same for PlantVillage-sized architectures
+#
+# models.json names the crop model ("crop_model", a "kind": "crop" entry
+# whose labels are crop names) next to the disease models. Each image goes
+# through the crop model at its own, much smaller input size (64x64 by
+# default); then the images of each crop go in one batch to the most
+# specialised disease model covering it (Manifest.route), loaded on first use
+# through the model registry. Crops with a single class need no head at all.
+#
+# The reported confidence is P(crop) x P(disease | crop). A head that also
+# covers other crops is restricted to the chosen crop's labels and
+# renormalised, so the disease always agrees with the crop.
+#
+# --synthetic builds untrained Keras models shaped like a 38-class
+# PlantVillage deployment: the notebook CNN as the flat classifier against
+# the crop model plus one head per crop (--head-width scales the heads'
+# filters). Images are assigned to crops in PlantVillage proportions, so the
+# FLOPs and latency are representative even though the weights are not.
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from batch_predict import iter_image_paths
+from inference import decode_image, predict_batch, preprocess
+from model_manifest import MANIFEST, BoundModel, ManifestError, ModelSpec
+
+# PlantVillage (colour) classes and approximate images per crop
+PLANTVILLAGE_CROPS = {
+    'Apple': (4, 3171), 'Blueberry': (1, 1502), 'Cherry': (2, 1906), 'Corn': (4, 3852),
+    'Grape': (4, 4062), 'Orange': (1, 5507), 'Peach': (2, 2657), 'Pepper': (2, 2475),
+    'Potato': (3, 2152), 'Raspberry': (1, 371), 'Soybean': (1, 5090), 'Squash': (1, 1835),
+    'Strawberry': (2, 1565), 'Tomato': (10, 18160),
+}
+
+
+def disease_of(probabilities, labels, crop):
+    """(label, probability) of the best disease of ``crop``, renormalised over that crop's labels."""
+    columns = [column for column, label in enumerate(labels) if label.split('-')[0] == crop]
+    if not columns:
+        raise ManifestError(f"no disease model covers {crop}")
+    probabilities = np.asarray(probabilities)[columns]
+    best = int(probabilities.argmax())
+    return labels[columns[best]], float(probabilities[best] / max(float(probabilities.sum()), 1e-12))
+
+
+class TwoStageClassifier:
+    """Crop model first, then one disease head per predicted crop.
+
+    ``head_for(crop)`` returns (disease model or None, its labels); the model
+    may be None when only one of the labels belongs to ``crop``.
+    """
+
+    def __init__(self, crop_model, head_for):
+        self.crop_model = crop_model
+        self.head_for = head_for
+
+    @classmethod
+    def from_manifest(cls, manifest=MANIFEST, registry=None):
+        """The crop model and routed heads of ``manifest``, loaded lazily through ``registry``."""
+        if registry is None:
+            from model_registry import registry
+        if manifest.crop_model is None:
+            raise ManifestError("models.json has no crop_model for two-stage inference")
+
+        def head_for(crop):
+            spec = manifest.route(crop)
+            if sum(label.split('-')[0] == crop for label in spec.labels) == 1:
+                return None, spec.labels
+            return registry.get(spec.path, warm_up=True), spec.labels
+
+        return cls(registry.get(manifest.crop_model, warm_up=True), head_for)
+
+    def predict(self, images):
+        """Classify decoded BGR images; returns one result dict per image."""
+        crop_probs = predict_batch(self.crop_model,
+                                   [preprocess(image, self.crop_model.input_size) for image in images])
+        crop_index = crop_probs.argmax(axis=1)
+        results = [None] * len(images)
+        for index in np.unique(crop_index):
+            crop = self.crop_model.labels[index]
+            rows = np.flatnonzero(crop_index == index)
+            head, labels = self.head_for(crop)
+            if head is None:
+                # One class for this crop: nothing left to tell apart
+                disease_probs = np.ones((len(rows), len(labels)), np.float32)
+            else:
+                disease_probs = predict_batch(head, [preprocess(images[row], head.input_size) for row in rows])
+            for row, probs in zip(rows, disease_probs):
+                label, disease_confidence = disease_of(probs, labels, crop)
+                crop_confidence = float(crop_probs[row, index])
+                results[row] = {
+                    'label': label,
+                    'crop': crop,
+                    'crop_confidence': crop_confidence,
+                    'disease_confidence': disease_confidence,
+                    'confidence': crop_confidence * disease_confidence,
+                }
+        return results
+
+
+def keras_flops(model):
+    """FLOPs of one image through a Keras model: 2 x multiply-adds of its convolution and dense layers."""
+    from keras.layers import Conv2D, Dense
+
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, Conv2D):
+            kernel_height, kernel_width, channels_in, channels_out = layer.kernel.shape
+            _, height, width, _ = layer.output.shape
+            flops += 2 * height * width * kernel_height * kernel_width * channels_in * channels_out
+        elif isinstance(layer, Dense):
+            inputs, units = layer.kernel.shape
+            flops += 2 * inputs * units
+    return int(flops)
+
+
+def tflite_flops(interpreter):
+    """The same count for a TFLite interpreter, read from its convolution and fully connected ops.
+
+    None if the interpreter does not expose its ops (``_get_ops_details`` is private API).
+    """
+    if not hasattr(interpreter, '_get_ops_details'):
+        return None
+    shapes = {tensor['index']: tuple(int(dim) for dim in tensor['shape'])
+              for tensor in interpreter.get_tensor_details()}
+    flops = 0
+    for op in interpreter._get_ops_details():
+        if op['op_name'] not in ('CONV_2D', 'DEPTHWISE_CONV_2D', 'FULLY_CONNECTED'):
+            continue
+        weights = shapes[op['inputs'][1]]
+        if op['op_name'] == 'FULLY_CONNECTED':
+            flops += 2 * weights[0] * weights[1]
+            continue
+        _, height, width, channels_out = shapes[op['outputs'][0]]
+        # CONV_2D filters are (out, kh, kw, in); depthwise ones (1, kh, kw, out)
+        channels_in = weights[3] if op['op_name'] == 'CONV_2D' else 1
+        flops += 2 * height * width * weights[1] * weights[2] * channels_in * channels_out
+    return flops
+
+
+def model_flops(model):
+    """FLOPs per image of a BoundModel's Keras or TFLite backend; None for other formats."""
+    keras_model = getattr(model.backend, 'model', None)
+    if keras_model is not None:
+        return keras_flops(keras_model)
+    interpreter = getattr(model.backend, 'interpreter', None)
+    return tflite_flops(interpreter) if interpreter is not None else None
+
+
+class _KerasModel:
+    """Backend interface over an in-memory Keras model.
+
+    Calls a compiled graph instead of model.predict, whose ~100 ms fixed
+    cost per call would swamp the comparison; deployed heads run as TFLite
+    or ONNX, where a call costs about as little.
+    """
+
+    name = 'keras'
+
+    def __init__(self, model):
+        import tensorflow as tf
+
+        self.model = model
+        self.input_shape = tuple(model.input_shape)
+        signature = [tf.TensorSpec(self.input_shape, tf.uint8)]
+        self._call = tf.function(lambda batch: model(batch, training=False), input_signature=signature)
+        # Trace now, not inside the timed runs
+        self.predict(np.zeros((1,) + self.input_shape[1:], np.uint8))
+
+    def predict(self, batch):
+        return self._call(batch).numpy()
+
+
+class _ProportionalCrops:
+    """Runs the (untrained) crop model for timing, then answers crops in PlantVillage proportions."""
+
+    def __init__(self, model, seed=0):
+        self.model = model
+        self.backend = model.backend
+        self.labels = model.labels
+        self.input_size = model.input_size
+        counts = np.array([PLANTVILLAGE_CROPS[crop][1] for crop in self.labels], np.float64)
+        self._weights = counts / counts.sum()
+        self._rng = np.random.default_rng(seed)
+
+    def predict(self, batch):
+        self.model.predict(batch)
+        choice = self._rng.choice(len(self.labels), size=len(batch), p=self._weights)
+        return np.eye(len(self.labels), dtype=np.float32)[choice]
+
+
+def synthetic_models(head_width=1.0, crop_input_size=(64, 64)):
+    """(flat model, two-stage classifier, {crop: head}) of untrained PlantVillage-sized models."""
+    from training import build_crop_model, build_model
+
+    def bound(model, name, labels, input_size):
+        return BoundModel(_KerasModel(model), ModelSpec(name, name, labels, input_size,
+                                                        kind='disease' if '-' in labels[0] else 'crop'))
+
+    labels = {crop: [f'{crop}-class_{i}' for i in range(classes)]
+              for crop, (classes, _) in PLANTVILLAGE_CROPS.items()}
+    flat = bound(build_model(sum(len(names) for names in labels.values())), 'flat',
+                 [label for names in labels.values() for label in names], (256, 256))
+    crop_model = bound(build_crop_model(len(labels), crop_input_size), 'crop', list(labels), crop_input_size)
+    heads = {crop: bound(build_model(len(names), width=head_width), f'head-{crop}', names, (256, 256))
+             for crop, names in labels.items() if len(names) > 1}
+    classifier = TwoStageClassifier(_ProportionalCrops(crop_model),
+                                    lambda crop: (heads.get(crop), labels[crop]))
+    return flat, classifier, heads
+
+
+def bench(flat, classifier, heads, images, batch_sizes=(1, 32), repeats=10):
+    """FLOPs per image and latency of the flat model against the two-stage classifier."""
+    from benchmark import summarize, time_calls
+
+    crop_flops = model_flops(classifier.crop_model)
+    head_flops = {crop: model_flops(head) for crop, head in heads.items()}
+    # Which heads actually run depends on the predicted crops
+    crops = [result['crop'] for result in classifier.predict(images * 4)]
+    report = {'flat_flops': model_flops(flat), 'two_stage_flops': None}
+    if crop_flops is not None and None not in head_flops.values():
+        report['two_stage_flops'] = crop_flops + float(np.mean([head_flops.get(crop, 0) for crop in crops]))
+    report['crop_flops'] = crop_flops
+    report['head_skipped'] = float(np.mean([crop not in heads for crop in crops]))
+
+    def run_flat(batch):
+        return predict_batch(flat, [preprocess(image, flat.input_size) for image in batch])
+
+    for batch_size in batch_sizes:
+        batch = [images[i % len(images)] for i in range(batch_size)]
+        runs = max(3, repeats * 8 // max(batch_size, 8))
+        for name, fn in (('flat', run_flat), ('two_stage', classifier.predict)):
+            summary = summarize(time_calls(fn, [batch], runs), batch_size)
+            report[f'{name}/batch{batch_size}'] = summary
+    return report
+
+
+def print_report(report):
+    def gflops(value):
+        return 'n/a' if value is None else f'{value / 1e9:.3f}'
+
+    print(f"FLOPs per image: flat {gflops(report['flat_flops'])} G, "
+          f"two-stage {gflops(report['two_stage_flops'])} G "
+          f"(crop model {gflops(report['crop_flops'])} G, no head needed for {report['head_skipped']:.0%})")
+    if report['flat_flops'] and report['two_stage_flops']:
+        print(f"Two-stage saves {1 - report['two_stage_flops'] / report['flat_flops']:.0%} of the FLOPs")
+    print(f"\n{'mode':<22} {'p50 ms':>9} {'ms/image':>9} {'images/s':>9}")
+    for name, row in report.items():
+        if isinstance(row, dict):
+            print(f"{name:<22} {row['p50_ms']:>9.2f} {row['p50_ms'] / row['items_per_call']:>9.2f} "
+                  f"{row['throughput_per_s']:>9.1f}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Two-stage (crop, then disease) plant disease inference.')
+    parser.add_argument('inputs', nargs='*', help='image files, directories or glob patterns to classify')
+    parser.add_argument('--bench', action='store_true', help='compare FLOPs and latency with the flat model')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='benchmark untrained PlantVillage-sized models instead of models.json')
+    parser.add_argument('--head-width', type=float, default=1.0,
+                        help='filter multiplier of the synthetic disease heads (default: 1.0)')
+    parser.add_argument('--images', default='Test Image', help='benchmark images (default: Test Image)')
+    parser.add_argument('--repeats', type=int, default=10, help='timed runs per measurement (default: 10)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.bench and not args.inputs:
+        build_parser().error('give images to classify or --bench')
+
+    try:
+        if args.synthetic:
+            flat, classifier, heads = synthetic_models(args.head_width)
+        else:
+            classifier = TwoStageClassifier.from_manifest()
+            if args.bench:
+                from model_registry import get_model
+                flat = get_model(MANIFEST.default_model, warm_up=True)
+                heads = {crop: head for crop, head in
+                         ((crop, classifier.head_for(crop)[0]) for crop in classifier.crop_model.labels)
+                         if head is not None}
+    except ManifestError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    if args.bench:
+        images = []
+        for path in iter_image_paths([args.images]):
+            with open(path, 'rb') as image_file:
+                images.append(decode_image(image_file.read(), reduce='auto'))
+        if not images:
+            from benchmark import synthetic_jpeg
+            images = [decode_image(synthetic_jpeg(1280, 960, seed)) for seed in range(3)]
+        print_report(bench(flat, classifier, heads, [image for image in images if image is not None],
+                           repeats=args.repeats))
+        return 0
+
+    start = time.perf_counter()
+    paths = list(iter_image_paths(args.inputs))
+    images = []
+    for path in paths:
+        with open(path, 'rb') as image_file:
+            images.append(decode_image(image_file.read(), reduce='auto'))
+    readable = [(path, image) for path, image in zip(paths, images) if image is not None]
+    results = classifier.predict([image for _, image in readable]) if readable else []
+    for (path, _), result in zip(readable, results):
+        print(f"{path}: {result['label']} ({result['confidence']:.1%} = crop {result['crop_confidence']:.1%}"
+              f" x disease {result['disease_confidence']:.1%})")
+    for path, image in zip(paths, images):
+        if image is None:
+            print(f"{path}: could not decode image", file=sys.stderr)
+    print(f"Classified {len(results)} image(s) in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    return 0 if results else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# Shared image -> disease pipeline used by the Streamlit app and the CLI tools
+import numpy as np
+import cv2
+
+from model_manifest import MANIFEST
+
+# Name of Classes, in the default model's output order (models.json binds
+# every model to its own labels; loaded models carry them as model.labels)
+CLASS_NAMES = MANIFEST.default.labels
+
+# Model input size (width, height)
+IMAGE_SIZE = (256, 256)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Pixel scaling applied inside models built by training.py (their first layer),
+# so every model takes the uint8 output of preprocess() as is
+PIXEL_SCALE = 1 / 255.0
+
+
+# Decode flags for each downscale factor. For JPEG, libjpeg scales during the
+# IDCT, so a 4000x3000 photo is never decoded at full resolution.
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data):
+    """Read (width, height) from a JPEG header without decoding (None if not a JPEG)."""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before the marker
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # Markers without a length field
+            i += 2
+            continue
+        if marker in _SOF_MARKERS and i + 9 <= len(data):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+def reduction_factor(data, target=IMAGE_SIZE):
+    """Largest decode downscale that still leaves at least ``target`` pixels."""
+    size = jpeg_size(data)
+    if size is None:
+        return 1
+    width, height = size
+    for factor in (8, 4, 2):
+        if width // factor >= target[0] and height // factor >= target[1]:
+            return factor
+    return 1
+
+
+def decode_image(data, reduce=1):
+    """Decode encoded image bytes into a BGR OpenCV image (None if undecodable).
+
+    ``reduce`` decodes at 1/2, 1/4 or 1/8 scale; 'auto' picks the largest
+    factor that keeps the image at least model-input sized.
+    """
+    if reduce == 'auto':
+        reduce = reduction_factor(data)
+    file_bytes = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(file_bytes, REDUCED_DECODE_FLAGS[reduce])
+
+
+def preprocess(image, size=IMAGE_SIZE):
+    """Resize a decoded BGR image to the model input size (width, height)."""
+    return cv2.resize(image, tuple(size))
+
+
+# Test-time augmentation: the frame itself, then alternately flips/right-angle
+# rotations of the resized image and crops (TTA_CROP of each side) of the
+# decoded one. Variant 0 is always the plain prediction.
+TTA_CROP = 0.85
+
+_TTA_TRANSFORMS = (
+    lambda image: image,
+    lambda image: image[:, ::-1],
+    ('crop', 0.5, 0.5),
+    lambda image: image[::-1],
+    lambda image: np.rot90(image, 1),
+    ('crop', 0.0, 0.0),
+    lambda image: np.rot90(image, 3),
+    ('crop', 1.0, 1.0),
+    lambda image: np.rot90(image, 2),
+    ('crop', 1.0, 0.0),
+    lambda image: image.transpose(1, 0, 2),
+    ('crop', 0.0, 1.0),
+)
+
+TTA_MAX_VARIANTS = len(_TTA_TRANSFORMS)
+
+
+def tta_variants(image, n, size=IMAGE_SIZE):
+    """``n`` (1..TTA_MAX_VARIANTS) augmented copies of a decoded BGR image, each resized to ``size``."""
+    if not 1 <= n <= TTA_MAX_VARIANTS:
+        raise ValueError(f"TTA takes 1 to {TTA_MAX_VARIANTS} variants, not {n}")
+    resized = preprocess(image, size)
+    height, width = image.shape[:2]
+    crop_height, crop_width = int(height * TTA_CROP), int(width * TTA_CROP)
+    variants = []
+    for transform in _TTA_TRANSFORMS[:n]:
+        if isinstance(transform, tuple):
+            _, y, x = transform
+            top = int((height - crop_height) * y)
+            left = int((width - crop_width) * x)
+            variants.append(preprocess(image[top:top + crop_height, left:left + crop_width], size))
+        else:
+            variants.append(np.ascontiguousarray(transform(resized)))
+    return variants
+
+
+def tta_summary(probabilities):
+    """Mean softmax over the variants, and the share of variants whose top class agrees with it.
+
+    Agreement is 1.0 when every view of the leaf gives the same answer; lower
+    values mean the prediction depends on framing and deserves less trust.
+    """
+    probabilities = np.asarray(probabilities)
+    mean = probabilities.mean(axis=0)
+    agreement = float(np.mean(probabilities.argmax(axis=1) == mean.argmax()))
+    return mean, agreement
+
+
+def predict_batch(model, images):
+    """Run one model.predict over a list of preprocessed images.
+
+    Returns an (N, len(model.labels)) array of softmax probabilities.
+    """
+    batch = np.stack(images)
+    return model.predict(batch)
+
+
+def label_of(probabilities, labels=CLASS_NAMES):
+    return labels[int(np.argmax(probabilities))]
+
+
+# Alternatives shown next to the top prediction
+TOP_K = 3
+
+
+def top_k(probabilities, labels=CLASS_NAMES, k=TOP_K):
+    """The ``k`` most likely (label, probability) pairs, best first."""
+    probabilities = np.asarray(probabilities)
+    order = np.argsort(probabilities)[::-1][:k]
+    return [(labels[int(index)], float(probabilities[index])) for index in order]
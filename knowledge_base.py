@@ -0,0 +1,361 @@
+# Offline disease descriptions: a bundled, memory-mapped knowledge base
+#
+#   python knowledge_base.py build                         # knowledge_base.json + stored descriptions
+#   python knowledge_base.py refresh                       # fetch what is missing from the LLM, rebuild
+#   python knowledge_base.py lookup "Early blight" Hindi
+#   python knowledge_base.py info
+#   python knowledge_base.py bench
+#
+# Without a connection to the Groq API the app used to have nothing to say
+# about a disease. knowledge_base.json holds a reviewed description of every
+# disease the models know (symptoms, causes, treatment), and `build` compiles
+# it, together with every LLM description in the description store, into one
+# file (default .cache/knowledge_base.bin, BHOOMI_KNOWLEDGE_BASE):
+#
+#   header   b'BKB1', entry count (uint32)
+#   index    one record per entry: 64-bit hash of 'disease\0language',
+#            offset, key length, text length, source; sorted by hash
+#   data     'disease\0language' followed by the UTF-8 description
+#
+# The file is memory-mapped and the index is a numpy view into it, so a
+# lookup is one hash, a binary search and a slice: a few microseconds,
+# whatever the number of entries, and nothing is read until it is used.
+# Languages without an entry fall back to English.
+#
+# When the API is reachable, start_background_refresh() fetches every
+# disease x language description the store does not have yet on a daemon
+# thread, then rewrites the file atomically; readers notice the new file
+# within RELOAD_CHECK_SECONDS. A failed request ends the round (the network
+# is probably down) and the next one starts after BHOOMI_KB_RETRY_INTERVAL.
+# Point GROQ_API_URL at groq_stub.py to exercise all of this offline.
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from descriptions import DescriptionError, disease_name_of, get_description_store
+from model_manifest import MANIFEST
+from prompts import LANGUAGE_OPTIONS
+
+DEFAULT_BUNDLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_base.json')
+DEFAULT_PATH = os.path.join('.cache', 'knowledge_base.bin')
+
+FALLBACK_LANGUAGE = 'English'
+
+SOURCES = ('bundled', 'llm')
+
+REFRESH_INTERVAL = float(os.getenv('BHOOMI_KB_REFRESH_INTERVAL', 6 * 3600))
+RETRY_INTERVAL = float(os.getenv('BHOOMI_KB_RETRY_INTERVAL', 300))
+
+# How often a reader checks whether the file has been rebuilt
+RELOAD_CHECK_SECONDS = 5.0
+
+MAGIC = b'BKB1'
+_HEADER = struct.Struct('<4sI')
+_RECORD = np.dtype([('hash', '<u8'), ('offset', '<u8'), ('key_length', '<u2'), ('length', '<u4'),
+                    ('source', 'u1')])
+
+
+class KnowledgeBaseError(Exception):
+    pass
+
+
+def _key(disease_name, language):
+    return f'{disease_name}\0{language}'.encode('utf-8')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def disease_names():
+    """Every disease the manifest's models can report, in label order."""
+    return list(dict.fromkeys(disease_name_of(result) for result in MANIFEST.labels()))
+
+
+def load_bundle(path=None):
+    """{(disease, language): description} from knowledge_base.json."""
+    path = path or DEFAULT_BUNDLE_PATH
+    try:
+        with open(path, encoding='utf-8') as bundle_file:
+            data = json.load(bundle_file)
+    except (OSError, ValueError) as e:
+        raise KnowledgeBaseError(f"cannot read knowledge base {path}: {e}") from e
+    entries = {}
+    for disease_name, languages in data.items():
+        for language, description in languages.items():
+            if not isinstance(description, str) or not description.strip():
+                raise KnowledgeBaseError(f"{path}: {disease_name} / {language} must be a non-empty string")
+            entries[(disease_name, language)] = description
+    return entries
+
+
+def write_knowledge_base(path, entries):
+    """Write {(disease, language): (description, source)} to ``path`` atomically."""
+    keys = [_key(disease_name, language) for disease_name, language in entries]
+    texts = [description.encode('utf-8') for description, _ in entries.values()]
+    records = np.zeros(len(keys), _RECORD)
+    records['hash'] = [_hash(key) for key in keys]
+    records['key_length'] = [len(key) for key in keys]
+    records['length'] = [len(text) for text in texts]
+    records['source'] = [SOURCES.index(source) for _, source in entries.values()]
+    if len(np.unique(records['hash'])) != len(keys):
+        raise KnowledgeBaseError("hash collision between two knowledge base keys")
+    order = np.argsort(records['hash'], kind='stable')
+    records = records[order]
+    sizes = records['key_length'].astype(np.uint64) + records['length']
+    records['offset'] = _HEADER.size + len(keys) * _RECORD.itemsize + np.cumsum(sizes) - sizes
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, len(keys)))
+        out.write(records.tobytes())
+        for row in order:
+            out.write(keys[row])
+            out.write(texts[row])
+    os.replace(path + '.tmp', path)
+
+
+def build(path=DEFAULT_PATH, bundle_path=None, store=None):
+    """Compile the bundle, overridden by ``store``'s LLM descriptions, into ``path``; returns the entry count."""
+    entries = {key: (description, 'bundled') for key, description in load_bundle(bundle_path).items()}
+    if store is not None:
+        for disease_name, language, description in store.items():
+            entries[(disease_name, language)] = (description, 'llm')
+    write_knowledge_base(path, entries)
+    return len(entries)
+
+
+class KnowledgeBase:
+    """Read-only view of a knowledge base file; a missing file is an empty knowledge base."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._view = (b'', np.zeros(0, _RECORD))
+        self._stat = None
+        self._checked = 0.0
+        self.reload()
+
+    def reload(self):
+        """Map the file again, e.g. after it was rebuilt."""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                with open(self.path, 'rb') as kb_file:
+                    stat = os.fstat(kb_file.fileno())
+                    data = mmap.mmap(kb_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self._view, self._stat = (b'', np.zeros(0, _RECORD)), None
+                return
+            if data[:len(MAGIC)] != MAGIC:
+                raise KnowledgeBaseError(f"{self.path} is not a knowledge base file")
+            _, count = _HEADER.unpack_from(data)
+            # The previous mapping is closed once the last lookup using it is done
+            self._view = (data, np.frombuffer(data, _RECORD, count, _HEADER.size))
+            self._stat = (stat.st_ino, stat.st_mtime_ns)
+
+    def _check_reload(self):
+        if time.monotonic() - self._checked < RELOAD_CHECK_SECONDS:
+            return
+        self._checked = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns) != self._stat:
+            self.reload()
+
+    def lookup(self, disease_name, language):
+        """(description, source) of exactly this disease and language, or None."""
+        self._check_reload()
+        data, records = self._view
+        key = _key(disease_name, language)
+        row = int(np.searchsorted(records['hash'], np.uint64(_hash(key))))
+        if row == len(records) or records['hash'][row] != _hash(key):
+            return None
+        offset, key_length = int(records['offset'][row]), int(records['key_length'][row])
+        if data[offset:offset + key_length] != key:
+            return None
+        start = offset + key_length
+        return (data[start:start + int(records['length'][row])].decode('utf-8'),
+                SOURCES[records['source'][row]])
+
+    def get(self, disease_name, language):
+        """(description, language it is in, source), in English if ``language`` has none; None if neither."""
+        for candidate in dict.fromkeys((language, FALLBACK_LANGUAGE)):
+            found = self.lookup(disease_name, candidate)
+            if found is not None:
+                self.hits += 1
+                return found[0], candidate, found[1]
+        self.misses += 1
+        return None
+
+    def entries(self):
+        """(disease, language, source) of every entry, in index order."""
+        data, records = self._view
+        rows = []
+        for record in records:
+            offset = int(record['offset'])
+            disease_name, language = data[offset:offset + int(record['key_length'])].decode('utf-8').split('\0')
+            rows.append((disease_name, language, SOURCES[record['source']]))
+        return rows
+
+    def __len__(self):
+        return len(self._view[1])
+
+
+def refresh(knowledge_base, store, api_key, url=None, languages=None, force=False):
+    """Fetch the descriptions ``store`` lacks from the LLM, then rebuild the knowledge base.
+
+    Stops at the first failed request, since that usually means the network
+    is down. Returns (fetched, the error that stopped it or None).
+    """
+    fetched, error = 0, None
+    for disease_name in disease_names():
+        for language in languages or LANGUAGE_OPTIONS:
+            if not force and store.get(disease_name, language) is not None:
+                continue
+            try:
+                store.fetch(disease_name, language, api_key, url)
+            except DescriptionError as e:
+                error = e
+                break
+            fetched += 1
+        if error is not None:
+            break
+    stored = len(store.items())
+    built = sum(source == 'llm' for _, _, source in knowledge_base.entries())
+    if fetched or stored != built:
+        build(knowledge_base.path, store=store)
+        knowledge_base.reload()
+    return fetched, error
+
+
+_knowledge_base = None
+_refresher = None
+_lock = threading.Lock()
+
+
+def get_knowledge_base():
+    """Process-wide knowledge base, built first if the file is missing or older than knowledge_base.json.
+
+    BHOOMI_KNOWLEDGE_BASE   file (default .cache/knowledge_base.bin)
+    """
+    global _knowledge_base
+    with _lock:
+        if _knowledge_base is None:
+            path = os.getenv('BHOOMI_KNOWLEDGE_BASE') or DEFAULT_PATH
+            if (not os.path.exists(path)
+                    or os.path.getmtime(path) < os.path.getmtime(DEFAULT_BUNDLE_PATH)):
+                build(path, store=get_description_store())
+            _knowledge_base = KnowledgeBase(path)
+        return _knowledge_base
+
+
+def _refresh_loop(api_key, url, interval, retry_interval):
+    while True:
+        try:
+            _, error = refresh(get_knowledge_base(), get_description_store(), api_key, url)
+        except (KnowledgeBaseError, OSError) as e:
+            error = e
+        time.sleep(retry_interval if error is not None else interval)
+
+
+def start_background_refresh(api_key, url=None, interval=REFRESH_INTERVAL, retry_interval=RETRY_INTERVAL):
+    """Keep the knowledge base up to date from the LLM on a daemon thread (once per process)."""
+    global _refresher
+    with _lock:
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_loop, args=(api_key, url, interval, retry_interval),
+                                          name='knowledge-base-refresh', daemon=True)
+            _refresher.start()
+        return _refresher
+
+
+def bench(knowledge_base, lookups=100000):
+    """Mean microseconds per lookup over every disease x language."""
+    keys = [(disease_name, language) for disease_name in disease_names() for language in LANGUAGE_OPTIONS]
+    start = time.perf_counter()
+    for index in range(lookups):
+        knowledge_base.get(*keys[index % len(keys)])
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Build, refresh and query the offline knowledge base.')
+    parser.add_argument('--path', help='knowledge base file (default: $BHOOMI_KNOWLEDGE_BASE or '
+                                       '.cache/knowledge_base.bin)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build', help='compile knowledge_base.json and the stored LLM descriptions')
+    update = commands.add_parser('refresh', help='fetch missing descriptions from the LLM, then build')
+    update.add_argument('--language', action='append', choices=list(LANGUAGE_OPTIONS),
+                        help='only these languages (repeatable; default: all)')
+    update.add_argument('--url', help='chat-completions endpoint (default: $GROQ_API_URL or Groq)')
+    update.add_argument('--force', action='store_true', help='refetch descriptions already stored')
+    lookup = commands.add_parser('lookup', help='print one description')
+    lookup.add_argument('disease', help="disease name, e.g. 'Early blight'")
+    lookup.add_argument('language', nargs='?', default=FALLBACK_LANGUAGE, choices=list(LANGUAGE_OPTIONS))
+    commands.add_parser('info', help='entries per language and source')
+    timing = commands.add_parser('bench', help='time lookups')
+    timing.add_argument('--lookups', type=int, default=100000)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    path = args.path or os.getenv('BHOOMI_KNOWLEDGE_BASE') or DEFAULT_PATH
+
+    try:
+        if args.command == 'build':
+            print(f"Wrote {build(path, store=get_description_store())} entries to {path}")
+            return 0
+        knowledge_base = KnowledgeBase(path)
+        if args.command == 'refresh':
+            api_key = os.getenv("GROQ_API_KEY")
+            if not api_key:
+                parser.error('GROQ_API_KEY is not set')
+            fetched, error = refresh(knowledge_base, get_description_store(), api_key, args.url,
+                                     args.language, args.force)
+            print(f"Fetched {fetched}, {len(knowledge_base)} entries in {path}")
+            if error is not None:
+                print(f"error: {error}", file=sys.stderr)
+                return 1
+        elif args.command == 'lookup':
+            found = knowledge_base.get(args.disease, args.language)
+            if found is None:
+                print(f"error: no description of {args.disease!r} in {path}", file=sys.stderr)
+                return 1
+            description, language, source = found
+            print(f"[{language}, {source}]\n{description}")
+        elif args.command == 'info':
+            counts = {}
+            for _, language, source in knowledge_base.entries():
+                counts.setdefault(language, {name: 0 for name in SOURCES})[source] += 1
+            diseases = len(disease_names())
+            print(f"{len(knowledge_base)} entries in {path}, {diseases} diseases")
+            print(f"{'language':<12} {'bundled':>8} {'llm':>8} {'missing':>8}")
+            for language in LANGUAGE_OPTIONS:
+                row = counts.get(language, {name: 0 for name in SOURCES})
+                print(f"{language:<12} {row['bundled']:>8} {row['llm']:>8} "
+                      f"{max(diseases - row['bundled'] - row['llm'], 0):>8}")
+        elif args.command == 'bench':
+            print(f"{bench(knowledge_base, args.lookups):.2f} µs per lookup ({len(knowledge_base)} entries)")
+    except KnowledgeBaseError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
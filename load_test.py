@@ -0,0 +1,140 @@
+# Load test for the HTTP prediction service
+#
+# Starts serve.py in-process once per (max batch size, max wait) setting,
+# hammers it with concurrent clients and reports latency percentiles and
+# throughput for each setting:
+#
+#   python load_test.py --batch-sizes 1,8,32 --wait-ms 0,5,10 --concurrency 16
+#
+# Or measure a server that is already running:
+#
+#   python load_test.py --url http://localhost:8000/predict
+import argparse
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+import requests
+
+from batch_predict import iter_image_paths
+from model_registry import DEFAULT_MODEL_PATH, get_model
+from serve import make_server
+
+
+def run_clients(url, payloads, total_requests, concurrency):
+    """Send ``total_requests`` POSTs from ``concurrency`` threads.
+
+    Returns (per-request latencies in seconds, error count, wall-clock seconds).
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        # One pooled connection per client thread
+        session = requests.Session()
+        while True:
+            n = next(counter)
+            if n >= total_requests:
+                return
+            start = time.perf_counter()
+            try:
+                response = session.post(url, data=payloads[n % len(payloads)],
+                                        headers={'Content-Type': 'image/jpeg'}, timeout=60)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors), time.perf_counter() - start
+
+
+def summarize(latencies, errors, seconds):
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / seconds if seconds else 0.0,
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+    }
+
+
+def parse_list(text, cast):
+    return [cast(value) for value in text.split(',') if value]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Load test the prediction server.')
+    parser.add_argument('--images', default='Test Image', help='folder or glob of request images')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='model file for in-process servers')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='requests per setting (default: 200)')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='client threads (default: 16)')
+    parser.add_argument('--batch-sizes', default='1,8,32', help='max batch sizes to try (default: 1,8,32)')
+    parser.add_argument('--wait-ms', default='0,5,10', help='max wait times to try (default: 0,5,10)')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this JSON file')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    payloads = []
+    for path in iter_image_paths([args.images]):
+        with open(path, 'rb') as image_file:
+            payloads.append(image_file.read())
+    if not payloads:
+        build_parser().error(f'no images found in {args.images}')
+
+    results = []
+    if args.url:
+        row = summarize(*run_clients(args.url, payloads, args.requests, args.concurrency))
+        row.update(url=args.url, concurrency=args.concurrency)
+        results.append(row)
+    else:
+        model = get_model(args.model, warm_up=True)
+        for max_batch, max_wait in itertools.product(parse_list(args.batch_sizes, int),
+                                                     parse_list(args.wait_ms, float)):
+            server = make_server(model, port=0, max_batch_size=max_batch, max_wait_ms=max_wait,
+                                 quiet=True)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = f'http://127.0.0.1:{server.server_port}/predict'
+            try:
+                # Warm up so each predict shape is traced before timing starts
+                run_clients(url, payloads, args.concurrency, args.concurrency)
+                server.batcher.batches = server.batcher.items = 0
+                row = summarize(*run_clients(url, payloads, args.requests, args.concurrency))
+            finally:
+                server.shutdown()
+                server.server_close()
+                server.batcher.close()
+            row.update(max_batch_size=max_batch, max_wait_ms=max_wait,
+                       concurrency=args.concurrency,
+                       mean_batch_size=server.batcher.mean_batch_size())
+            results.append(row)
+
+    print(f"{'batch':>5} {'wait ms':>7} {'mean bs':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for row in results:
+        print(f"{row.get('max_batch_size', '-'):>5} {row.get('max_wait_ms', '-'):>7} "
+              f"{row.get('mean_batch_size', 0):>7.1f} {row['throughput_rps']:>8.1f} "
+              f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['errors']:>6}")
+    if args.json_path:
+        with open(args.json_path, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
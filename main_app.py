@@ -1,11 +1,36 @@
 # Library imports
-import numpy as np
+# TensorFlow is heavy (several seconds to import); it is only pulled in when
+# the model loads, on a background thread unless BHOOMI_STARTUP says otherwise
 import streamlit as st
-import cv2
-from keras.models import load_model
-import tensorflow as tf
-import requests
+from model_registry import DEFAULT_MODEL_PATH, get_model, registry
+from model_manifest import MANIFEST
+from hierarchical import TwoStageClassifier, disease_of
+from inference import (TTA_MAX_VARIANTS, decode_image, label_of, predict_batch, preprocess, top_k,
+                       tta_summary, tta_variants)
+from tiling import decode_for_tiling, heatmap, tile_grid, tile_summary
+from prediction_cache import get_prediction_cache
+from descriptions import DescriptionError, disease_name_of, get_description_store
+from knowledge_base import get_knowledge_base, start_background_refresh
+from compress import load_leaderboard
+from prompts import LANGUAGE_OPTIONS
+from telemetry import get_telemetry
+from uploads import UPLOAD_TYPES, classify_uploads, downscale_jpeg, expand_uploads, is_archive
 import os
+import itertools
+
+# background (default): start loading the model while the page renders
+# lazy: load it on the first prediction; eager: load it before rendering
+STARTUP_MODE = os.getenv("BHOOMI_STARTUP", "background")
+
+# Test-time augmentation: BHOOMI_TTA=N (2..12) turns robust mode on by default with N views
+TTA_DEFAULT = int(os.getenv("BHOOMI_TTA", "0") or 0)
+TTA_VIEWS = min(TTA_DEFAULT, TTA_MAX_VARIANTS) if TTA_DEFAULT > 1 else 8
+# Below this share of agreeing views the result is flagged as uncertain
+TTA_MIN_AGREEMENT = 0.75
+
+# BHOOMI_OFFLINE=1 never calls the Groq API and describes diseases from the
+# bundled knowledge base only (knowledge_base.py)
+OFFLINE = os.getenv("BHOOMI_OFFLINE", "").lower() in ("1", "true", "yes")
 
 # Configure page
 st.set_page_config(
@@ -247,170 +272,340 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+def groq_api_key():
+    """Groq API key from Streamlit secrets (for deployment) or the environment; None if not set."""
+    try:
+        api_key = st.secrets.get("GROQ_API_KEY", None)
+    except Exception:
+        # No secrets file
+        api_key = None
+    return api_key or os.getenv("GROQ_API_KEY")
+
+
+def describe_offline(disease_name, selected_language, telemetry):
+    """Show the knowledge base's description of a disease; returns False if it has none."""
+    found = get_knowledge_base().get(disease_name, selected_language)
+    telemetry.cache_lookups.inc(cache="knowledge_base", result="miss" if found is None else "hit")
+    if found is None:
+        return False
+    description, language, source = found
+    if language != selected_language:
+        st.warning(f"📴 No {selected_language} description is available offline yet; showing it in {language}.")
+    st.markdown(f"**About {disease_name} ({language}):**")
+    st.markdown(description)
+    st.caption("📴 Offline description" + (" (reviewed)" if source == "bundled" else ""))
+    return True
+
+
+def describe_disease(disease_name, selected_language, trace, telemetry):
+    """Show the description of a disease, from the cache, Groq or the offline knowledge base.
+
+    Returns the request outcome.
+    """
+    # --- Groq AI API integration to describe the disease ---
+    outcome = "ok"
+    description_store = get_description_store()
+    with trace.span("description_lookup"):
+        description = description_store.get(disease_name, selected_language)
+    telemetry.cache_lookups.inc(cache="description", result="miss" if description is None else "hit")
+
+    if description is None:
+        # Groq AI API key - using environment variable or Streamlit secrets for security
+        GROQ_API_KEY = None if OFFLINE else groq_api_key()
+        if not GROQ_API_KEY:
+            with trace.span("knowledge_base"):
+                if describe_offline(disease_name, selected_language, telemetry):
+                    return "offline"
+            st.error("⚠️ Groq API key not found! Please set GROQ_API_KEY in secrets or environment variables.")
+            st.info("For local development, create a .streamlit/secrets.toml file with: GROQ_API_KEY = 'your_api_key_here'")
+            # st.stop() ends the script run here, so the request is counted now
+            trace.finish("no_api_key")
+            st.stop()
+
+        # Stream the description in the background and show it token by token
+        description_chunks = iter(description_store.stream(disease_name, selected_language, GROQ_API_KEY))
+        try:
+            # Display loading message only until the first words arrive
+            with st.spinner(f'Getting disease description in {selected_language} from Groq AI...'):
+                with trace.span("groq_first_token"):
+                    first_chunk = next(description_chunks, "")
+            st.markdown(f"**About {disease_name} ({selected_language}):**")
+            with trace.span("groq_stream"):
+                st.write_stream(itertools.chain([first_chunk], description_chunks))
+        except DescriptionError as e:
+            # No connection (or the API is down): fall back to the knowledge base
+            with trace.span("knowledge_base"):
+                if describe_offline(disease_name, selected_language, telemetry):
+                    return "offline"
+            outcome = "description_error"
+            st.warning("Could not fetch disease description from Groq AI API.")
+            st.error(str(e))
+    else:
+        st.markdown(f"**About {disease_name} ({selected_language}):**")
+        st.markdown(description)
+    return outcome
+
+
 # Create tabs
 tab1, tab2 = st.tabs(["🔍 Disease Detection", "📚 Documentation"])
 
 with tab1:
-    # Loading the Model
-    model = load_model('plant_disease_model.h5')
-                        
-    # Name of Classes
-    CLASS_NAMES = ('Tomato-Bacterial_spot', 'Potato-Barly blight', 'Corn-Common_rust')
+    # Loading the Model (cached for the whole process, reloaded if the file changes)
+    if STARTUP_MODE == "eager":
+        get_model(DEFAULT_MODEL_PATH, warm_up=True)
+    elif STARTUP_MODE == "background":
+        registry.preload(DEFAULT_MODEL_PATH)
+
+    # While the API is reachable, fetch the descriptions the offline knowledge base lacks
+    if not OFFLINE and groq_api_key():
+        start_background_refresh(groq_api_key())
+
 
     # Setting Title of App
     st.title("Plant Disease Detection")
     st.markdown("Upload an image of the plant leaf")
 
-    # Language selection dropdown
-    language_options = {
-        "English": "English",
-        "Hindi": "Hindi (हिंदी)",
-        "Bengali": "Bengali (বাংলা)",
-        "Telugu": "Telugu (తెలుగు)",
-        "Marathi": "Marathi (मराठी)",
-        "Tamil": "Tamil (தமிழ்)",
-        "Gujarati": "Gujarati (ગુજરાતી)",
-        "Kannada": "Kannada (ಕನ್ನಡ)",
-        "Malayalam": "Malayalam (മലയാളം)",
-        "Punjabi": "Punjabi (ਪੰਜਾਬੀ)",
-        "Odia": "Odia (ଓଡ଼ିଆ)",
-        "Urdu": "Urdu (اردو)",
-        "Spanish": "Spanish (Español)",
-        "French": "French (Français)", 
-        "German": "German (Deutsch)",
-        "Italian": "Italian (Italiano)",
-        "Portuguese": "Portuguese (Português)",
-        "Chinese": "Chinese (中文)",
-        "Japanese": "Japanese (日本語)",
-        "Arabic": "Arabic (العربية)"
-    }
-
+    # Without the API, descriptions come from the knowledge base, which may lack a language
+    offline_languages = None
+    if OFFLINE or not groq_api_key():
+        offline_languages = {language for _, language, _ in get_knowledge_base().entries()}
     selected_language = st.selectbox(
         "Select language for disease description:",
-        options=list(language_options.keys()),
-        format_func=lambda x: language_options[x]
+        options=list(LANGUAGE_OPTIONS.keys()),
+        format_func=lambda x: LANGUAGE_OPTIONS[x] + (
+            " (English only offline)" if offline_languages is not None and x not in offline_languages else "")
     )
 
-    # Uploading the plant image
-    plant_image = st.file_uploader("Choose an image...", type = "jpg")
+    # Route to the most specialised model for the chosen crop (models.json);
+    # other models load the first time a farmer picks their crop. With a crop
+    # model configured, Auto-detect lets it pick the crop (two-stage inference)
+    model_spec = MANIFEST.resolve(DEFAULT_MODEL_PATH)
+    selected_crop = "Auto-detect"
+    if len(MANIFEST.disease_models()) > 1 or MANIFEST.crop_model is not None:
+        selected_crop = st.selectbox("Crop:", options=["Auto-detect"] + MANIFEST.crops())
+        if selected_crop != "Auto-detect":
+            model_spec = MANIFEST.route(selected_crop)
+    two_stage = MANIFEST.crop_model is not None and selected_crop == "Auto-detect"
+
+    # Smaller distilled/pruned variants of that model (compress.py), with their
+    # leaderboard numbers; two-stage inference picks its model per photo instead
+    variants = [spec.name for spec in MANIFEST.variants(model_spec.name) if os.path.exists(spec.path)]
+    if variants and not two_stage:
+        leaderboard = load_leaderboard()
+
+        def describe_variant(name):
+            row = leaderboard.get(name)
+            if row is None:
+                return name
+            return (f"{name} ({row['accuracy'] * 100:.0f}% accuracy, {row['p50_ms_batch1']:.0f} ms, "
+                    f"{row['size_bytes'] / 2 ** 20:.1f} MB)")
+
+        model_spec = MANIFEST.models[st.selectbox("Model variant:", options=[model_spec.name] + variants,
+                                                  format_func=describe_variant)]
+
+    # Overlapping full-resolution tiles instead of one squashed 256x256 image (tiling.py)
+    use_tiles = st.checkbox("🧩 Tiled mode: analyse a high-resolution photo tile by tile")
+    # Several flipped/rotated/cropped views of the photo, predicted as one batch and averaged
+    use_tta = st.checkbox(f"🔁 Robust mode: check {TTA_VIEWS} views of the photo", value=TTA_DEFAULT > 1,
+                          disabled=use_tiles) and not use_tiles
+    cache_variant = "tiled" if use_tiles else f"tta{TTA_VIEWS}" if use_tta else ""
+    decode = decode_for_tiling if use_tiles else decode_image
+
+    # Uploading the plant images: one photo gets the detailed result below,
+    # several photos or a zip archive of them a results grid (uploads.py)
+    plant_images = st.file_uploader("Choose images (or a zip of them)...", type=UPLOAD_TYPES,
+                                    accept_multiple_files=True) or []
     submit = st.button('predict Disease')
+    plant_image = None
+    if len(plant_images) == 1 and not is_archive(plant_images[0].name):
+        plant_image = plant_images[0]
+
+    # Several photos: decoded in parallel, one batched predict, one description per disease
+    if submit and plant_images and plant_image is None:
+        telemetry = get_telemetry()
+        trace = telemetry.trace()
+        outcome = "ok"
+        with trace.span("upload"):
+            images, skipped = expand_uploads((upload.name, upload.getvalue()) for upload in plant_images)
+        for _, image_bytes in images:
+            telemetry.upload_bytes.observe(len(image_bytes))
+        with st.spinner(f"Classifying {len(images)} photos..."):
+            with trace.span("batch_predict"):
+                classifier = TwoStageClassifier.from_manifest() if two_stage else None
+                results = classify_uploads(images, model_spec, get_prediction_cache(model_spec.path), classifier)
+        if use_tiles or use_tta:
+            st.caption("Tiled and robust modes apply to single photos; this batch was classified as is.")
+
+        st.subheader(f"Results for {len(results)} photos")
+        st.dataframe(
+            [{
+                "Photo": result["thumbnail"],
+                "File": result["name"],
+                "Crop": result["label"].split("-")[0] if result["label"] else None,
+                "Disease": disease_name_of(result["label"]) if result["label"] else None,
+                "Confidence": result["confidence"],
+                "Status": ("⚠️ " + result["error"] if result["error"] else
+                           "🤔 Unknown" if result["unknown"] else "✅"),
+            } for result in results],
+            column_config={
+                "Photo": st.column_config.ImageColumn("Photo"),
+                "Confidence": st.column_config.ProgressColumn("Confidence", min_value=0.0, max_value=1.0,
+                                                              format="percent"),
+            },
+            hide_index=True,
+            width="stretch",
+        )
+        if skipped:
+            with st.expander(f"{len(skipped)} file(s) skipped"):
+                st.table({"file": [name for name, _ in skipped], "reason": [reason for _, reason in skipped]})
+
+        # Each distinct disease is described once, however many photos show it
+        photos_by_disease = {}
+        for result in results:
+            if result["label"] and not result["unknown"]:
+                photos_by_disease.setdefault(disease_name_of(result["label"]), []).append(result["name"])
+        for disease_name, names in photos_by_disease.items():
+            st.caption(f"Seen in {len(names)} photo(s): {', '.join(names)}")
+            described = describe_disease(disease_name, selected_language, trace, telemetry)
+            if described != "ok":
+                outcome = described
+        trace.finish(outcome)
 
     # On predict button click
     if submit:
         if plant_image is not None:
-            # Convert the file to an opencv image.
-            file_bytes = np.asarray (bytearray(plant_image.read()), dtype = np.uint8)
-            opencv_image = cv2.imdecode(file_bytes, 1)
-            
-            # Displaying the image
-            st.image(opencv_image, channels="BGR")
-            st.write(opencv_image.shape)
-            
-            # Resizing the image
-            opencv_image = cv2.resize(opencv_image, (256, 256))
+            # Per-stage timings (a no-op unless metrics or the debug panel are enabled)
+            telemetry = get_telemetry()
+            trace = telemetry.trace()
+            outcome = "ok"
+            with trace.span("upload"):
+                image_bytes = plant_image.getvalue()
+            telemetry.upload_bytes.observe(len(image_bytes))
             
-            # Convert image to 4 Dimension
-            opencv_image.shape = (1, 256, 256, 3)
+            # Displaying a downscaled copy rather than sending the whole upload back to the browser
+            with trace.span("thumbnail"):
+                preview = downscale_jpeg(image_bytes)
+            if preview is not None:
+                st.image(preview)
             
-            #Make Prediction
-            Y_pred = model.predict(opencv_image)
-            result = CLASS_NAMES[np.argmax(Y_pred)]
-            st.title(str("This is "+result.split('-')[0]+ " leaf with " +  result.split('-')[1]))
-
-            # --- Groq AI API integration to describe the disease ---
-            # Groq AI API key - using environment variable or Streamlit secrets for security
-            try:
-                # Try to get from Streamlit secrets first (for deployment)
-                GROQ_API_KEY = st.secrets.get("GROQ_API_KEY", None)
-                if not GROQ_API_KEY:
-                    # Fallback to environment variable
-                    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-                    if not GROQ_API_KEY:
-                        st.error("⚠️ Groq API key not found! Please set GROQ_API_KEY in secrets or environment variables.")
-                        st.stop()
-            except Exception:
-                # If secrets not available, try environment variable
-                GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-                if not GROQ_API_KEY:
-                    st.error("⚠️ Groq API key not found! Please set GROQ_API_KEY as an environment variable.")
-                    st.info("For local development, create a .streamlit/secrets.toml file with: GROQ_API_KEY = 'your_api_key_here'")
+            opencv_image = None
+            if two_stage:
+                # A small crop model picks the crop, then that crop's disease model runs
+                with trace.span("decode"):
+                    opencv_image = decode(image_bytes)
+                if opencv_image is None:
+                    trace.finish("bad_image")
+                    st.error("⚠️ Could not decode this image; upload a JPG, PNG or WEBP photo.")
                     st.stop()
-            
-            disease_name = result.split('-')[1].replace('_', ' ')
-            
-            # Create language-specific prompt
-            if selected_language == "English":
-                prompt = f"Describe the plant disease: {disease_name}. Provide symptoms, causes, and possible treatments in detail."
-            elif selected_language == "Hindi":
-                prompt = f"पौधे की बीमारी का वर्णन करें: {disease_name}। लक्षण, कारण और संभावित उपचार विस्तार से प्रदान करें। हिंदी में उत्तर दें।"
-            elif selected_language == "Bengali":
-                prompt = f"উদ্ভিদের রোগ বর্ণনা করুন: {disease_name}। লক্ষণ, কারণ এবং সম্ভাব্য চিকিৎসা বিস্তারিতভাবে প্রদান করুন। বাংলায় উত্তর দিন।"
-            elif selected_language == "Telugu":
-                prompt = f"మొక్కల వ్యాధిని వివరించండి: {disease_name}. లక్ష్యణాలు, కారణాలు మరియు సాధ్యమైన చికిత్సలను వివరంగా అందించండి। తెలుగులో సమాధానం ఇవ్వండి।"
-            elif selected_language == "Marathi":
-                prompt = f"वनस्पती रोगाचे वर्णन करा: {disease_name}. लक्षणे, कारणे आणि संभाव्य उपचार तपशीलवार प्रदान करा. मराठीत उत्तर द्या।"
-            elif selected_language == "Tamil":
-                prompt = f"தாவர நோயை விவரிக்கவும்: {disease_name}. அறிகுறிகள், காரணங்கள் மற்றும் சாத்தியமான சிகிச்சைகளை விரிவாக வழங்கவும். தமிழில் பதிலளிக்கவும்।"
-            elif selected_language == "Gujarati":
-                prompt = f"છોડના રોગનું વર્ણન કરો: {disease_name}. લક્ષણો, કારણો અને સંભવિત સારવાર વિગતવાર આપો. ગુજરાતીમાં જવાબ આપો।"
-            elif selected_language == "Kannada":
-                prompt = f"ಸಸ್ಯ ರೋಗವನ್ನು ವಿವರಿಸಿ: {disease_name}. ಲಕ್ಷಣಗಳು, ಕಾರಣಗಳು ಮತ್ತು ಸಂಭವನೀಯ ಚಿಕಿತ್ಸೆಗಳನ್ನು ವಿವರವಾಗಿ ಒದಗಿಸಿ. ಕನ್ನಡದಲ್ಲಿ ಉತ್ತರಿಸಿ।"
-            elif selected_language == "Malayalam":
-                prompt = f"സസ്യരോഗം വിവരിക്കുക: {disease_name}. ലക്ഷണങ്ങൾ, കാരണങ്ങൾ, സാധ്യമായ ചികിത്സകൾ എന്നിവ വിശദമായി നൽകുക. മലയാളത്തിൽ ഉത്തരം നൽകുക।"
-            elif selected_language == "Punjabi":
-                prompt = f"ਪੌਧੇ ਦੀ ਬਿਮਾਰੀ ਦਾ ਵਰਣਨ ਕਰੋ: {disease_name}। ਲੱਛਣ, ਕਾਰਨ ਅਤੇ ਸੰਭਾਵਿਤ ਇਲਾਜ ਵਿਸਤਾਰ ਨਾਲ ਪ੍ਰਦਾਨ ਕਰੋ। ਪੰਜਾਬੀ ਵਿੱਚ ਜਵਾਬ ਦਿਓ।"
-            elif selected_language == "Odia":
-                prompt = f"ଉଦ୍ଭିଦ ରୋଗ ବର୍ଣ୍ଣନା କରନ୍ତୁ: {disease_name}। ଲକ୍ଷଣ, କାରଣ ଏବଂ ସମ୍ଭାବ୍ୟ ଚିକିତ୍ସା ବିସ୍ତୃତ ଭାବରେ ପ୍ରଦାନ କରନ୍ତୁ। ଓଡ଼ିଆରେ ଉତ୍ତର ଦିଅନ୍ତୁ।"
-            elif selected_language == "Urdu":
-                prompt = f"پودوں کی بیماری کی وضاحت کریں: {disease_name}۔ علامات، اسباب اور ممکنہ علاج تفصیل سے فراہم کریں۔ اردو میں جواب دیں۔"
-            elif selected_language == "Spanish":
-                prompt = f"Describe la enfermedad de la planta: {disease_name}. Proporciona síntomas, causas y posibles tratamientos en detalle. Responde en español."
-            elif selected_language == "French":
-                prompt = f"Décris la maladie de la plante: {disease_name}. Fournis les symptômes, les causes et les traitements possibles en détail. Réponds en français."
-            elif selected_language == "German":
-                prompt = f"Beschreibe die Pflanzenkrankheit: {disease_name}. Gib Symptome, Ursachen und mögliche Behandlungen detailliert an. Antworte auf Deutsch."
-            elif selected_language == "Italian":
-                prompt = f"Descrivi la malattia della pianta: {disease_name}. Fornisci sintomi, cause e possibili trattamenti in dettaglio. Rispondi in italiano."
-            elif selected_language == "Portuguese":
-                prompt = f"Descreva a doença da planta: {disease_name}. Forneça sintomas, causas e possíveis tratamentos em detalhes. Responda em português."
-            elif selected_language == "Chinese":
-                prompt = f"描述植物疾病：{disease_name}。详细提供症状、原因和可能的治疗方法。用中文回答。"
-            elif selected_language == "Japanese":
-                prompt = f"植物の病気について説明してください：{disease_name}。症状、原因、可能な治療法を詳しく説明してください。日本語で回答してください。"
-            elif selected_language == "Arabic":
-                prompt = f"صف مرض النبات: {disease_name}. قدم الأعراض والأسباب والعلاجات المحتملة بالتفصيل. أجب باللغة العربية."
+                with trace.span("crop_detect"):
+                    crop_model = get_model(MANIFEST.crop_model, warm_up=True)
+                    crop_probs = predict_batch(crop_model, [preprocess(opencv_image, crop_model.input_size)])[0]
+                detected_crop = crop_model.labels[int(crop_probs.argmax())]
+                model_spec = MANIFEST.route(detected_crop)
+            prediction_cache = get_prediction_cache(model_spec.path)
+
+            #Make Prediction (cached by image content and model version)
+            with trace.span("cache_lookup"):
+                Y_pred = prediction_cache.get(image_bytes, cache_variant)
+            telemetry.cache_lookups.inc(cache="prediction", result="miss" if Y_pred is None else "hit")
+            if Y_pred is None:
+                # Convert the file to an opencv image, resize it and predict
+                if opencv_image is None:
+                    with trace.span("decode"):
+                        opencv_image = decode(image_bytes)
+                if opencv_image is None:
+                    trace.finish("bad_image")
+                    st.error("⚠️ Could not decode this image; upload a JPG, PNG or WEBP photo.")
+                    st.stop()
+                # Waits for the background load if it is still running
+                with trace.span("model_wait"):
+                    model = get_model(model_spec.path, warm_up=True)
+                if use_tiles:
+                    # Per-tile probabilities; the heatmap is drawn from these
+                    with trace.span("tiles"):
+                        Y_pred = tile_grid(opencv_image, model)
+                else:
+                    with trace.span("resize"):
+                        if use_tta:
+                            model_input = tta_variants(opencv_image, TTA_VIEWS, model_spec.input_size)
+                        else:
+                            model_input = [preprocess(opencv_image, model_spec.input_size)]
+                    with trace.span("predict"):
+                        Y_pred = predict_batch(model, model_input)
+                        if not use_tta:
+                            Y_pred = Y_pred[0]
+                with trace.span("cache_store"):
+                    prediction_cache.put(image_bytes, Y_pred, cache_variant)
+            if use_tta:
+                Y_pred, tta_agreement = tta_summary(Y_pred)
+            if use_tiles:
+                tiles = Y_pred
+                Y_pred, tile_votes = tile_summary(tiles)
+            if two_stage:
+                result, disease_confidence = disease_of(Y_pred, model_spec.labels, detected_crop)
             else:
-                prompt = f"Describe the plant disease: {disease_name}. Provide symptoms, causes, and possible treatments in detail."
-
-            headers = {
-                'Authorization': f'Bearer {GROQ_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            data = {
-                "model": "llama3-8b-8192",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
-            }
-            
-            # Display loading message while fetching description
-            with st.spinner(f'Getting disease description in {selected_language} from Groq AI...'):
-                try:
-                    response = requests.post(
-                        "https://api.groq.com/openai/v1/chat/completions",
-                        headers=headers,
-                        json=data,
-                        timeout=15
-                    )
-                    if response.status_code == 200:
-                        description = response.json()['choices'][0]['message']['content']
-                        st.markdown(f"**About {disease_name} ({selected_language}):**")
-                        st.markdown(description)
-                    else:
-                        st.warning("Could not fetch disease description from Groq AI API.")
-                        st.error(f"API returned status code: {response.status_code}")
-                except Exception as e:
-                    st.warning(f"Error contacting Groq AI API: {e}")
+                result = label_of(Y_pred, model_spec.labels)
+            # Calibrated (models.json temperature) confidence; below the model's min_confidence the
+            # photo is reported as unknown
+            confidence = float(crop_probs.max()) * disease_confidence if two_stage else float(Y_pred.max())
+            confident = model_spec.is_confident(confidence)
+            if confident:
+                st.title(str("This is "+result.split('-')[0]+ " leaf with " +  result.split('-')[1]))
+            else:
+                outcome = "unknown"
+                st.title("🤔 Could not recognise this leaf")
+                st.warning(f"⚠️ The model is only {confidence:.0%} sure. This may not be a "
+                           f"{', '.join(MANIFEST.crops())} leaf, or the photo may be unclear. "
+                           "Try a closer, well-lit photo of a single leaf.")
+            if two_stage:
+                st.caption(f"Confidence {confidence:.0%} "
+                           f"(crop {float(crop_probs.max()):.0%} × disease {disease_confidence:.0%})")
+            else:
+                st.caption(f"Confidence {confidence:.0%}")
+            st.caption("Top matches: " + ", ".join(f"{label.replace('-', ' ').replace('_', ' ')} {p:.0%}"
+                                                   for label, p in top_k(Y_pred, model_spec.labels)))
+            if use_tta:
+                st.caption(f"{tta_agreement:.0%} of {TTA_VIEWS} views agree")
+                if tta_agreement < TTA_MIN_AGREEMENT:
+                    st.warning("⚠️ Different views of this photo disagree, so this result is uncertain. "
+                               "Try a closer, well-lit photo of a single leaf.")
+            if use_tiles:
+                label_index = model_spec.labels.index(result)
+                st.caption(f"{tile_votes.sum()} of {tiles[..., 0].size} tiles show the plant; "
+                           f"{tile_votes[label_index]} of them point to {result.split('-')[1]}")
+                if opencv_image is None:
+                    with trace.span("decode"):
+                        opencv_image = decode(image_bytes)
+                with trace.span("heatmap"):
+                    overlay = heatmap(opencv_image, tiles, model_spec.input_size, label_index)
+                st.image(overlay, channels="BGR", caption=f"Where the model sees {result.split('-')[1]}")
+
+            # Photos the model cannot place cost no LLM call
+            if confident:
+                outcome = describe_disease(disease_name_of(result), selected_language, trace, telemetry)
+
+            request_seconds = trace.finish(outcome)
+            if telemetry.debug_panel:
+                # Where the time went for this request
+                with st.expander("⏱️ Timing breakdown", expanded=True):
+                    st.table({
+                        "stage": [name for name, _ in trace.spans] + ["total"],
+                        "ms": [round(seconds * 1000, 2) for _, seconds in trace.spans] + [round(request_seconds * 1000, 2)],
+                    })
+
+# Model status in the sidebar
+with st.sidebar.expander("⚙️ Model status"):
+    for model_stats in registry.stats():
+        st.markdown(f"**{model_stats['name']}** ({os.path.basename(model_stats['path'])})")
+        st.write(f"Load time: {model_stats['load_seconds'] * 1000:.0f} ms")
+        st.write(f"Resident memory: ~{model_stats['rss_bytes'] / 2 ** 20:.1f} MiB")
+    if registry.max_bytes is not None:
+        st.write(f"Model memory budget: {registry.resident_bytes() / 2 ** 20:.0f} of "
+                 f"{registry.max_bytes / 2 ** 20:.0f} MiB, {registry.evictions} evictions")
+    # The cache of the model in use: the selected crop's model or variant, or the one two-stage picked last
+    cache_stats = get_prediction_cache(model_spec.path).stats()
+    st.write(f"Prediction cache ({model_spec.name}): {cache_stats['memory_hits'] + cache_stats['disk_hits']} "
+             f"hits, {cache_stats['misses']} misses")
 
 with tab2:
     st.title("📚 Documentation")
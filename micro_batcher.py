@@ -0,0 +1,99 @@
+# Dynamic micro-batching for concurrent prediction requests
+#
+# Each HTTP request carries one image, but model.predict costs nearly the same
+# for 1 image as for 16. The batcher parks incoming images on a queue and a
+# single worker thread drains it: it waits for the first image, then collects
+# more until either ``max_batch_size`` images are queued or ``max_wait_ms``
+# has passed, and runs one predict for all of them. A request whose caller
+# timed out is cancelled and left out of the next batch.
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+
+class MicroBatcher:
+    """Group concurrent ``submit`` calls into batched ``predict_fn`` calls.
+
+    ``predict_fn`` takes a list of preprocessed images and returns one row of
+    probabilities per image.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0):
+        if max_batch_size < 1 or max_wait_ms < 0:
+            raise ValueError('max_batch_size must be >= 1 and max_wait_ms >= 0')
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """Queue one image; the returned Future resolves to its probabilities."""
+        if self._closed:
+            raise RuntimeError('batcher is closed')
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def predict(self, image, timeout=None):
+        future = self.submit(image)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # Nobody will read the result; a no-op if the worker already started on it
+            future.cancel()
+            raise
+
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Close requested; finish this batch and stop afterwards
+                self._queue.put(None)
+                break
+            if not item[1].cancelled():
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            if first[1].cancelled():
+                continue
+            batch = self._collect(first)
+            # Skip requests whose caller gave up while the batch was collected
+            live = [(image, future) for image, future in batch
+                    if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                probabilities = self.predict_fn([image for image, _ in live])
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(live)
+            for (_, future), probs in zip(live, probabilities):
+                future.set_result(probs)
@@ -0,0 +1,367 @@
+# Model manifest: which labels and preprocessing belong to which model file
+#
+# models.json names every model the app can serve:
+#
+#   {"version": 1, "default_model": "plant-disease-3",
+#    "models": {"plant-disease-3": {"path": "plant_disease_model.h5",
+#                                   "labels": ["Corn-Common_rust", ...],
+#                                   "input_size": [256, 256], "color": "bgr", "divide_by": 225}}}
+#
+# labels are in the model's output order, "<Crop>-<Disease>". input_size is
+# (width, height) for preprocess(); color is the channel order the model was
+# trained on; pixels are divided by divide_by before predict (1 for models
+# that scale inside the graph, as those built by training.py do).
+# memory_mb optionally overrides the resident size used for the registry's
+# memory budget (default: the file size). temperature (fitted by
+# calibration.py, default 1) softens or sharpens the model's probabilities,
+# and min_confidence is the calibrated top probability below which a
+# prediction is reported as unknown (default: $BHOOMI_MIN_CONFIDENCE or 0.5).
+#
+# "variant_of" marks a compressed variant of another model (see compress.py):
+# same labels, selectable by name, but never routed to or used to list crops.
+#
+# An entry with "kind": "crop" is a crop identifier for two-stage inference
+# (see hierarchical.py): its labels are crop names, and the optional
+# top-level "crop_model" names it. Crop models are never routed to as
+# disease models.
+#
+# A model file that is not in the manifest carries its binding in a sidecar
+# next to it, <stem>.model.json, with the same fields minus "path";
+# export_model.py and train.py write one for everything they produce. A file
+# with neither is taken to be an export of the default model.
+#
+#   python model_manifest.py --check    # validate and list the models
+import argparse
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models.json')
+
+COLOR_ORDERS = ('bgr', 'rgb')
+
+KINDS = ('disease', 'crop')
+
+DEFAULT_MIN_CONFIDENCE = float(os.getenv('BHOOMI_MIN_CONFIDENCE', '0.5'))
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def _positive(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def temperature_scale(probabilities, temperature):
+    """softmax(log(p) / temperature) over the last axis.
+
+    log(p) differs from the model's logits by a per-image constant that
+    softmax cancels, so this is temperature scaling of the logits.
+    """
+    scaled = np.log(np.maximum(probabilities, 1e-12)) / np.float32(temperature)
+    scaled = np.exp(scaled - scaled.max(axis=-1, keepdims=True))
+    return (scaled / scaled.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+
+def binding_path(model_path):
+    """Sidecar manifest entry for a model file: <stem>.model.json."""
+    return os.path.splitext(model_path)[0] + '.model.json'
+
+
+class ModelSpec:
+    """One model artifact and the labels and preprocessing it was trained with."""
+
+    def __init__(self, name, path, labels, input_size=(256, 256), color='bgr', divide_by=1,
+                 memory_mb=None, kind='disease', temperature=1, min_confidence=None, variant_of=None):
+        self.name = name
+        self.path = path
+        self.labels = tuple(labels)
+        self.input_size = tuple(input_size)
+        self.color = color
+        self.divide_by = divide_by
+        self.memory_mb = memory_mb
+        self.kind = kind
+        self.temperature = temperature
+        self.min_confidence = min_confidence
+        self.variant_of = variant_of
+        # Crops in label order, e.g. ('Corn', 'Potato', 'Tomato')
+        self.crops = tuple(dict.fromkeys(label.split('-')[0] for label in self.labels))
+
+    @classmethod
+    def from_dict(cls, name, data, path=None):
+        """Validate one entry; ``path`` overrides the entry's own (for sidecars)."""
+        if not isinstance(data, dict):
+            raise ManifestError(f"{name}: entry must be an object")
+        path = path or data.get('path')
+        if not isinstance(path, str) or not path:
+            raise ManifestError(f"{name}: missing path")
+        kind = data.get('kind', 'disease')
+        if kind not in KINDS:
+            raise ManifestError(f"{name}: kind must be one of {', '.join(KINDS)}")
+        labels = data.get('labels')
+        if not isinstance(labels, list) or not labels:
+            raise ManifestError(f"{name}: labels must be a non-empty list")
+        for label in labels:
+            if not isinstance(label, str) or not label:
+                raise ManifestError(f"{name}: labels must be non-empty strings")
+            if kind == 'disease' and '-' not in label.strip('-'):
+                raise ManifestError(f"{name}: label {label!r} is not <Crop>-<Disease>")
+            if kind == 'crop' and '-' in label:
+                raise ManifestError(f"{name}: crop label {label!r} must not contain '-'")
+        if len(set(labels)) != len(labels):
+            raise ManifestError(f"{name}: duplicate labels")
+        input_size = data.get('input_size', [256, 256])
+        if (not isinstance(input_size, list) or len(input_size) != 2
+                or not all(isinstance(dim, int) and _positive(dim) for dim in input_size)):
+            raise ManifestError(f"{name}: input_size must be [width, height]")
+        color = data.get('color', 'bgr')
+        if color not in COLOR_ORDERS:
+            raise ManifestError(f"{name}: color must be one of {', '.join(COLOR_ORDERS)}")
+        divide_by = data.get('divide_by', 1)
+        if not _positive(divide_by):
+            raise ManifestError(f"{name}: divide_by must be a positive number")
+        memory_mb = data.get('memory_mb')
+        if memory_mb is not None and not _positive(memory_mb):
+            raise ManifestError(f"{name}: memory_mb must be a positive number")
+        temperature = data.get('temperature', 1)
+        if not _positive(temperature):
+            raise ManifestError(f"{name}: temperature must be a positive number")
+        min_confidence = data.get('min_confidence')
+        if min_confidence is not None and (not _positive(min_confidence) or min_confidence > 1):
+            raise ManifestError(f"{name}: min_confidence must be a number in (0, 1]")
+        variant_of = data.get('variant_of')
+        if variant_of is not None and (not isinstance(variant_of, str) or not variant_of):
+            raise ManifestError(f"{name}: variant_of must be a model name")
+        return cls(name, path, labels, input_size, color, divide_by, memory_mb, kind, temperature,
+                   min_confidence, variant_of)
+
+    def to_dict(self):
+        data = {
+            'kind': self.kind,
+            'labels': list(self.labels),
+            'input_size': list(self.input_size),
+            'color': self.color,
+            'divide_by': self.divide_by,
+        }
+        if self.memory_mb is not None:
+            data['memory_mb'] = self.memory_mb
+        if self.temperature != 1:
+            data['temperature'] = self.temperature
+        if self.min_confidence is not None:
+            data['min_confidence'] = self.min_confidence
+        if self.variant_of is not None:
+            data['variant_of'] = self.variant_of
+        return data
+
+    def fingerprint(self):
+        """Stable text of everything that changes what the model outputs for an image."""
+        data = self.to_dict()
+        data.pop('memory_mb', None)
+        data.pop('min_confidence', None)
+        data.pop('variant_of', None)
+        return json.dumps(data, sort_keys=True)
+
+    def prepare(self, batch):
+        """Apply the channel order and pixel scaling to a batch of preprocess() output."""
+        batch = np.asarray(batch)
+        if self.color == 'rgb':
+            batch = batch[..., ::-1]
+        if self.divide_by != 1:
+            batch = batch.astype(np.float32) / np.float32(self.divide_by)
+        return batch
+
+    def calibrate(self, probabilities):
+        """Apply the fitted temperature to a model's probabilities."""
+        if self.temperature == 1:
+            return probabilities
+        return temperature_scale(probabilities, self.temperature)
+
+    def is_confident(self, confidence):
+        """Whether a calibrated top probability clears this model's min_confidence."""
+        threshold = DEFAULT_MIN_CONFIDENCE if self.min_confidence is None else self.min_confidence
+        return confidence >= threshold
+
+
+class BoundModel:
+    """A loaded backend that applies its spec's preprocessing and calibration and knows its labels."""
+
+    def __init__(self, backend, spec):
+        self.backend = backend
+        self.spec = spec
+        self.name = backend.name
+        self.labels = spec.labels
+        self.input_size = spec.input_size
+        self.input_shape = backend.input_shape
+
+    def predict(self, batch):
+        probabilities = self.backend.predict(self.spec.prepare(batch))
+        if probabilities.shape[-1] != len(self.labels):
+            raise ManifestError(f"{self.spec.name}: model has {probabilities.shape[-1]} outputs "
+                                f"but {len(self.labels)} labels")
+        return self.spec.calibrate(probabilities)
+
+
+class Manifest:
+    def __init__(self, version, default_model, models, base_dir='', crop_model=None):
+        self.version = version
+        self.default_model = default_model
+        self.models = models
+        self.base_dir = base_dir
+        self.crop_model = crop_model
+
+    @classmethod
+    def from_dict(cls, data, base_dir=''):
+        """Build a manifest, raising ManifestError if anything is off.
+
+        Relative model paths are resolved against ``base_dir``.
+        """
+        if not isinstance(data, dict):
+            raise ManifestError("manifest must be a JSON object")
+        version = data.get('version')
+        if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+            raise ManifestError("version must be a positive integer")
+        entries = data.get('models')
+        if not isinstance(entries, dict) or not entries:
+            raise ManifestError("models must be a non-empty object")
+        models = {}
+        for name, entry in entries.items():
+            spec = ModelSpec.from_dict(name, entry)
+            spec.path = os.path.join(base_dir, spec.path)
+            models[name] = spec
+        for name, spec in models.items():
+            if spec.variant_of is None:
+                continue
+            original = models.get(spec.variant_of)
+            if original is None or original.variant_of is not None:
+                raise ManifestError(f"{name}: variant_of {spec.variant_of!r} is not a model in models")
+            if (original.kind, original.labels) != (spec.kind, spec.labels):
+                raise ManifestError(f"{name}: a variant must have the kind and labels of {spec.variant_of}")
+        default_model = data.get('default_model')
+        if (default_model not in models or models[default_model].kind != 'disease'
+                or models[default_model].variant_of is not None):
+            raise ManifestError(f"default_model {default_model!r} is not a disease model in models")
+        crop_model = data.get('crop_model')
+        if crop_model is not None and (crop_model not in models or models[crop_model].kind != 'crop'):
+            raise ManifestError(f"crop_model {crop_model!r} is not a crop model in models")
+        return cls(version, default_model, models, base_dir, crop_model)
+
+    @property
+    def default(self):
+        return self.models[self.default_model]
+
+    def disease_models(self):
+        return [spec for spec in self.models.values() if spec.kind == 'disease' and spec.variant_of is None]
+
+    def variants(self, name):
+        """Compressed variants of the model called ``name``, in manifest order."""
+        return [spec for spec in self.models.values() if spec.variant_of == name]
+
+    def crops(self):
+        """Every crop some model can diagnose, in manifest order."""
+        return list(dict.fromkeys(crop for spec in self.disease_models() for crop in spec.crops))
+
+    def labels(self):
+        """Every label of every disease model, without duplicates."""
+        return list(dict.fromkeys(label for spec in self.disease_models() for label in spec.labels))
+
+    def route(self, crop=None):
+        """The model for ``crop``: the most specialised one covering it, else the default."""
+        if crop:
+            candidates = [spec for spec in self.disease_models() if crop in spec.crops]
+            if candidates:
+                return min(candidates, key=lambda spec: len(spec.labels))
+        return self.default
+
+    def resolve(self, model):
+        """ModelSpec for a manifest name or a model file path."""
+        if model in self.models:
+            return self.models[model]
+        key = os.path.abspath(model)
+        for spec in self.models.values():
+            if os.path.abspath(spec.path) == key:
+                return spec
+        sidecar = binding_path(model)
+        if os.path.exists(sidecar):
+            try:
+                with open(sidecar, encoding='utf-8') as sidecar_file:
+                    data = json.load(sidecar_file)
+            except (OSError, ValueError) as e:
+                raise ManifestError(f"cannot read model binding {sidecar}: {e}") from e
+            return ModelSpec.from_dict(os.path.basename(model), data, path=model)
+        default = self.default
+        return ModelSpec(os.path.basename(model), model, default.labels, default.input_size,
+                         default.color, default.divide_by, temperature=default.temperature,
+                         min_confidence=default.min_confidence)
+
+
+def write_binding(spec, model_path):
+    """Write the sidecar that binds ``model_path`` to ``spec``'s labels and preprocessing."""
+    path = binding_path(model_path)
+    with open(path, 'w', encoding='utf-8') as sidecar:
+        json.dump(spec.to_dict(), sidecar, indent=2)
+    return path
+
+
+def update_manifest(specs, manifest_path=None):
+    """Add or replace the entries of ``specs`` in models.json (paths relative to it); returns the file."""
+    manifest_path = manifest_path or os.getenv('BHOOMI_MODELS') or DEFAULT_MANIFEST_PATH
+    with open(manifest_path, encoding='utf-8') as manifest_file:
+        data = json.load(manifest_file)
+    for spec in specs:
+        entry = {'path': os.path.relpath(spec.path, os.path.dirname(os.path.abspath(manifest_path)))}
+        entry.update(spec.to_dict())
+        if entry.pop('kind') != 'disease':
+            entry['kind'] = spec.kind
+        data['models'][spec.name] = entry
+    # Keep label lists and sizes on one line, as models.json is written by hand
+    text = re.sub(r'\[[^\[\]{}]*\]', lambda match: json.dumps(json.loads(match.group(0))),
+                  json.dumps(data, indent=2, ensure_ascii=False))
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        manifest_file.write(text + '\n')
+    return manifest_path
+
+
+def load_manifest(path=None):
+    path = path or os.getenv('BHOOMI_MODELS') or DEFAULT_MANIFEST_PATH
+    try:
+        with open(path, encoding='utf-8') as manifest_file:
+            data = json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        raise ManifestError(f"cannot read model manifest {path}: {e}") from e
+    return Manifest.from_dict(data, os.path.dirname(path))
+
+
+# Loaded once at import; a broken manifest fails at startup, not mid-request
+MANIFEST = load_manifest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Validate the model manifest.')
+    parser.add_argument('manifest', nargs='?', help='manifest file (default: $BHOOMI_MODELS or models.json)')
+    parser.add_argument('--check', action='store_true', help='also require every model file to exist')
+    args = parser.parse_args(argv)
+
+    try:
+        manifest = load_manifest(args.manifest)
+    except ManifestError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    missing = 0
+    for name, spec in manifest.models.items():
+        exists = os.path.exists(spec.path)
+        missing += not exists
+        role = {manifest.default_model: ' (default)', manifest.crop_model: ' (crop model)'}.get(name, '')
+        if spec.variant_of is not None:
+            role = f' (variant of {spec.variant_of})'
+        print(f"{name}{role}: {spec.path}"
+              f"{'' if exists else ' [missing]'}, {len(spec.labels)} labels over {', '.join(spec.crops)}, "
+              f"{spec.input_size[0]}x{spec.input_size[1]} {spec.color.upper()} / {spec.divide_by}")
+    return 1 if args.check and missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# Process-wide model registry
+#
+# Streamlit re-executes main_app.py on every widget change, but imported modules
+# stay in sys.modules for the life of the server process. Keeping the loaded
+# models here means each model file is parsed once per process and shared by
+# all sessions, instead of once per rerun.
+#
+# BHOOMI_MODEL selects the artifact to serve: a name from models.json or a
+# file in any format in backends.BACKENDS, e.g.
+# BHOOMI_MODEL=artifacts/plant_disease_model_int8.tflite. Every model comes
+# back bound to its manifest entry (labels and preprocessing, see
+# model_manifest.py) and is loaded on first use.
+#
+# BHOOMI_MODEL_MEMORY_MB caps the resident size of all loaded models; going
+# over it evicts the least recently used ones (never the one just requested).
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from model_manifest import MANIFEST, BoundModel
+
+DEFAULT_MODEL_PATH = MANIFEST.resolve(os.getenv('BHOOMI_MODEL') or MANIFEST.default_model).path
+
+
+def current_rss_bytes():
+    """Resident set size of this process in bytes (0 if it cannot be read)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, not the current value, but it is the best we
+        # have on platforms without /proc (kilobytes on Linux, bytes on macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def file_fingerprint(path):
+    """Cheap identity of a model file on disk: (size, mtime in ns)."""
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _default_loader():
+    from backends import load_backend
+    return load_backend
+
+
+class _Entry:
+    def __init__(self, model, fingerprint, load_seconds, rss_bytes, size_bytes):
+        self.model = model
+        self.fingerprint = fingerprint
+        self.load_seconds = load_seconds
+        self.rss_bytes = rss_bytes
+        self.size_bytes = size_bytes
+        self.loaded_at = time.time()
+        self.warmup_seconds = None
+        self.hits = 0
+        # Sessions asking for a warm model at once warm it up only once
+        self.warmup_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Loads each model file once per process and reloads it when it changes.
+
+    ``loader`` turns a path into a model object with ``predict(batch)`` and
+    ``input_shape``; it defaults to ``backends.load_backend``. ``max_bytes``
+    caps the total size of the loaded models (None: no cap).
+    """
+
+    def __init__(self, loader=None, max_bytes=None, manifest=MANIFEST):
+        self._loader = loader
+        self.max_bytes = max_bytes
+        self.manifest = manifest
+        # Least recently used first
+        self._entries = collections.OrderedDict()
+        self._preloads = {}
+        # _lock guards _entries and _preloads and is only held briefly;
+        # _load_lock lets one model load at a time without blocking lookups
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.evictions = 0
+
+    def _key(self, model):
+        return os.path.abspath(self.manifest.resolve(model).path)
+
+    def get(self, model=DEFAULT_MODEL_PATH, warm_up=False):
+        """The loaded BoundModel for a manifest name or model path."""
+        spec = self.manifest.resolve(model)
+        key = os.path.abspath(spec.path)
+        fingerprint = file_fingerprint(key)
+        with self._lock:
+            entry = self._current(key, fingerprint)
+        if entry is None:
+            with self._load_lock:
+                # Another session may have finished loading while we waited
+                with self._lock:
+                    entry = self._current(key, fingerprint)
+                if entry is None:
+                    entry = self._load(key, spec, fingerprint)
+        if warm_up:
+            self._warm_up(entry)
+        with self._lock:
+            entry.hits += 1
+            # Unless evicted meanwhile to make room for another model; the caller keeps this one
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+        return entry.model
+
+    def _current(self, key, fingerprint):
+        entry = self._entries.get(key)
+        return entry if entry is not None and entry.fingerprint == fingerprint else None
+
+    def _load(self, key, spec, fingerprint):
+        # Drop the stale copy first so old and new weights are never resident together
+        with self._lock:
+            self._entries.pop(key, None)
+        # Resolve the loader before measuring so the one-off framework import
+        # is not charged to the first model
+        loader = self._loader or _default_loader()
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        model = BoundModel(loader(key), spec)
+        load_seconds = time.perf_counter() - start
+        size_bytes = int(spec.memory_mb * 2 ** 20) if spec.memory_mb else os.path.getsize(key)
+        entry = _Entry(model, fingerprint, load_seconds,
+                       max(current_rss_bytes() - rss_before, 0), size_bytes)
+        with self._lock:
+            self._entries[key] = entry
+            self._enforce_budget(key)
+        return entry
+
+    def _enforce_budget(self, keep):
+        # Called with _lock held
+        if self.max_bytes is None:
+            return
+        while self._resident_bytes() > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                self._entries.move_to_end(key)
+                continue
+            del self._entries[key]
+            self.evictions += 1
+
+    def _resident_bytes(self):
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def resident_bytes(self):
+        """Total budgeted size of the loaded models."""
+        with self._lock:
+            return self._resident_bytes()
+
+    def _warm_up(self, entry):
+        # The first predict builds the graph and allocates buffers; pay that
+        # cost at startup instead of on the first farmer's request
+        with entry.warmup_lock:
+            if entry.warmup_seconds is not None:
+                return
+            shape = tuple(dim or 1 for dim in entry.model.input_shape)
+            start = time.perf_counter()
+            entry.model.predict(np.zeros(shape, dtype=np.uint8))
+            entry.warmup_seconds = time.perf_counter() - start
+
+    def preload(self, model=DEFAULT_MODEL_PATH, warm_up=True):
+        """Start loading ``path`` on a background thread and return immediately.
+
+        Lets the page render while the framework imports and the model loads;
+        a later ``get`` of the same path waits for the load instead of
+        starting another. Load errors are left for that ``get`` to raise.
+        """
+        key = self._key(model)
+        with self._lock:
+            if key in self._entries or key in self._preloads:
+                return
+            thread = threading.Thread(target=self._preload, args=(key, warm_up),
+                                      name='model-preload', daemon=True)
+            self._preloads[key] = thread
+        thread.start()
+
+    def _preload(self, key, warm_up):
+        try:
+            self.get(key, warm_up=warm_up)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._preloads.pop(key, None)
+
+    def wait(self, model=DEFAULT_MODEL_PATH, timeout=None):
+        """Block until a preload of ``model`` (if any) has finished."""
+        key = self._key(model)
+        with self._lock:
+            thread = self._preloads.get(key)
+        if thread is not None:
+            thread.join(timeout)
+
+    def evict(self, model):
+        with self._lock:
+            return self._entries.pop(self._key(model), None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Load time, warm-up time and approximate resident memory per model, least recently used first."""
+        with self._lock:
+            entries = list(self._entries.items())
+        return [
+            {
+                'path': key,
+                'name': entry.model.spec.name,
+                'size_bytes': entry.size_bytes,
+                'load_seconds': entry.load_seconds,
+                'warmup_seconds': entry.warmup_seconds,
+                'rss_bytes': entry.rss_bytes,
+                'loaded_at': entry.loaded_at,
+                'hits': entry.hits,
+            }
+            for key, entry in entries
+        ]
+
+
+def _memory_budget():
+    megabytes = os.getenv('BHOOMI_MODEL_MEMORY_MB')
+    return int(float(megabytes) * 2 ** 20) if megabytes else None
+
+
+# Shared by every Streamlit session in this process
+registry = ModelRegistry(max_bytes=_memory_budget())
+
+
+def get_model(model=DEFAULT_MODEL_PATH, warm_up=False):
+    # Let a running preload finish warming up rather than warming up twice
+    registry.wait(model)
+    return registry.get(model, warm_up=warm_up)
+
+
+if __name__ == '__main__':
+    import sys
+
+    for model_path in sys.argv[1:] or [DEFAULT_MODEL_PATH]:
+        get_model(model_path, warm_up=True)
+    for row in registry.stats():
+        print(f"{row['name']} ({row['path']}): load {row['load_seconds'] * 1000:.0f} ms, "
+              f"warm-up {row['warmup_seconds'] * 1000:.0f} ms, "
+              f"~{row['rss_bytes'] / 2 ** 20:.1f} MiB resident")
@@ -0,0 +1,209 @@
+# Content-addressed cache of model predictions
+#
+# Farmers often upload the same photo again. Predictions are cached under a
+# hash of the uploaded bytes plus a fingerprint of the model file and its
+# manifest binding, so a repeat upload skips decode, resize and
+# model.predict. Replacing the model file or changing its labels or
+# preprocessing changes the fingerprint, which invalidates every cached entry
+# at once.
+#
+# Two tiers: an in-memory LRU and an optional SQLite file that survives
+# restarts and is shared between worker processes on the same host.
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from model_manifest import MANIFEST
+from model_registry import DEFAULT_MODEL_PATH, file_fingerprint
+
+_model_hashes = {}
+
+
+def model_fingerprint(path):
+    """SHA-256 of a model file and its binding, rehashing the file only when its size or mtime changes."""
+    spec = MANIFEST.resolve(path)
+    key = os.path.abspath(spec.path)
+    stat_fingerprint = file_fingerprint(key)
+    cached = _model_hashes.get(key)
+    if cached is None or cached[0] != stat_fingerprint:
+        digest = hashlib.sha256()
+        with open(key, 'rb') as model_file:
+            for chunk in iter(lambda: model_file.read(2 ** 20), b''):
+                digest.update(chunk)
+        cached = (stat_fingerprint, digest.hexdigest())
+        _model_hashes[key] = cached
+    return hashlib.sha256(f'{cached[1]}:{spec.fingerprint()}'.encode('utf-8')).hexdigest()
+
+
+class PredictionCache:
+    """LRU (+ optional SQLite) cache of probabilities keyed by image content.
+
+    ``disk_path`` enables the on-disk tier; ``ttl_seconds`` and
+    ``max_disk_entries`` bound it. Entries are stored per model fingerprint,
+    and the previous fingerprint's entries are purged when the model changes.
+    """
+
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, max_entries=1024, disk_path=None,
+                 ttl_seconds=None, max_disk_entries=100_000):
+        self.model_path = model_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                ' key TEXT PRIMARY KEY, model TEXT NOT NULL, probabilities TEXT NOT NULL,'
+                ' created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)')
+
+    def _current_model(self):
+        fingerprint = model_fingerprint(self.model_path)
+        if fingerprint != self._fingerprint:
+            # New model weights: nothing cached for the old ones is valid any more.
+            # Only the previous version's rows go; caches of other models may
+            # share the file, and rows left from earlier runs age out by LRU.
+            self._memory.clear()
+            if self._db is not None and self._fingerprint is not None:
+                self._db.execute('DELETE FROM predictions WHERE model = ?', (self._fingerprint,))
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def key_for(self, data, fingerprint, variant=''):
+        digest = hashlib.sha256(data)
+        digest.update(fingerprint.encode('ascii'))
+        digest.update(variant.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, data, variant=''):
+        """Cached probabilities for these image bytes, or None.
+
+        ``variant`` keeps results computed another way apart, e.g. 'tta8'
+        for the stacked outputs of eight test-time augmentations.
+        """
+        with self._lock:
+            key = self.key_for(data, self._current_model(), variant)
+            probs = self._memory.get(key)
+            if probs is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return probs
+            probs = self._disk_get(key)
+            if probs is not None:
+                self._remember(key, probs)
+                self.disk_hits += 1
+                return probs
+            self.misses += 1
+            return None
+
+    def put(self, data, probabilities, variant=''):
+        probs = np.asarray(probabilities, dtype=np.float32)
+        with self._lock:
+            fingerprint = self._current_model()
+            key = self.key_for(data, fingerprint, variant)
+            self._remember(key, probs)
+            if self._db is not None:
+                now = time.time()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)',
+                    (key, fingerprint, json.dumps(probs.tolist()), now, now),
+                )
+                self._trim_disk()
+
+    def get_or_compute(self, data, compute):
+        """Return cached probabilities, or call ``compute()`` and cache its result."""
+        probs = self.get(data)
+        if probs is None:
+            probs = np.asarray(compute(), dtype=np.float32)
+            self.put(data, probs)
+        return probs
+
+    def _remember(self, key, probs):
+        self._memory[key] = probs
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            'SELECT probabilities, created FROM predictions WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+            self._db.execute('DELETE FROM predictions WHERE key = ?', (key,))
+            return None
+        self._db.execute('UPDATE predictions SET accessed = ? WHERE key = ?', (now, key))
+        return np.asarray(json.loads(row[0]), dtype=np.float32)
+
+    def _trim_disk(self):
+        if self.ttl_seconds is not None:
+            self._db.execute('DELETE FROM predictions WHERE created < ?',
+                             (time.time() - self.ttl_seconds,))
+        excess = self._db.execute('SELECT COUNT(*) FROM predictions').fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            # Evict the least recently used rows
+            self._db.execute(
+                'DELETE FROM predictions WHERE key IN '
+                '(SELECT key FROM predictions ORDER BY accessed LIMIT ?)', (excess,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM predictions')
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_prediction_cache(model_path=DEFAULT_MODEL_PATH):
+    """Process-wide cache for ``model_path``, configured from the environment.
+
+    BHOOMI_PREDICTION_CACHE_SIZE     in-memory entries (default 1024)
+    BHOOMI_PREDICTION_CACHE_DB       SQLite file for the disk tier (default: off)
+    BHOOMI_PREDICTION_CACHE_TTL      disk entry lifetime in seconds (default: none)
+    BHOOMI_PREDICTION_CACHE_DB_SIZE  maximum disk entries (default 100000)
+    """
+    key = os.path.abspath(MANIFEST.resolve(model_path).path)
+    with _caches_lock:
+        if key not in _caches:
+            ttl = os.getenv('BHOOMI_PREDICTION_CACHE_TTL')
+            _caches[key] = PredictionCache(
+                model_path,
+                max_entries=int(os.getenv('BHOOMI_PREDICTION_CACHE_SIZE', 1024)),
+                disk_path=os.getenv('BHOOMI_PREDICTION_CACHE_DB') or None,
+                ttl_seconds=float(ttl) if ttl else None,
+                max_disk_entries=int(os.getenv('BHOOMI_PREDICTION_CACHE_DB_SIZE', 100_000)),
+            )
+        return _caches[key]
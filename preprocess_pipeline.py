@@ -0,0 +1,107 @@
+# Parallel decode/resize stage that overlaps image preprocessing with inference
+#
+# Decoding a 12-megapixel phone JPEG costs more than one predict of the small
+# CNN, so a single thread spends most of its time in cv2. The pipeline runs
+# the loader on a worker pool and hands complete batches to the consumer
+# through a bounded queue: while the model works on batch N, the workers are
+# already decoding batch N+1 (and at most ``prefetch`` batches ahead, so
+# memory stays bounded however many files there are).
+import collections
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class PrefetchPipeline:
+    """Apply ``load`` to ``items`` on a worker pool and yield ordered batches.
+
+    ``processes=True`` uses a process pool instead of threads; ``load`` must
+    then be picklable (a module-level function or a ``functools.partial`` of
+    one). Threads are usually enough because cv2.imdecode and cv2.resize
+    release the GIL.
+    """
+
+    def __init__(self, items, load, batch_size, workers=4, prefetch=2, processes=False):
+        if batch_size < 1 or workers < 1 or prefetch < 1:
+            raise ValueError('batch_size, workers and prefetch must all be at least 1')
+        self.items = items
+        self.load = load
+        self.batch_size = batch_size
+        self.workers = workers
+        self.processes = processes
+        self._batches = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __iter__(self):
+        self._thread = threading.Thread(target=self._produce, name='prefetch', daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                batch = self._batches.get()
+                if batch is _DONE:
+                    return
+                if isinstance(batch, _Failure):
+                    raise batch.error
+                yield batch
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the producer early, e.g. when the consumer breaks out of the loop."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            # Unblock a producer waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._batches.get_nowait()
+                except queue.Empty:
+                    self._thread.join(0.05)
+
+    def _put(self, value):
+        while not self._stop.is_set():
+            try:
+                self._batches.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        executor_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        # Enough work in flight to keep every worker busy through one batch
+        max_in_flight = self.workers + self.batch_size
+        try:
+            with executor_class(max_workers=self.workers) as pool:
+                pending = collections.deque()
+                batch = []
+                items = iter(self.items)
+                exhausted = False
+                while not self._stop.is_set():
+                    while not exhausted and len(pending) < max_in_flight:
+                        try:
+                            pending.append(pool.submit(self.load, next(items)))
+                        except StopIteration:
+                            exhausted = True
+                    if not pending:
+                        break
+                    batch.append(pending.popleft().result())
+                    if len(batch) == self.batch_size:
+                        if not self._put(batch):
+                            break
+                        batch = []
+                for future in pending:
+                    future.cancel()
+                if batch and not self._stop.is_set():
+                    self._put(batch)
+        except Exception as e:
+            self._put(_Failure(e))
+            return
+        self._put(_DONE)
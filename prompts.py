@@ -0,0 +1,151 @@
+# Prompt catalog for the disease descriptions
+#
+# Prompts live in prompts.json, indexed by language code:
+#
+#   {"version": 1, "default_language": "en",
+#    "languages": {"hi": {"name": "Hindi", "label": "Hindi (हिंदी)",
+#                         "template": "... {disease_name} ..."}, ...}}
+#
+# Adding a language means adding an entry there. The catalog is loaded and
+# validated once per process; its version is part of the description store
+# key, so editing the wording (or pointing BHOOMI_PROMPTS at another catalog
+# for an A/B comparison) never serves descriptions written for other prompts.
+#
+#   python prompts.py --check    # validate and render every language x disease
+import argparse
+import json
+import os
+import string
+import sys
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts.json')
+
+# The only placeholder a template may use
+PLACEHOLDER = 'disease_name'
+
+
+class PromptCatalogError(ValueError):
+    pass
+
+
+def _check_template(code, template):
+    if not isinstance(template, str) or not template.strip():
+        raise PromptCatalogError(f"{code}: template must be a non-empty string")
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+    except ValueError as e:
+        raise PromptCatalogError(f"{code}: malformed template: {e}") from e
+    if fields != [PLACEHOLDER]:
+        raise PromptCatalogError(
+            f"{code}: template must contain {{{PLACEHOLDER}}} exactly once and no other fields, got {fields}"
+        )
+
+
+class PromptCatalog:
+    def __init__(self, version, default_language, languages):
+        self.version = version
+        self.default_language = default_language
+        self.languages = languages
+        self._codes_by_name = {entry['name']: code for code, entry in languages.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a catalog, raising PromptCatalogError if anything is off."""
+        if not isinstance(data, dict):
+            raise PromptCatalogError("catalog must be a JSON object")
+        version = data.get('version')
+        if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+            raise PromptCatalogError("version must be a positive integer")
+        languages = data.get('languages')
+        if not isinstance(languages, dict) or not languages:
+            raise PromptCatalogError("languages must be a non-empty object")
+        names = set()
+        for code, entry in languages.items():
+            if not isinstance(entry, dict):
+                raise PromptCatalogError(f"{code}: entry must be an object")
+            for field in ('name', 'label'):
+                if not isinstance(entry.get(field), str) or not entry[field]:
+                    raise PromptCatalogError(f"{code}: missing {field}")
+            if entry['name'] in names:
+                raise PromptCatalogError(f"{code}: duplicate language name {entry['name']!r}")
+            names.add(entry['name'])
+            _check_template(code, entry.get('template'))
+        default_language = data.get('default_language')
+        if default_language not in languages:
+            raise PromptCatalogError(f"default_language {default_language!r} is not in languages")
+        return cls(version, default_language, languages)
+
+    def code_for(self, language):
+        """Language code for a code or display name; unknown languages get the default."""
+        if language in self.languages:
+            return language
+        return self._codes_by_name.get(language, self.default_language)
+
+    def render(self, disease_name, language):
+        template = self.languages[self.code_for(language)]['template']
+        return template.format(**{PLACEHOLDER: disease_name})
+
+    def options(self):
+        """{name: label} in catalog order, for the language dropdown."""
+        return {entry['name']: entry['label'] for entry in self.languages.values()}
+
+
+def load_catalog(path=None):
+    path = path or os.getenv('BHOOMI_PROMPTS') or DEFAULT_CATALOG_PATH
+    try:
+        with open(path, encoding='utf-8') as catalog_file:
+            data = json.load(catalog_file)
+    except (OSError, ValueError) as e:
+        raise PromptCatalogError(f"cannot read prompt catalog {path}: {e}") from e
+    return PromptCatalog.from_dict(data)
+
+
+# Loaded once at import; a broken catalog fails at startup, not mid-request
+CATALOG = load_catalog()
+PROMPT_VERSION = CATALOG.version
+LANGUAGE_OPTIONS = CATALOG.options()
+
+
+def build_prompt(disease_name, language):
+    return CATALOG.render(disease_name, language)
+
+
+def check(catalog, disease_names):
+    """Render every language x disease combination; returns the number rendered."""
+    rendered = 0
+    for code in catalog.languages:
+        for disease_name in disease_names:
+            prompt = catalog.render(disease_name, code)
+            if disease_name not in prompt:
+                raise PromptCatalogError(f"{code}: rendered prompt does not mention {disease_name!r}")
+            rendered += 1
+    return rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Validate the prompt catalog.')
+    parser.add_argument('catalog', nargs='?', help='catalog file (default: $BHOOMI_PROMPTS or prompts.json)')
+    parser.add_argument('--check', action='store_true',
+                        help='render every language x disease combination')
+    parser.add_argument('--show', metavar='LANGUAGE', help='print the prompts for one language')
+    args = parser.parse_args(argv)
+
+    from model_manifest import MANIFEST
+    disease_names = [result.split('-')[1].replace('_', ' ') for result in MANIFEST.labels()]
+    try:
+        catalog = load_catalog(args.catalog)
+        if args.check:
+            rendered = check(catalog, disease_names)
+            print(f"Prompt catalog v{catalog.version}: {len(catalog.languages)} languages, "
+                  f"{rendered} prompts rendered OK")
+        if args.show:
+            for disease_name in disease_names:
+                print(catalog.render(disease_name, args.show))
+    except PromptCatalogError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
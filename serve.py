@@ -0,0 +1,301 @@
+# JSON/HTTP prediction service for partner apps
+#
+#   python serve.py --port 8000 --max-batch-size 32 --max-wait-ms 5
+#
+#   curl --data-binary @leaf.jpg -H 'Content-Type: image/jpeg' localhost:8000/predict
+#   curl -d '{"image": "<base64 JPEG>"}' -H 'Content-Type: application/json' localhost:8000/predict
+#
+# Requests are decoded on the server's handler threads and then grouped into
+# micro-batches, so concurrent callers share a single model.predict call.
+#
+# With --metrics, GET /metrics returns per-stage latency histograms and
+# request counters in the Prometheus text format (see telemetry.py).
+#
+# GET / is a small upload page for phones on slow links: the browser
+# downscales the photo (long side CLIENT_MAX_SIDE) and re-encodes it as JPEG
+# before sending, so a multi-megabyte photo goes over the wire as tens of
+# kilobytes and the server decodes a fraction of the pixels. Partner apps
+# should do the same; `python benchmark.py --client-upload` measures the
+# effect on bytes, decode time and predictions.
+import argparse
+import base64
+import binascii
+import functools
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from inference import decode_image, predict_batch, preprocess, top_k
+from micro_batcher import MicroBatcher
+from model_registry import DEFAULT_MODEL_PATH, get_model
+from prediction_cache import get_prediction_cache
+from telemetry import CONTENT_TYPE, Telemetry
+from uploads import CLIENT_JPEG_QUALITY, CLIENT_MAX_SIDE
+
+# Largest accepted upload
+MAX_BODY_BYTES = 20 * 2 ** 20
+
+
+# Downscales in the browser with repeated halving (one large canvas step
+# aliases), then posts the JPEG to /predict
+UPLOAD_PAGE = '''<!doctype html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>BhoomiSetu - Crop Disease Detector</title>
+<style>
+  body { font-family: sans-serif; max-width: 32rem; margin: 1rem auto; padding: 0 1rem; }
+  img { max-width: 100%; margin-top: 1rem; }
+</style>
+</head>
+<body>
+<h1>🌾 BhoomiSetu</h1>
+<p>Take or choose a photo of one leaf.</p>
+<input type="file" id="photo" accept="image/*" capture="environment">
+<p id="status"></p>
+<h2 id="result"></h2>
+<img id="preview" alt="">
+<script>
+const MAX_SIDE = __MAX_SIDE__, QUALITY = __QUALITY__;
+
+async function downscale(file) {
+  const bitmap = await createImageBitmap(file, {imageOrientation: 'from-image'});
+  const scale = Math.min(1, MAX_SIDE / Math.max(bitmap.width, bitmap.height));
+  const target = [Math.round(bitmap.width * scale), Math.round(bitmap.height * scale)];
+  let source = bitmap, width = bitmap.width, height = bitmap.height;
+  do {
+    width = Math.max(Math.round(width / 2), target[0]);
+    height = Math.max(Math.round(height / 2), target[1]);
+    const canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    const context = canvas.getContext('2d');
+    context.imageSmoothingQuality = 'high';
+    context.drawImage(source, 0, 0, width, height);
+    source = canvas;
+  } while (width > target[0] || height > target[1]);
+  return new Promise(resolve => source.toBlob(resolve, 'image/jpeg', QUALITY));
+}
+
+const kb = bytes => `${Math.round(bytes / 1024)} kB`;
+
+document.getElementById('photo').addEventListener('change', async event => {
+  const file = event.target.files[0];
+  if (!file) return;
+  const status = document.getElementById('status');
+  const result = document.getElementById('result');
+  result.textContent = '';
+  status.textContent = 'Preparing photo...';
+  const blob = await downscale(file);
+  document.getElementById('preview').src = URL.createObjectURL(blob);
+  status.textContent = `Sending ${kb(blob.size)} instead of ${kb(file.size)}...`;
+  try {
+    const response = await fetch('predict', {
+      method: 'POST', headers: {'Content-Type': 'image/jpeg'}, body: blob,
+    });
+    const body = await response.json();
+    status.textContent = `Sent ${kb(blob.size)} instead of ${kb(file.size)}.`;
+    if (body.error) {
+      result.textContent = body.error;
+    } else if (body.unknown) {
+      result.textContent = `Not sure (${Math.round(body.confidence * 100)}%). Try a closer photo of one leaf.`;
+    } else {
+      result.textContent = `${body.crop}: ${body.disease} (${Math.round(body.confidence * 100)}%)`;
+    }
+  } catch (error) {
+    status.textContent = `Upload failed: ${error}`;
+  }
+});
+</script>
+</body>
+</html>
+'''.replace('__MAX_SIDE__', str(CLIENT_MAX_SIDE)).replace('__QUALITY__', str(CLIENT_JPEG_QUALITY / 100))
+
+
+class BadRequest(Exception):
+    pass
+
+
+def prediction_response(probs, spec):
+    """Response body for calibrated probabilities; ``unknown`` is true below the model's min_confidence."""
+    best = int(probs.argmax())
+    result = spec.labels[best]
+    return {
+        'label': result,
+        'crop': result.split('-')[0],
+        'disease': result.split('-')[1].replace('_', ' '),
+        'confidence': float(probs[best]),
+        'unknown': not spec.is_confident(float(probs[best])),
+        'top_k': [{'label': label, 'probability': p} for label, p in top_k(probs, spec.labels)],
+        'probabilities': {name: float(p) for name, p in zip(spec.labels, probs)},
+    }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    server_version = 'BhoomiSetu/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            batcher = self.server.batcher
+            self._send_json(200, {
+                'status': 'ok',
+                'classes': list(self.server.model.labels),
+                'batches': batcher.batches,
+                'mean_batch_size': batcher.mean_batch_size(),
+                'cache': self.server.cache.stats() if self.server.cache is not None else None,
+            })
+        elif self.path == '/metrics' and self.server.telemetry.enabled:
+            body = self.server.telemetry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/':
+            body = UPLOAD_PAGE.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        telemetry = self.server.telemetry
+        trace = telemetry.trace()
+        start = time.perf_counter()
+        try:
+            with trace.span('upload'):
+                data = self._read_image_bytes()
+        except BadRequest as e:
+            trace.finish('bad_request')
+            self._send_json(400, {'error': str(e)})
+            return
+        telemetry.upload_bytes.observe(len(data))
+        cache = self.server.cache
+        probs = None
+        if cache is not None:
+            with trace.span('cache_lookup'):
+                probs = cache.get(data)
+            telemetry.cache_lookups.inc(cache='prediction', result='miss' if probs is None else 'hit')
+        decoded = time.perf_counter()
+        if probs is None:
+            with trace.span('decode'):
+                image = decode_image(data, self.server.reduce)
+            if image is None:
+                trace.finish('bad_image')
+                self._send_json(400, {'error': 'could not decode image'})
+                return
+            with trace.span('resize'):
+                image = preprocess(image, self.server.model.input_size)
+            decoded = time.perf_counter()
+            try:
+                # Includes waiting for the micro-batch to fill
+                with trace.span('predict'):
+                    probs = self.server.batcher.predict(image, timeout=self.server.timeout_seconds)
+            except Exception as e:
+                trace.finish('error')
+                self._send_json(500, {'error': f'prediction failed: {e}'})
+                return
+            if cache is not None:
+                with trace.span('cache_store'):
+                    cache.put(data, probs)
+        trace.finish()
+        body = prediction_response(probs, self.server.model.spec)
+        body['timing_ms'] = {
+            'decode': (decoded - start) * 1000,
+            'predict': (time.perf_counter() - decoded) * 1000,
+        }
+        self._send_json(200, body)
+
+    def _read_image_bytes(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            raise BadRequest('empty request body')
+        if length > MAX_BODY_BYTES:
+            raise BadRequest(f'image larger than {MAX_BODY_BYTES} bytes')
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                return base64.b64decode(json.loads(body)['image'], validate=True)
+            except (ValueError, KeyError, TypeError, binascii.Error):
+                raise BadRequest('expected a JSON object with a base64 "image" field')
+        return body
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(model, host='127.0.0.1', port=8000, max_batch_size=32, max_wait_ms=5.0,
+                reduce=1, quiet=False, cache=None, telemetry=None):
+    """Build (but do not start) a prediction server around ``model``.
+
+    ``cache`` is an optional PredictionCache consulted before decoding;
+    ``telemetry`` an enabled Telemetry to time requests and serve /metrics.
+    """
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.batcher = MicroBatcher(functools.partial(predict_batch, model), max_batch_size, max_wait_ms)
+    server.reduce = reduce
+    server.cache = cache
+    server.quiet = quiet
+    server.telemetry = telemetry or Telemetry(enabled=False)
+    server.timeout_seconds = 30
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Serve plant disease predictions over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='models.json name or model file')
+    parser.add_argument('--max-batch-size', type=int, default=32,
+                        help='largest micro-batch passed to model.predict (default: 32)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='how long the first request waits for others to join its batch (default: 5)')
+    parser.add_argument('--reduced-decode', default='1', choices=['1', '2', '4', '8', 'auto'],
+                        help='decode JPEGs at 1/N scale; auto keeps at least 256x256 (default: 1)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not cache predictions by image content')
+    parser.add_argument('--quiet', action='store_true', help='do not log each request')
+    parser.add_argument('--metrics', action='store_true',
+                        help='time each request stage and serve Prometheus metrics on /metrics')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    reduce = args.reduced_decode if args.reduced_decode == 'auto' else int(args.reduced_decode)
+    model = get_model(args.model, warm_up=True)
+    cache = None if args.no_cache else get_prediction_cache(args.model)
+    server = make_server(model, args.host, args.port, args.max_batch_size, args.max_wait_ms,
+                         reduce, args.quiet, cache, Telemetry(enabled=args.metrics))
+    print(f"Serving predictions on http://{args.host}:{server.server_port}/predict "
+          f"(upload page at http://{args.host}:{server.server_port}/)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+
+
+if __name__ == '__main__':
+    main()
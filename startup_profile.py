@@ -0,0 +1,127 @@
+# Where does the app's cold start go?
+#
+#   python startup_profile.py                         # default model
+#   python startup_profile.py --model artifacts/plant_disease_model_int8.tflite
+#   python startup_profile.py --json startup.json --budget-seconds 1.5
+#
+# Runs a fresh interpreter with `python -X importtime`, imports what
+# main_app.py imports, then loads and warms up the model the way the app does.
+# Import time is attributed to top-level packages and split into the two
+# phases: what the page waits for before it can render, and what the first
+# prediction waits for (the inference runtime plus the model itself).
+#
+# --budget-seconds exits non-zero when the time to first render exceeds the
+# budget, so an accidental heavy import at module level shows up in CI.
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+
+from model_registry import DEFAULT_MODEL_PATH
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main_app.py')
+
+PHASE_MARKER = '--- model load ---'
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+print({marker!r}, file=sys.stderr, flush=True)
+from model_registry import registry
+registry.get({model!r}, warm_up=True)
+entry = registry.stats()[0]
+print(json.dumps({{'import_seconds': imported - start,
+                  'model_seconds': time.perf_counter() - imported,
+                  'load_seconds': entry['load_seconds'],
+                  'warmup_seconds': entry['warmup_seconds'],
+                  'rss_bytes': entry['rss_bytes']}}))
+"""
+
+
+def app_modules(path=APP_PATH):
+    """The modules main_app.py imports at module level, in order."""
+    with open(path, encoding='utf-8') as source:
+        tree = ast.parse(source.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)')
+
+
+def parse_importtime(lines):
+    """{top-level package: cumulative seconds} for the imports in ``lines``."""
+    packages = {}
+    for line in lines:
+        match = _IMPORTTIME_LINE.match(line)
+        # Indentation is two spaces per nesting level after the first
+        if not match or len(match.group(3)) != 1:
+            continue
+        package = match.group(4).split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(match.group(2)) / 1e6
+    return packages
+
+
+def profile(model_path):
+    code = _CHILD.format(imports='\n'.join(f'import {module}' for module in app_modules()),
+                         marker=PHASE_MARKER, model=model_path)
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3')
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True,
+                             text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(f"profiling subprocess failed:\n{process.stderr[-2000:]}")
+    stderr = process.stderr.splitlines()
+    split = stderr.index(PHASE_MARKER)
+    report = json.loads(process.stdout.strip().splitlines()[-1])
+    report['model'] = model_path
+    report['app_imports'] = parse_importtime(stderr[:split])
+    report['model_imports'] = parse_importtime(stderr[split + 1:])
+    return report
+
+
+def print_report(report, top=8):
+    def rows(packages):
+        for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            print(f"    {package:<28} {seconds:>7.3f} s")
+
+    print(f"Startup profile for {report['model']}")
+    print(f"  before first render        {report['import_seconds']:>7.3f} s")
+    rows(report['app_imports'])
+    print(f"  before first prediction    {report['model_seconds']:>7.3f} s")
+    rows(report['model_imports'])
+    print(f"    {'(model load + warm-up)':<28} {report['load_seconds'] + report['warmup_seconds']:>7.3f} s")
+    print(f"  model memory (RSS growth)  {report['rss_bytes'] / 2 ** 20:>7.0f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Break down the app's cold-start time.")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help='model to load (default: $BHOOMI_MODEL)')
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    parser.add_argument('--budget-seconds', type=float,
+                        help='fail if the imports before first render take longer than this')
+    args = parser.parse_args(argv)
+
+    report = profile(args.model)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.budget_seconds is not None and report['import_seconds'] > args.budget_seconds:
+        print(f"error: imports before first render took {report['import_seconds']:.3f} s, "
+              f"budget is {args.budget_seconds:.3f} s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+# Per-request stage timing and Prometheus metrics
+#
+#   BHOOMI_METRICS_PORT=9464 streamlit run main_app.py   # metrics at http://localhost:9464/metrics
+#   BHOOMI_DEBUG_PANEL=1 streamlit run main_app.py       # timing breakdown under each prediction
+#   python serve.py --metrics                            # /metrics next to /predict
+#
+# Each request gets a Trace, and `with trace.span('decode'):` times one stage.
+# Finished spans feed the bhoomi_stage_seconds histogram, exported in the
+# Prometheus text format together with a few counters.
+#
+# Telemetry is off unless one of the variables above is set. trace() then
+# returns a shared no-op whose span() hands back one reusable null context
+# and whose counters return immediately, so instrumented code pays about a
+# method call per stage.
+import bisect
+import contextlib
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds; decode and resize sit at the low end, a Groq
+# description at the high end
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Upload sizes in bytes, from thumbnails to 12-megapixel photos
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=(), enabled=True):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.enabled = enabled
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_label_text(self.labelnames, key)} {_number(value)}'
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, enabled=True):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        # key -> [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not self.enabled:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels[name] for name in self.labelnames))
+        return sum(entry[0]) if entry else 0
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _label_text(self.labelnames, key, [('le', _number(float(bound)))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _label_text(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_number(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Trace:
+    """Stage timings of one request, in the order the stages finished."""
+
+    enabled = True
+
+    def __init__(self, telemetry):
+        self._telemetry = telemetry
+        self._start = time.perf_counter()
+        self._seconds = None
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Record a stage timed elsewhere, e.g. across a streamed response."""
+        self.spans.append((name, seconds))
+        self._telemetry.stage_seconds.observe(seconds, stage=name)
+
+    def finish(self, outcome='ok'):
+        """Count the request and return its wall-clock seconds; later calls only return them."""
+        if self._seconds is None:
+            self._seconds = time.perf_counter() - self._start
+            self._telemetry.request_seconds.observe(self._seconds)
+            self._telemetry.requests.inc(outcome=outcome)
+        return self._seconds
+
+
+class _NullTrace:
+    enabled = False
+    spans = ()
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def add(self, name, seconds):
+        pass
+
+    def finish(self, outcome='ok'):
+        return 0.0
+
+
+_NULL_SPAN = contextlib.nullcontext()
+NULL_TRACE = _NullTrace()
+
+
+class Telemetry:
+    """Metric definitions plus a trace() factory; everything is a no-op when disabled."""
+
+    def __init__(self, enabled=True, debug_panel=False):
+        self.enabled = enabled
+        self.debug_panel = debug_panel
+        self.stage_seconds = Histogram('bhoomi_stage_seconds', 'Time spent in each stage of a request.',
+                                       ('stage',), enabled=enabled)
+        self.request_seconds = Histogram('bhoomi_request_seconds', 'Wall-clock time of whole requests.',
+                                         enabled=enabled)
+        self.requests = Counter('bhoomi_requests_total', 'Prediction requests by outcome.', ('outcome',),
+                                enabled=enabled)
+        self.upload_bytes = Histogram('bhoomi_upload_bytes', 'Size of uploaded images.',
+                                      buckets=SIZE_BUCKETS, enabled=enabled)
+        self.cache_lookups = Counter('bhoomi_cache_lookups_total', 'Prediction and description cache lookups.',
+                                     ('cache', 'result'), enabled=enabled)
+        self.metrics = [self.stage_seconds, self.request_seconds, self.requests, self.upload_bytes,
+                        self.cache_lookups]
+
+    def trace(self):
+        return Trace(self) if self.enabled else NULL_TRACE
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.telemetry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(telemetry, host='127.0.0.1', port=9464):
+    """Serve /metrics on a background thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.telemetry = telemetry
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """Process-wide telemetry configured from the environment.
+
+    BHOOMI_METRICS_PORT   serve /metrics on this port (BHOOMI_METRICS_HOST, default 127.0.0.1)
+    BHOOMI_DEBUG_PANEL    1 to show each request's timing breakdown in the app
+    """
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            port = os.getenv('BHOOMI_METRICS_PORT')
+            debug_panel = os.getenv('BHOOMI_DEBUG_PANEL', '') not in ('', '0')
+            _telemetry = Telemetry(enabled=bool(port) or debug_panel, debug_panel=debug_panel)
+            if port:
+                try:
+                    start_metrics_server(_telemetry, os.getenv('BHOOMI_METRICS_HOST', '127.0.0.1'), int(port))
+                except OSError as e:
+                    # Another process (e.g. a second app worker) may hold the port
+                    print(f"Metrics endpoint not started on port {port}: {e}", file=sys.stderr)
+        return _telemetry
@@ -0,0 +1,20 @@
+from descriptions import DescriptionStore, stream_description
+from groq_stub import canned_description, start_stub
+from prompts import build_prompt
+
+
+def test_stream_decodes_non_ascii_as_utf8():
+    # The stub sends text/event-stream without a charset, like many servers
+    server, url = start_stub()
+    try:
+        for language in ('Hindi', 'Telugu'):
+            expected = canned_description(build_prompt('Early blight', language))
+            assert any(ord(char) > 127 for char in expected)
+            assert ''.join(stream_description('Early blight', language, 'key', url)) == expected
+
+        store = DescriptionStore(db_path=None)
+        streamed = ''.join(store.stream('Early blight', 'Hindi', 'key', url))
+        assert store.get('Early blight', 'Hindi') == streamed
+        assert streamed == canned_description(build_prompt('Early blight', 'Hindi'))
+    finally:
+        server.shutdown()
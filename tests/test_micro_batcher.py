@@ -0,0 +1,34 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+def test_timed_out_requests_are_not_predicted():
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def predict(images):
+        batches.append(list(images))
+        started.set()
+        release.wait(5)
+        return [[image] for image in images]
+
+    batcher = MicroBatcher(predict, max_batch_size=8, max_wait_ms=0)
+    try:
+        busy = batcher.submit('busy')
+        assert started.wait(5)
+        # The worker is busy, so this request times out while still queued
+        with pytest.raises(TimeoutError):
+            batcher.predict('abandoned', timeout=0.05)
+        waiting = batcher.submit('waiting')
+        release.set()
+        assert busy.result(5) == ['busy']
+        assert waiting.result(5) == ['waiting']
+        assert batches == [['busy'], ['waiting']]
+        assert batcher.items == 2
+    finally:
+        release.set()
+        batcher.close()
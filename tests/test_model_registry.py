@@ -0,0 +1,55 @@
+import threading
+import time
+
+import numpy as np
+
+from model_registry import ModelRegistry
+
+
+class SlowBackend:
+    name = 'slow'
+
+    def __init__(self, size, labels):
+        self.input_shape = (None, *size, 3)
+        self.labels = labels
+        self.calls = 0
+
+    def predict(self, batch):
+        self.calls += 1
+        time.sleep(0.05)
+        return np.full((len(batch), self.labels), 1.0 / self.labels, dtype=np.float32)
+
+
+def test_concurrent_gets_load_and_warm_up_once(tmp_path):
+    path = tmp_path / 'model.keras'
+    path.write_bytes(b'weights')
+    backends = []
+
+    registry = ModelRegistry(max_bytes=None)
+    spec = registry.manifest.resolve(str(path))
+
+    def loader(key):
+        time.sleep(0.05)
+        backends.append(SlowBackend(spec.input_size, len(spec.labels)))
+        return backends[-1]
+
+    registry._loader = loader
+    start = threading.Barrier(8)
+    models = []
+
+    def get():
+        start.wait()
+        models.append(registry.get(str(path), warm_up=True))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(backends) == 1
+    assert backends[0].calls == 1
+    assert len(models) == 8 and all(model is models[0] for model in models)
+    [stats] = registry.stats()
+    assert stats['hits'] == 8
+    assert registry.resident_bytes() == len(b'weights')
@@ -0,0 +1,42 @@
+import string
+
+import pytest
+
+from descriptions import disease_name_of
+from model_manifest import MANIFEST
+from prompts import CATALOG, PromptCatalog, PromptCatalogError, check, load_catalog
+
+DISEASES = [disease_name_of(result) for result in MANIFEST.labels()]
+
+
+@pytest.mark.parametrize('code', list(CATALOG.languages))
+@pytest.mark.parametrize('disease_name', DISEASES)
+def test_every_language_and_disease_renders(code, disease_name):
+    prompt = load_catalog().render(disease_name, code)
+    assert disease_name in prompt
+    # Nothing left to fill in: no {field} and no stray braces
+    assert [field for _, field, _, _ in string.Formatter().parse(prompt) if field is not None] == []
+    assert '{' not in prompt and '}' not in prompt
+
+
+def test_check_covers_every_combination():
+    assert check(CATALOG, DISEASES) == len(CATALOG.languages) * len(DISEASES)
+
+
+def test_languages_are_selectable_by_name():
+    for code, entry in CATALOG.languages.items():
+        assert CATALOG.code_for(entry['name']) == code
+
+
+def test_template_with_unknown_placeholder_is_rejected():
+    data = {'version': 1, 'default_language': 'en',
+            'languages': {'en': {'name': 'English', 'label': 'English', 'template': 'Describe {disease}.'}}}
+    with pytest.raises(PromptCatalogError):
+        PromptCatalog.from_dict(data)
+
+
+def test_template_without_placeholder_is_rejected():
+    data = {'version': 1, 'default_language': 'en',
+            'languages': {'en': {'name': 'English', 'label': 'English', 'template': 'Describe the disease.'}}}
+    with pytest.raises(PromptCatalogError):
+        PromptCatalog.from_dict(data)
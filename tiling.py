@@ -0,0 +1,220 @@
+# Tiled analysis of high-resolution leaf photos
+#
+#   python tiling.py photo.jpg                       # aggregate label and tile votes
+#   python tiling.py "Test Image/" --heatmaps out/   # also write a heatmap per image
+#
+# preprocess() squashes the whole photo into the 256x256 model input, so on a
+# 4000x3000 photo a lesion a few millimetres across shrinks to a pixel or
+# two, and the leaf is stretched to a square. Tiled mode keeps the photo's
+# resolution and aspect ratio instead: it cuts the image into overlapping
+# model-input-sized tiles (TILE_OVERLAP of a side), classifies each one and
+# averages the tiles that show the plant.
+#
+# Tiles are views into the decoded image (sliding_window_view), so no pixels
+# are copied until a batch of TILE_BATCH tiles is stacked for predict.
+# Background tiles are dropped before that: a plant mask is computed once at
+# 1/MASK_SCALE scale, and its integral image gives every tile's plant
+# fraction in four lookups. Memory is therefore the decoded image plus one
+# batch whatever the photo size, and photos whose long side exceeds
+# BHOOMI_TILE_MAX_SIDE (default 4096) are decoded at reduced size first.
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from batch_predict import iter_image_paths
+from inference import decode_image, jpeg_size, predict_batch
+
+TILE_OVERLAP = 0.25
+
+TILE_BATCH = 32
+
+# Tiles with less plant than this (share of the tile's pixels) are background
+MIN_PLANT_FRACTION = 0.15
+
+MASK_SCALE = 8
+
+TILE_MAX_SIDE = int(os.getenv('BHOOMI_TILE_MAX_SIDE', '4096'))
+
+# OpenCV HSV (hue 0..180): green leaves and yellow-to-brown lesions, but not
+# grey, white or very dark backgrounds
+_PLANT_HUE = (5, 95)
+_PLANT_MIN_SATURATION = 40
+_PLANT_MIN_VALUE = 40
+
+
+def decode_for_tiling(data, max_side=TILE_MAX_SIDE):
+    """Decode image bytes to BGR with the long side at most ``max_side`` (None if undecodable).
+
+    JPEGs are decoded directly at the smallest libjpeg reduction that fits,
+    so a very large photo is never held at full resolution.
+    """
+    reduce = 1
+    size = jpeg_size(data)
+    if size is not None:
+        for reduce in (1, 2, 4, 8):
+            if max(size) // reduce <= max_side:
+                break
+    image = decode_image(data, reduce)
+    if image is not None and max(image.shape[:2]) > max_side:
+        scale = max_side / max(image.shape[:2])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def tile_origins(length, tile, stride):
+    """Start offsets of tiles covering ``length``; the last tile is flush with the edge."""
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile + 1, stride))
+    if origins[-1] != length - tile:
+        origins.append(length - tile)
+    return origins
+
+
+def _fit(image, size):
+    """Upscale an image smaller than one tile (width, height) so at least one tile fits."""
+    height, width = image.shape[:2]
+    scale = max(size[0] / width, size[1] / height)
+    if scale <= 1:
+        return image
+    return cv2.resize(image, (max(int(np.ceil(width * scale)), size[0]),
+                              max(int(np.ceil(height * scale)), size[1])))
+
+
+def _layout(image, size, overlap):
+    """(row origins, column origins) of the tiles of ``image``."""
+    width, height = size
+    return (tile_origins(image.shape[0], height, max(int(height * (1 - overlap)), 1)),
+            tile_origins(image.shape[1], width, max(int(width * (1 - overlap)), 1)))
+
+
+def plant_fractions(image, ys, xs, size):
+    """Share of plant pixels in each tile, as a (len(ys), len(xs)) array."""
+    small = cv2.resize(image, (max(image.shape[1] // MASK_SCALE, 1), max(image.shape[0] // MASK_SCALE, 1)),
+                       interpolation=cv2.INTER_AREA)
+    hue, saturation, value = cv2.split(cv2.cvtColor(small, cv2.COLOR_BGR2HSV))
+    mask = ((hue >= _PLANT_HUE[0]) & (hue <= _PLANT_HUE[1]) & (saturation >= _PLANT_MIN_SATURATION)
+            & (value >= _PLANT_MIN_VALUE))
+    integral = cv2.integral(mask.astype(np.uint8))
+    scale_y, scale_x = small.shape[0] / image.shape[0], small.shape[1] / image.shape[1]
+    fractions = np.zeros((len(ys), len(xs)), np.float32)
+    for row, y in enumerate(ys):
+        top, bottom = int(y * scale_y), max(int((y + size[1]) * scale_y), int(y * scale_y) + 1)
+        for column, x in enumerate(xs):
+            left, right = int(x * scale_x), max(int((x + size[0]) * scale_x), int(x * scale_x) + 1)
+            plant = (integral[bottom, right] - integral[top, right] - integral[bottom, left]
+                     + integral[top, left])
+            fractions[row, column] = plant / ((bottom - top) * (right - left))
+    return fractions
+
+
+def tile_grid(image, model, overlap=TILE_OVERLAP, batch_size=TILE_BATCH, min_plant=MIN_PLANT_FRACTION):
+    """Per-tile probabilities of a decoded BGR image.
+
+    Returns a (rows, columns, len(model.labels)) array with NaN rows for
+    background tiles. If no tile looks like a plant the mask has failed
+    rather than the photo, and every tile is classified.
+    """
+    image = _fit(image, model.input_size)
+    width, height = model.input_size
+    ys, xs = _layout(image, model.input_size, overlap)
+    keep = plant_fractions(image, ys, xs, model.input_size) >= min_plant
+    if not keep.any():
+        keep[:] = True
+    windows = np.lib.stride_tricks.sliding_window_view(image, (height, width, 3))
+    positions = list(zip(*np.nonzero(keep)))
+    grid = np.full((len(ys), len(xs), len(model.labels)), np.nan, np.float32)
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        probabilities = predict_batch(model, [windows[ys[row], xs[column], 0] for row, column in chunk])
+        for (row, column), probs in zip(chunk, probabilities):
+            grid[row, column] = probs
+    return grid
+
+
+def tile_summary(grid):
+    """Mean probabilities over the classified tiles, and how many tiles voted for each label."""
+    tiles = grid[~np.isnan(grid[..., 0])]
+    votes = np.bincount(tiles.argmax(axis=1), minlength=grid.shape[-1])
+    return tiles.mean(axis=0), votes
+
+
+def heatmap(image, grid, size, label_index, overlap=TILE_OVERLAP, max_side=768, alpha=0.45):
+    """BGR overlay of each tile's probability of ``label_index`` on a copy of the image.
+
+    ``image``, ``size`` and ``overlap`` must be those tile_grid() was given.
+    Overlapping tiles are averaged; background tiles are left uncoloured.
+    """
+    image = _fit(image, size)
+    ys, xs = _layout(image, size, overlap)
+    scale = min(1.0, max_side / max(image.shape[:2]))
+    canvas_height, canvas_width = int(image.shape[0] * scale), int(image.shape[1] * scale)
+    total = np.zeros((canvas_height, canvas_width), np.float32)
+    count = np.zeros((canvas_height, canvas_width), np.float32)
+    for row, y in enumerate(ys):
+        for column, x in enumerate(xs):
+            if np.isnan(grid[row, column, 0]):
+                continue
+            top, bottom = int(y * scale), int((y + size[1]) * scale)
+            left, right = int(x * scale), int((x + size[0]) * scale)
+            total[top:bottom, left:right] += grid[row, column, label_index]
+            count[top:bottom, left:right] += 1
+    heat = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    colours = cv2.applyColorMap((heat * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    small = cv2.resize(image, (canvas_width, canvas_height), interpolation=cv2.INTER_AREA)
+    overlay = cv2.addWeighted(small, 1 - alpha, colours, alpha, 0)
+    overlay[count == 0] = small[count == 0]
+    return overlay
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Classify high-resolution leaf photos tile by tile.')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or glob patterns')
+    parser.add_argument('--model', help='model name or file (default: $BHOOMI_MODEL)')
+    parser.add_argument('--overlap', type=float, default=TILE_OVERLAP,
+                        help=f'overlap between neighbouring tiles, as a fraction (default: {TILE_OVERLAP})')
+    parser.add_argument('--min-plant', type=float, default=MIN_PLANT_FRACTION,
+                        help=f'plant share below which a tile is skipped (default: {MIN_PLANT_FRACTION})')
+    parser.add_argument('--max-side', type=int, default=TILE_MAX_SIDE,
+                        help='longest side photos are analysed at (default: $BHOOMI_TILE_MAX_SIDE or 4096)')
+    parser.add_argument('--heatmaps', help='write <image>_heatmap.png for each image to this directory')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not 0 <= args.overlap < 1:
+        build_parser().error('--overlap must be in [0, 1)')
+
+    from model_registry import DEFAULT_MODEL_PATH, get_model
+    model = get_model(args.model or DEFAULT_MODEL_PATH, warm_up=True)
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+
+    classified = 0
+    for path in iter_image_paths(args.inputs):
+        start = time.perf_counter()
+        with open(path, 'rb') as image_file:
+            image = decode_for_tiling(image_file.read(), args.max_side)
+        if image is None:
+            print(f"{path}: could not decode image", file=sys.stderr)
+            continue
+        grid = tile_grid(image, model, args.overlap, min_plant=args.min_plant)
+        probabilities, votes = tile_summary(grid)
+        best = int(probabilities.argmax())
+        classified += 1
+        print(f"{path}: {model.labels[best]} ({probabilities[best]:.1%}), {votes.sum()} of {grid[..., 0].size} "
+              f"tiles classified, {votes[best]} voted for it, {time.perf_counter() - start:.2f} s")
+        if args.heatmaps:
+            overlay = heatmap(image, grid, model.input_size, best, args.overlap)
+            name = os.path.splitext(os.path.basename(path))[0] + '_heatmap.png'
+            cv2.imwrite(os.path.join(args.heatmaps, name), overlay)
+    return 0 if classified else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
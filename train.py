@@ -0,0 +1,330 @@
+# Unattended training run: config in, deployable model out
+#
+#   python train.py --config train_config.json
+#   python train.py --config train_config.json --set dataset=.cache/shards --set epochs=5
+#   python train.py --print-config
+#
+# Every hyperparameter comes from the config (train_config.json; --set
+# overrides single keys, values parsed as JSON). A run is reproducible from
+# its config: the seed fixes the splits, the shuffling and the initial
+# weights, and "deterministic" makes TensorFlow's kernels deterministic too.
+#
+# Training can be interrupted at any point: the state after the last complete
+# epoch is backed up under checkpoint_dir, and running the same command again
+# resumes from there. Training stops early once validation accuracy has not
+# improved for early_stopping_patience epochs, keeping the best weights.
+#
+# The result goes straight into output_dir (artifacts/ by default):
+#
+#   <model_name>.h5                Keras model; point BHOOMI_MODEL at it
+#   <model_name>_int8.tflite       any export_formats (fp16, int8, onnx), as export_model.py
+#   <model_name>.history.csv       per-epoch metrics
+#   <model_name>.training.json     config, class names, test accuracy, timings
+#   <artifact stem>.model.json     labels and preprocessing of each model (see model_manifest.py)
+#
+# task "crop" trains the crop identifier of two-stage inference (see
+# hierarchical.py) on images downscaled to crop_input_size, with one output
+# per crop; "crops" limits either task to some crops, e.g. a per-crop
+# disease head with "crops": ["Tomato"] and a narrower "width".
+#
+# mixed_precision "auto" trains in bfloat16 only on CPUs with native bfloat16
+# support (AVX512-BF16 / AMX), where it is faster; elsewhere emulating it is
+# slower than float32. Exported models are always float32.
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from dataset import (DEFAULT_SEED, DEFAULT_TEST_FRACTION, DEFAULT_VAL_FRACTION, INPUT_SHAPE, SPLITS,
+                     ShardedDataset, is_shard_dir, list_dataset, load_example, split_dataset)
+
+DEFAULT_CONFIG = {
+    'dataset': 'Dataset',
+    'output_dir': 'artifacts',
+    'model_name': 'plant_disease_model',
+    'task': 'disease',
+    'crops': None,
+    'width': 1.0,
+    'crop_input_size': [64, 64],
+    'seed': DEFAULT_SEED,
+    'deterministic': True,
+    'epochs': 50,
+    'batch_size': 128,
+    'learning_rate': 0.0001,
+    'val_fraction': DEFAULT_VAL_FRACTION,
+    'test_fraction': DEFAULT_TEST_FRACTION,
+    'mixed_precision': 'auto',
+    'workers': 'auto',
+    'cache': None,
+    'shuffle_buffer': 256,
+    'early_stopping_patience': 5,
+    'checkpoint_dir': os.path.join('.cache', 'checkpoints'),
+    'export_formats': ['int8'],
+    'calibration_samples': 200,
+}
+
+EXPORT_FORMATS = ('fp16', 'int8', 'onnx')
+
+TASKS = ('disease', 'crop')
+
+
+class TrainConfigError(ValueError):
+    pass
+
+
+def load_config(path=None, overrides=()):
+    """DEFAULT_CONFIG updated from a JSON file and KEY=VALUE overrides."""
+    config = dict(DEFAULT_CONFIG)
+    updates = {}
+    if path:
+        try:
+            with open(path, encoding='utf-8') as config_file:
+                updates.update(json.load(config_file))
+        except (OSError, ValueError) as e:
+            raise TrainConfigError(f"cannot read config {path}: {e}") from e
+    for override in overrides:
+        key, separator, value = override.partition('=')
+        if not separator:
+            raise TrainConfigError(f"override {override!r} is not KEY=VALUE")
+        try:
+            updates[key] = json.loads(value)
+        except ValueError:
+            # Bare strings such as paths need no quotes
+            updates[key] = value
+    unknown = set(updates) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise TrainConfigError(f"unknown config key(s): {', '.join(sorted(unknown))}")
+    config.update(updates)
+    bad_formats = set(config['export_formats']) - set(EXPORT_FORMATS)
+    if bad_formats:
+        raise TrainConfigError(f"unknown export format(s): {', '.join(sorted(bad_formats))}")
+    if config['task'] not in TASKS:
+        raise TrainConfigError(f"task must be one of {', '.join(TASKS)}")
+    return config
+
+
+def select_classes(class_names, task='disease', crops=None):
+    """The model's output labels and a map from dataset class index to output index (-1: left out).
+
+    A disease model keeps the classes of ``crops`` (all if None); a crop
+    model has one output per crop.
+    """
+    import numpy as np
+
+    kept = [index for index, name in enumerate(class_names) if not crops or name.split('-')[0] in crops]
+    if not kept:
+        raise TrainConfigError(f"no classes of crops {crops} in the dataset")
+    if task == 'crop':
+        labels = list(dict.fromkeys(class_names[index].split('-')[0] for index in kept))
+        targets = {index: labels.index(class_names[index].split('-')[0]) for index in kept}
+    else:
+        labels = [class_names[index] for index in kept]
+        targets = {index: output for output, index in enumerate(kept)}
+    if len(labels) < 2:
+        raise TrainConfigError(f"a {task} model needs at least two outputs, got {labels}")
+    return labels, np.array([targets.get(index, -1) for index in range(len(class_names))], np.int32)
+
+
+def input_size(config):
+    """(width, height) the model takes."""
+    if config['task'] == 'crop':
+        return tuple(config['crop_input_size'])
+    return (INPUT_SHAPE[1], INPUT_SHAPE[0])
+
+
+def build(config, num_classes):
+    from training import build_crop_model, build_model
+
+    if config['task'] == 'crop':
+        return build_crop_model(num_classes, input_size(config), config['learning_rate'])
+    return build_model(num_classes, config['learning_rate'], config['width'])
+
+
+def cpu_supports_bfloat16():
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            flags = cpuinfo.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def mixed_precision_enabled(setting):
+    if setting == 'auto':
+        return cpu_supports_bfloat16()
+    return bool(setting)
+
+
+def load_datasets(config):
+    """Output labels, {split: tf.data.Dataset or None} and a few uint8 training images for calibration."""
+    import numpy as np
+    import tensorflow as tf
+    from inference import preprocess
+    from training import make_dataset, make_shard_dataset
+
+    workers = tf.data.AUTOTUNE if config['workers'] == 'auto' else int(config['workers'])
+    fractions = {'val_fraction': config['val_fraction'], 'test_fraction': config['test_fraction']}
+    samples = config['calibration_samples']
+    size = input_size(config)
+    image_size = None if size == (INPUT_SHAPE[1], INPUT_SHAPE[0]) else size
+    datasets = {}
+    if is_shard_dir(config['dataset']):
+        shards = ShardedDataset(config['dataset'])
+        labels, label_map = select_classes(shards.class_names, config['task'], config['crops'])
+        splits = shards.split_indices(config['seed'], **fractions)
+        splits = {split: indices[label_map[shards.labels[indices]] >= 0] for split, indices in splits.items()}
+        for split in SPLITS:
+            datasets[split] = make_shard_dataset(
+                shards, splits[split], config['batch_size'], split == 'train', config['seed'], workers,
+                label_map, image_size,
+            ) if len(splits[split]) else None
+        calibration = list(shards.take(splits['train'][:samples]))
+    else:
+        class_names, examples = list_dataset(config['dataset'])
+        labels, label_map = select_classes(class_names, config['task'], config['crops'])
+        examples = [(path, int(label_map[label])) for path, label in examples if label_map[label] >= 0]
+        splits = split_dataset(config['dataset'], examples, config['seed'], **fractions)
+        for split in SPLITS:
+            cache = f"{config['cache']}_{split}" if config['cache'] else None
+            datasets[split] = make_dataset(
+                splits[split], len(labels), config['batch_size'], split == 'train', config['seed'],
+                cache, config['shuffle_buffer'], workers, image_size,
+            ) if splits[split] else None
+        calibration = [image for image in (load_example(path) for path, _ in splits['train'][:samples])
+                       if image is not None]
+    if image_size is not None:
+        calibration = [preprocess(image, image_size) for image in calibration]
+    sizes = {split: len(splits[split]) for split in SPLITS}
+    return labels, datasets, np.asarray(calibration), sizes
+
+
+def callbacks(run_dir, history_path, has_validation, patience):
+    import keras
+
+    monitor = 'val_accuracy' if has_validation else 'accuracy'
+    return [
+        # Restores weights, optimizer state and epoch after an interruption
+        keras.callbacks.BackupAndRestore(os.path.join(run_dir, 'backup')),
+        keras.callbacks.ModelCheckpoint(os.path.join(run_dir, 'best.weights.h5'), monitor=monitor,
+                                        mode='max', save_best_only=True, save_weights_only=True),
+        keras.callbacks.EarlyStopping(monitor=monitor, mode='max', restore_best_weights=True,
+                                      patience=patience),
+        keras.callbacks.CSVLogger(history_path, append=True),
+    ]
+
+
+def export(model, class_names, config, calibration, mixed_precision, log=None):
+    """Write the float32 Keras model and the configured exports with their bindings; returns their paths."""
+    import keras
+    from export_model import export_onnx, export_tflite
+    from model_manifest import ModelSpec, write_binding
+
+    if mixed_precision:
+        # Same weights in a float32 graph, so serving never runs emulated bfloat16
+        keras.mixed_precision.set_global_policy('float32')
+        weights = model.get_weights()
+        model = build(config, len(class_names))
+        model.set_weights(weights)
+    stem = os.path.join(config['output_dir'], config['model_name'])
+    paths = [f'{stem}.h5']
+    model.save(paths[0])
+    for fmt in config['export_formats']:
+        if fmt == 'onnx':
+            paths.append(f'{stem}.onnx')
+            export_onnx(model, paths[-1])
+        else:
+            paths.append(f'{stem}_{fmt}.tflite')
+            export_tflite(model, paths[-1], fmt, calibration if fmt == 'int8' else ())
+        if log:
+            print(f"Wrote {paths[-1]}", file=log)
+    # Pixel scaling is the model's first layer, so the binding divides by 1
+    spec = ModelSpec(config['model_name'], paths[0], class_names, input_size(config), kind=config['task'])
+    for path in paths:
+        write_binding(spec, path)
+    return paths
+
+
+def train(config, log=sys.stderr):
+    """Run one training job as configured; returns the report written next to the model."""
+    import keras
+    import tensorflow as tf
+
+    keras.utils.set_random_seed(config['seed'])
+    if config['deterministic']:
+        tf.config.experimental.enable_op_determinism()
+    mixed_precision = mixed_precision_enabled(config['mixed_precision'])
+    keras.mixed_precision.set_global_policy('mixed_bfloat16' if mixed_precision else 'float32')
+
+    class_names, datasets, calibration, sizes = load_datasets(config)
+    if datasets['train'] is None:
+        raise ValueError(f"no training images in {config['dataset']}")
+    print(f"{config['task'].capitalize()} classes: {', '.join(class_names)}", file=log)
+    print(', '.join(f"{split}: {sizes[split]}" for split in SPLITS)
+          + f"; mixed precision {'on' if mixed_precision else 'off'}", file=log)
+
+    os.makedirs(config['output_dir'], exist_ok=True)
+    run_dir = os.path.join(config['checkpoint_dir'], config['model_name'])
+    history_path = os.path.join(config['output_dir'], f"{config['model_name']}.history.csv")
+    if not os.path.isdir(os.path.join(run_dir, 'backup')) and os.path.exists(history_path):
+        # A fresh run, not a resumed one: start a new history
+        os.remove(history_path)
+    model = build(config, len(class_names))
+    start = time.perf_counter()
+    model.fit(datasets['train'], epochs=config['epochs'], validation_data=datasets['val'],
+              callbacks=callbacks(run_dir, history_path, datasets['val'] is not None,
+                                  config['early_stopping_patience']),
+              verbose=2)
+    train_seconds = time.perf_counter() - start
+    # The CSV spans every epoch, including those before a resume
+    with open(history_path, newline='') as history_file:
+        history = list(csv.DictReader(history_file))
+
+    report = {
+        'model_name': config['model_name'],
+        'class_names': class_names,
+        'config': config,
+        'split_sizes': sizes,
+        'mixed_precision': mixed_precision,
+        'epochs_run': len(history),
+        'train_seconds': train_seconds,
+        'best_val_accuracy': (max(float(row['val_accuracy']) for row in history)
+                              if datasets['val'] is not None else None),
+        'test_accuracy': None,
+    }
+    if datasets['test'] is not None:
+        report['test_accuracy'] = float(model.evaluate(datasets['test'], verbose=0)[1])
+        print(f"Test Accuracy: {report['test_accuracy'] * 100:.2f}", file=log)
+    report['artifacts'] = export(model, class_names, config, calibration, mixed_precision, log)
+    with open(os.path.join(config['output_dir'], f"{config['model_name']}.training.json"), 'w') as output:
+        json.dump(report, output, indent=2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the disease classifier and export it.')
+    parser.add_argument('--config', help='JSON config file (missing keys take the defaults)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override one config key; VALUE is parsed as JSON (repeatable)')
+    parser.add_argument('--print-config', action='store_true', help='print the effective config and exit')
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config, args.set)
+    except TrainConfigError as e:
+        parser.error(str(e))
+    if args.print_config:
+        print(json.dumps(config, indent=2))
+        return 0
+    try:
+        report = train(config)
+    except TrainConfigError as e:
+        parser.error(str(e))
+    print(f"Done after {report['epochs_run']} epochs in {report['train_seconds']:.0f} s: "
+          f"{', '.join(report['artifacts'])}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
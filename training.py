@@ -0,0 +1,187 @@
+# Streaming training pipeline for the disease classifier (driven by train.py)
+#
+# The dataset is one directory per class (e.g. Corn___Common_rust/,
+# Potato___Early_blight/, Tomato___Bacterial_spot/), as in the notebook.
+# Instead of reading every image into a Python list, only the file paths are
+# held in memory: tf.data decodes and resizes the files in parallel with the
+# same decode_image()/preprocess() the app uses, and batches are shuffled and
+# prefetched on the fly, so peak memory depends on the batch and shuffle
+# buffer sizes, not on the number of images.
+#
+# Pixel scaling (inference.PIXEL_SCALE, 1/255; the notebook divided by 225)
+# is the model's first layer, so a trained model takes exactly what
+# preprocess() returns, in training and in serving alike.
+#
+# Each file's split is decided by a hash of its path, so adding images to the
+# dataset never moves existing ones between train, validation and test.
+#
+# The dataset may also be a shard directory built by `python dataset.py
+# build`; batches are then read from the memory-mapped shards and no JPEG is
+# decoded during training.
+#
+# Models with a smaller input (the crop identifier of two-stage inference,
+# see hierarchical.py) get their batches resized on the fly.
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from dataset import INPUT_SHAPE, load_example
+from inference import PIXEL_SCALE
+
+
+def _resized(images, image_size):
+    """uint8 batches resized to (width, height), as preprocess() would for serving."""
+    resized = tf.image.resize(images, (image_size[1], image_size[0]))
+    return tf.cast(tf.clip_by_value(tf.round(resized), 0, 255), tf.uint8)
+
+
+def _load(path):
+    image = load_example(path.decode('utf-8'))
+    if image is None:
+        return np.zeros(INPUT_SHAPE, np.uint8), False
+    return image, True
+
+
+def make_dataset(examples, num_classes, batch_size=32, training=False, seed=0, cache=None,
+                 shuffle_buffer=256, num_parallel_calls=tf.data.AUTOTUNE, image_size=None):
+    """Batched (uint8 images, one-hot labels) dataset over (path, label) pairs.
+
+    Only paths live in memory; images are decoded ``num_parallel_calls`` at a
+    time. ``cache`` is a file prefix for keeping decoded images on disk after
+    the first epoch (tf.data cache files; memory caching would defeat the
+    point). Unreadable images are skipped. Training datasets are reshuffled
+    every epoch; the order is reproducible for a given ``seed``. ``image_size``
+    (width, height) resizes the batches for models with a smaller input.
+    """
+    if not examples:
+        raise ValueError("no examples")
+    paths = [path for path, _ in examples]
+    labels = [label for _, label in examples]
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training and not cache:
+        # Shuffling paths is free, so shuffle all of them
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+
+    def load(path, label):
+        image, ok = tf.numpy_function(_load, [path], (tf.uint8, tf.bool))
+        image.set_shape(INPUT_SHAPE)
+        ok.set_shape(())
+        return image, label, ok
+
+    dataset = dataset.map(load, num_parallel_calls=num_parallel_calls, deterministic=True)
+    dataset = dataset.filter(lambda image, label, ok: ok)
+    dataset = dataset.map(lambda image, label, ok: (image, tf.one_hot(label, num_classes)))
+    if cache:
+        if os.path.dirname(cache):
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+        dataset = dataset.cache(cache)
+        if training:
+            # Decoded images cost ~200 KB each, so only a bounded buffer
+            dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    if image_size is not None:
+        dataset = dataset.map(lambda images, labels: (_resized(images, image_size), labels))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def make_shard_dataset(shards, indices, batch_size=32, training=False, seed=0,
+                       num_parallel_calls=tf.data.AUTOTUNE, label_map=None, image_size=None):
+    """Like make_dataset, reading rows ``indices`` of a ShardedDataset.
+
+    ``label_map`` maps the shards' class indices to the model's outputs.
+    """
+    if not len(indices):
+        raise ValueError("no examples")
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype=np.int64))
+    if training:
+        dataset = dataset.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+
+    labels_of = shards.labels if label_map is None else np.asarray(label_map, np.int32)[shards.labels]
+    num_classes = len(shards.class_names) if label_map is None else int(np.max(label_map)) + 1
+
+    def gather(rows):
+        images, labels = tf.numpy_function(lambda rows: (shards.take(rows), labels_of[rows]),
+                                           [rows], (tf.uint8, tf.int32))
+        images.set_shape((None,) + INPUT_SHAPE)
+        labels.set_shape((None,))
+        if image_size is not None:
+            images = _resized(images, image_size)
+        return images, tf.one_hot(labels, num_classes)
+
+    # Gathering whole batches keeps the reads within a shard sequential
+    dataset = dataset.batch(batch_size).map(gather, num_parallel_calls=num_parallel_calls)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_model(num_classes, learning_rate=0.0001, width=1.0):
+    """The notebook's CNN, taking uint8 preprocess() output directly.
+
+    ``width`` scales the number of convolution filters, e.g. 0.5 for a
+    per-crop disease head that only separates a few classes.
+    """
+    from keras import Input, Sequential
+    from keras.layers import Conv2D, Dense, Flatten, MaxPooling2D, Rescaling
+    from keras.optimizers import Adam
+
+    model = Sequential([
+        Input(shape=INPUT_SHAPE),
+        Rescaling(PIXEL_SCALE),
+        Conv2D(max(round(32 * width), 1), (3, 3), padding="same", activation="relu"),
+        MaxPooling2D(pool_size=(3, 3)),
+        Conv2D(max(round(16 * width), 1), (3, 3), padding="same", activation="relu"),
+        MaxPooling2D(pool_size=(2, 2)),
+        Flatten(),
+        Dense(8, activation="relu"),
+        # float32 output keeps the softmax stable under a mixed precision policy
+        Dense(num_classes, activation="softmax", dtype="float32"),
+    ])
+    model.compile(loss='categorical_crossentropy', optimizer=Adam(learning_rate), metrics=['accuracy'])
+    return model
+
+
+def build_gap_model(num_classes, learning_rate=0.001, width=1.0, pixel_scale=PIXEL_SCALE):
+    """The notebook's convolutions with global average pooling in place of Flatten -> Dense(8).
+
+    The Dense(8) layer holds almost all of the notebook model's parameters;
+    this keeps about 2% of them. ``pixel_scale`` lets compress.py copy the
+    convolutions of a model trained on other pixel scaling (the notebook
+    divided by 225).
+    """
+    from keras import Input, Sequential
+    from keras.layers import Conv2D, Dense, GlobalAveragePooling2D, MaxPooling2D, Rescaling
+    from keras.optimizers import Adam
+
+    model = Sequential([
+        Input(shape=INPUT_SHAPE),
+        Rescaling(pixel_scale),
+        Conv2D(max(round(32 * width), 1), (3, 3), padding="same", activation="relu"),
+        MaxPooling2D(pool_size=(3, 3)),
+        Conv2D(max(round(16 * width), 1), (3, 3), padding="same", activation="relu"),
+        MaxPooling2D(pool_size=(2, 2)),
+        GlobalAveragePooling2D(),
+        Dense(num_classes, activation="softmax", dtype="float32"),
+    ])
+    model.compile(loss='categorical_crossentropy', optimizer=Adam(learning_rate), metrics=['accuracy'])
+    return model
+
+
+def build_crop_model(num_crops, input_size=(64, 64), learning_rate=0.001):
+    """Tiny crop identifier for two-stage inference, taking uint8 images of ``input_size`` (width, height)."""
+    from keras import Input, Sequential
+    from keras.layers import Conv2D, Dense, GlobalAveragePooling2D, MaxPooling2D, Rescaling
+    from keras.optimizers import Adam
+
+    model = Sequential([
+        Input(shape=(input_size[1], input_size[0], 3)),
+        Rescaling(PIXEL_SCALE),
+        Conv2D(8, (3, 3), padding="same", activation="relu"),
+        MaxPooling2D(pool_size=(2, 2)),
+        Conv2D(16, (3, 3), padding="same", activation="relu"),
+        MaxPooling2D(pool_size=(2, 2)),
+        Conv2D(32, (3, 3), padding="same", activation="relu"),
+        GlobalAveragePooling2D(),
+        Dense(num_crops, activation="softmax", dtype="float32"),
+    ])
+    model.compile(loss='categorical_crossentropy', optimizer=Adam(learning_rate), metrics=['accuracy'])
+    return model
@@ -0,0 +1,183 @@
+# Multi-image uploads for the app: zip archives, parallel decode, one batched predict
+#
+# The app accepts several photos at once (JPEG, PNG, WEBP) or zip archives of
+# them. expand_uploads() turns the uploaded files into (name, bytes) pairs,
+# and classify_uploads() decodes and resizes every image that is not in the
+# prediction cache on a thread pool (cv2.imdecode and cv2.resize release the
+# GIL), then classifies them all with a single predict call. Each result also
+# carries a small JPEG thumbnail for the results grid.
+#
+# downscale_jpeg() is what serve.py's upload page does in the browser before
+# sending a photo, and what the app shows instead of echoing the original
+# upload: the long side cut to CLIENT_MAX_SIDE (still twice the model input)
+# and JPEG at CLIENT_JPEG_QUALITY, which takes a 12-megapixel phone photo from
+# megabytes to tens of kilobytes.
+import base64
+import functools
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from inference import IMAGE_EXTENSIONS, decode_image, jpeg_size, predict_batch, preprocess
+
+UPLOAD_TYPES = ['jpg', 'jpeg', 'png', 'webp', 'zip']
+
+MAX_UPLOAD_IMAGES = int(os.getenv('BHOOMI_MAX_UPLOAD_IMAGES', '64'))
+
+# Largest image accepted from inside a zip, uncompressed (as serve.py's MAX_BODY_BYTES)
+MAX_IMAGE_BYTES = 20 * 2 ** 20
+
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+
+THUMBNAIL_SIZE = 96
+
+CLIENT_MAX_SIDE = 512
+CLIENT_JPEG_QUALITY = 85
+
+
+def is_archive(name):
+    return name.lower().endswith('.zip')
+
+
+def expand_uploads(files, max_images=MAX_UPLOAD_IMAGES):
+    """Images in ``files`` ((name, bytes) pairs), with zip archives expanded.
+
+    Returns (images, skipped): (name, bytes) of every image to classify, and
+    (name, reason) for everything left out. Images in an archive are named
+    '<archive>/<path inside it>'.
+    """
+    images, skipped = [], []
+
+    def add(name, read):
+        if len(images) >= max_images:
+            skipped.append((name, f'over the {max_images}-image limit'))
+        else:
+            images.append((name, read()))
+
+    for name, data in files:
+        if not is_archive(name):
+            add(name, lambda: data)
+            continue
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    member = info.filename
+                    # Folders and the resource forks and dotfiles of macOS archives
+                    if (info.is_dir() or member.startswith('__MACOSX/')
+                            or os.path.basename(member).startswith('.')):
+                        continue
+                    label = f'{name}/{member}'
+                    if not member.lower().endswith(IMAGE_EXTENSIONS):
+                        skipped.append((label, 'not an image'))
+                    elif info.file_size > MAX_IMAGE_BYTES:
+                        skipped.append((label, f'larger than {MAX_IMAGE_BYTES // 2 ** 20} MiB'))
+                    else:
+                        add(label, lambda: archive.read(info))
+        except zipfile.BadZipFile:
+            skipped.append((name, 'not a valid zip archive'))
+    return images, skipped
+
+
+def thumbnail_uri(image):
+    """Small JPEG data URI of a BGR image, for st.column_config.ImageColumn."""
+    thumbnail = cv2.resize(image, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return 'data:image/jpeg;base64,' + base64.b64encode(encoded.tobytes()).decode('ascii')
+
+
+def downscale_jpeg(data, max_side=CLIENT_MAX_SIDE, quality=CLIENT_JPEG_QUALITY):
+    """JPEG bytes of an image with its long side at most ``max_side`` (None if undecodable).
+
+    Images that are already small enough are returned as they are. Large
+    JPEGs are decoded at a libjpeg reduction that still leaves ``max_side``.
+    """
+    reduce = 1
+    size = jpeg_size(data)
+    if size is not None:
+        for factor in (8, 4, 2):
+            if max(size) // factor >= max_side:
+                reduce = factor
+                break
+    image = decode_image(data, reduce)
+    if image is None:
+        return None
+    if reduce == 1 and max(image.shape[:2]) <= max_side:
+        return data
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def _load(data, for_model, size):
+    """(model input or None, thumbnail URI or None) of one upload.
+
+    Images already in the prediction cache only need a thumbnail, which a
+    1/8-scale decode provides.
+    """
+    if not for_model:
+        image = decode_image(data, reduce=8)
+        return None, None if image is None else thumbnail_uri(image)
+    image = decode_image(data)
+    if image is None:
+        return None, None
+    model_input = preprocess(image, size)
+    return model_input, thumbnail_uri(model_input)
+
+
+def classify_uploads(images, spec, cache=None, classifier=None, workers=DECODE_WORKERS):
+    """Classify (name, bytes) pairs; one result dict per image, in order.
+
+    Results have name, label, confidence, unknown (below ``spec``'s
+    min_confidence), thumbnail and error. Identical files are classified
+    once, cached predictions are reused and new ones stored. With a
+    two-stage ``classifier`` (hierarchical.py) it classifies the images
+    instead of ``spec``'s model, without the cache.
+    """
+    first = {}
+    for index, (_, data) in enumerate(images):
+        first.setdefault(data, index)
+    distinct = sorted(set(first.values()))
+    results = dict(zip(distinct, _classify([images[index] for index in distinct], spec, cache, classifier,
+                                            workers)))
+    return [dict(results[first[data]], name=name) for name, data in images]
+
+
+def _classify(images, spec, cache, classifier, workers):
+    results = [{'name': name, 'label': None, 'confidence': None, 'unknown': None, 'thumbnail': None,
+                'error': None} for name, _ in images]
+    probabilities = [None] * len(images)
+    if cache is not None and classifier is None:
+        probabilities = [cache.get(data) for _, data in images]
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        loaded = list(pool.map(functools.partial(_load, size=spec.input_size), [data for _, data in images],
+                               [probs is None for probs in probabilities]))
+    for result, probs, (model_input, thumbnail) in zip(results, probabilities, loaded):
+        result['thumbnail'] = thumbnail
+        if probs is None and model_input is None:
+            result['error'] = 'could not decode image'
+
+    pending = [index for index, (model_input, _) in enumerate(loaded) if model_input is not None]
+    if pending and classifier is not None:
+        for index, outcome in zip(pending, classifier.predict([loaded[index][0] for index in pending])):
+            results[index].update(label=outcome['label'], confidence=outcome['confidence'])
+    elif pending:
+        from model_registry import get_model
+
+        model = get_model(spec.path, warm_up=True)
+        for index, probs in zip(pending, predict_batch(model, [loaded[index][0] for index in pending])):
+            probabilities[index] = probs
+            if cache is not None:
+                cache.put(images[index][1], probs)
+    for result, probs in zip(results, probabilities):
+        if probs is not None:
+            best = int(probs.argmax())
+            result.update(label=spec.labels[best], confidence=float(probs[best]))
+    for result in results:
+        if result['confidence'] is not None:
+            result['unknown'] = not spec.is_confident(result['confidence'])
+    return results